@@ -0,0 +1,218 @@
+"""
+Controle de admissão das chamadas aos provedores de rota (cota da Directions API).
+
+Cada rota que não está no cache custa uma chamada à Directions API. Um cliente com defeito
+num laço (destino trocando a cada envio, desvio de rota a cada localização) pode gastar a
+cota do dia inteira e deixar todos sem navegação. Antes de cada chamada ao provedor,
+`AdmissionController.admit` verifica, nesta ordem:
+
+- o balde de fichas da sessão (DIRECTIONS_SESSION_RATE_PER_MINUTE, DIRECTIONS_SESSION_BURST)
+  ou, para pedidos sem sessão (início de navegação), o do endereço do cliente
+  (DIRECTIONS_CLIENT_RATE_PER_MINUTE, DIRECTIONS_CLIENT_BURST), mais folgado porque vários
+  usuários podem compartilhar um IP;
+- o balde de fichas global do worker (DIRECTIONS_GLOBAL_RATE_PER_SECOND, DIRECTIONS_GLOBAL_BURST);
+- a cota diária (DIRECTIONS_DAILY_BUDGET), que recomeça à meia-noite no fuso da cota do Google.
+  A última fração da cota (DIRECTIONS_BUDGET_RESERVE) fica para quem ainda não tem rota:
+  recálculos por desvio deixam de ser admitidos antes.
+
+Pré-cálculos de rotas alternativas (reroute_prefetch.py, `prefetch=True`) têm orçamento próprio
+por rota e não gastam as fichas da sessão; só são admitidos com pelo menos
+DIRECTIONS_PREFETCH_HEADROOM do balde global disponível e, como os recálculos, fora da reserva.
+
+As fichas só são gastas se todos os limites admitirem a chamada. Cada chamador é admitido antes
+de entrar no agrupamento de pedidos idênticos (singleflight.py), então a recusa de um não é
+entregue aos outros; quem aguarda uma chamada já em andamento só gasta as fichas da própria
+sessão (ou do cliente), não as do balde global nem a cota. Acertos do cache de rotas não passam
+por aqui, e as atualizações em segundo plano de rotas vencidas do cache só passam pelo limite
+global e pela cota, fora da reserva. Quando a chamada é recusada, main.py degrada em vez de
+falhar: serve a rota do cache mesmo vencida; sem cache, mantém o acompanhamento local da rota
+atual da sessão; sem sessão, responde com um aviso falado de quando tentar de novo.
+
+Os limites valem por processo: com vários workers, divida os valores pelo número de workers.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DIRECTIONS_SESSION_RATE_PER_MINUTE = float(os.getenv("DIRECTIONS_SESSION_RATE_PER_MINUTE", "6")) # Rotas por minuto por sessão
+DIRECTIONS_SESSION_BURST = float(os.getenv("DIRECTIONS_SESSION_BURST", "3")) # Rotas seguidas permitidas a uma sessão
+DIRECTIONS_CLIENT_RATE_PER_MINUTE = float(os.getenv("DIRECTIONS_CLIENT_RATE_PER_MINUTE", "30")) # Navegações novas por minuto por IP; 0 desativa
+DIRECTIONS_CLIENT_BURST = float(os.getenv("DIRECTIONS_CLIENT_BURST", "10"))
+DIRECTIONS_GLOBAL_RATE_PER_SECOND = float(os.getenv("DIRECTIONS_GLOBAL_RATE_PER_SECOND", "50")) # 0 desativa o limite global
+DIRECTIONS_GLOBAL_BURST = float(os.getenv("DIRECTIONS_GLOBAL_BURST", "100"))
+DIRECTIONS_DAILY_BUDGET = int(os.getenv("DIRECTIONS_DAILY_BUDGET", "25000")) # Chamadas por dia; 0 desativa
+DIRECTIONS_BUDGET_RESERVE = float(os.getenv("DIRECTIONS_BUDGET_RESERVE", "0.1")) # Fração final da cota só para rotas novas
+DIRECTIONS_BUDGET_UTC_OFFSET_HOURS = float(os.getenv("DIRECTIONS_BUDGET_UTC_OFFSET_HOURS", "-8")) # A cota do Google vira no horário do Pacífico
+DIRECTIONS_PREFETCH_HEADROOM = float(os.getenv("DIRECTIONS_PREFETCH_HEADROOM", "0.5")) # Fração do balde global livre para pré-calcular
+ADMISSION_MAX_SESSIONS = int(os.getenv("ADMISSION_MAX_SESSIONS", "10000")) # Baldes de sessão e de cliente em memória (LRU)
+
+ALLOWED = "allowed"
+SESSION_RATE = "session_rate"
+CLIENT_RATE = "client_rate"
+GLOBAL_RATE = "global_rate"
+DAILY_BUDGET = "daily_budget"
+BUDGET_RESERVE = "budget_reserve"
+PREFETCH_HEADROOM = "prefetch_headroom"
+
+
+class AdmissionDenied(Exception):
+    """Chamada ao provedor recusada pelo controle de admissão."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason} (tente novamente em {retry_after:.0f} s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` fichas por segundo, até `capacity` acumuladas."""
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """Segundos até haver uma ficha (após `refill`)."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class DailyBudget:
+    """Chamadas feitas no dia corrente da cota (o dia vira à meia-noite em UTC + offset)."""
+
+    def __init__(self, limit: int, utc_offset_hours: float = DIRECTIONS_BUDGET_UTC_OFFSET_HOURS):
+        self.limit = limit
+        self.offset = utc_offset_hours * 3600
+        self.day = None
+        self.used = 0
+
+    def roll(self, now: float):
+        day = int((now + self.offset) // 86400)
+        if day != self.day:
+            self.day = day
+            self.used = 0
+
+    def remaining(self) -> Optional[int]:
+        return max(self.limit - self.used, 0) if self.limit > 0 else None
+
+    def seconds_until_reset(self, now: float) -> float:
+        return 86400 - (now + self.offset) % 86400
+
+
+class AdmissionController:
+    """
+    Baldes por sessão (ou cliente) e global mais a cota diária. `clock` mede os intervalos dos baldes e
+    `wall_clock` dá o dia da cota; os dois podem ser substituídos por relógios falsos.
+    """
+
+    def __init__(self, session_rate_per_minute: float = DIRECTIONS_SESSION_RATE_PER_MINUTE,
+                 session_burst: float = DIRECTIONS_SESSION_BURST,
+                 client_rate_per_minute: float = DIRECTIONS_CLIENT_RATE_PER_MINUTE,
+                 client_burst: float = DIRECTIONS_CLIENT_BURST,
+                 global_rate_per_second: float = DIRECTIONS_GLOBAL_RATE_PER_SECOND,
+                 global_burst: float = DIRECTIONS_GLOBAL_BURST,
+                 daily_budget: int = DIRECTIONS_DAILY_BUDGET, reserve: float = DIRECTIONS_BUDGET_RESERVE,
+                 prefetch_headroom: float = DIRECTIONS_PREFETCH_HEADROOM, max_sessions: int = ADMISSION_MAX_SESSIONS,
+                 clock: Callable[[], float] = time.monotonic, wall_clock: Callable[[], float] = time.time):
+        self.session_rate = session_rate_per_minute / 60
+        self.session_burst = session_burst
+        self.client_rate = client_rate_per_minute / 60
+        self.client_burst = client_burst
+        self.prefetch_headroom = prefetch_headroom
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.global_bucket = TokenBucket(global_rate_per_second, global_burst, clock()) if global_rate_per_second > 0 else None
+        self.budget = DailyBudget(daily_budget)
+        self.reserve = int(daily_budget * reserve)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict() # "s:<sessão>" ou "c:<cliente>"
+        self.stats = {ALLOWED: 0, SESSION_RATE: 0, CLIENT_RATE: 0, GLOBAL_RATE: 0, DAILY_BUDGET: 0, BUDGET_RESERVE: 0,
+                      PREFETCH_HEADROOM: 0}
+
+    def admit(self, session_id: Optional[str] = None, client: Optional[str] = None, reroute: bool = False,
+              prefetch: bool = False, coalesced: bool = False):
+        """
+        Reserva uma chamada ao provedor ou levanta `AdmissionDenied` com o motivo e a espera sugerida.
+        Sem `session_id` (primeira rota de uma navegação) vale o balde do `client` (endereço IP), se informado.
+        `prefetch` marca um pré-cálculo em segundo plano (veja o início do módulo).
+        `coalesced` marca quem vai aguardar uma chamada idêntica já em andamento: o provedor não é
+        chamado de novo, então só o balde da sessão (ou do cliente) vale; o global e a cota, não.
+        """
+        now = self.clock()
+        reroute = reroute or prefetch
+        if prefetch:
+            bucket = reason = None
+        elif session_id:
+            bucket, reason = self._bucket(f"s:{session_id}", self.session_rate, self.session_burst, now), SESSION_RATE
+        elif client:
+            bucket, reason = self._bucket(f"c:{client}", self.client_rate, self.client_burst, now), CLIENT_RATE
+        else:
+            bucket = reason = None
+        if bucket is not None:
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                self._deny(reason, bucket.wait_time())
+        if coalesced:
+            if bucket is not None:
+                bucket.tokens -= 1
+            self.stats[ALLOWED] += 1
+            return
+        if self.global_bucket is not None:
+            self.global_bucket.refill(now)
+            if self.global_bucket.tokens < 1:
+                self._deny(GLOBAL_RATE, self.global_bucket.wait_time())
+            if prefetch and self.global_bucket.tokens < self.global_bucket.capacity * self.prefetch_headroom:
+                missing = self.global_bucket.capacity * self.prefetch_headroom - self.global_bucket.tokens
+                self._deny(PREFETCH_HEADROOM, missing / self.global_bucket.rate)
+        if self.budget.limit > 0:
+            wall_now = self.wall_clock()
+            self.budget.roll(wall_now)
+            remaining = self.budget.remaining()
+            if remaining <= 0:
+                self._deny(DAILY_BUDGET, self.budget.seconds_until_reset(wall_now))
+            if reroute and remaining <= self.reserve:
+                self._deny(BUDGET_RESERVE, self.budget.seconds_until_reset(wall_now))
+
+        if bucket is not None:
+            bucket.tokens -= 1
+        if self.global_bucket is not None:
+            self.global_bucket.tokens -= 1
+        self.budget.used += 1
+        self.stats[ALLOWED] += 1
+
+    def _deny(self, reason: str, retry_after: float):
+        self.stats[reason] += 1
+        raise AdmissionDenied(reason, retry_after)
+
+    def _bucket(self, key: str, rate: float, burst: float, now: float) -> Optional[TokenBucket]:
+        """Balde da sessão ou do cliente (None se o limite estiver desativado)."""
+        if rate <= 0:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            while len(self._buckets) >= self.max_sessions:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def snapshot(self) -> dict:
+        if self.budget.limit > 0:
+            self.budget.roll(self.wall_clock())
+        return {
+            **self.stats,
+            "budget_used": self.budget.used,
+            "budget_remaining": self.budget.remaining(),
+            "tracked_keys": len(self._buckets),
+        }
@@ -0,0 +1,241 @@
+"""
+Benchmark do controle de admissão (admission.py) com relógio falso e provedor de rotas falso.
+
+Simula, em tempo acelerado, usuários normais (uma atualização a cada 10 s, às vezes saindo da
+rota) e dois clientes com defeito em laço: um que sai da rota a cada envio mantendo a sessão
+e outro que perde a sessão e pede uma navegação nova a cada envio. As rotas em cache estão
+todas vencidas (TTL 0), então toda rota nova custaria uma chamada ao Google. Os relógios dos
+baldes e da cota diária são falsos: uma hora simulada roda em segundos.
+
+Roda o mesmo cenário sem limites e com os limites configurados e mostra, para cada janela,
+as chamadas ao Google e as respostas degradadas (rota vencida do cache, só acompanhamento,
+só aviso). Termina com código 1 se as chamadas passarem da cota diária ou se alguma
+atualização ficar sem resposta útil (nem instruções nem progresso).
+
+Antes, confere que a admissão é decidida por chamador: uma sessão sem fichas não derruba outra
+que pede a mesma rota ao mesmo tempo, e a atualização em segundo plano de uma rota vencida do
+cache não gasta as fichas da sessão.
+
+Uso:
+    python benchmarks/bench_admission.py --users 200 --minutes 60 --budget 4000 --runaway-rate 10
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+os.environ.setdefault("SHARE_SPOOL_PATH", "")
+os.environ.setdefault("TTS_ENGINE", "")
+os.environ.setdefault("USE_GEMINI_FOR_REFINEMENT", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import main
+from admission import AdmissionController, AdmissionDenied
+from metrics import DEGRADED_NAVIGATION
+from route_cache import InMemoryRouteCacheBackend, RouteCache
+from route_model import Route
+from stubs import DEGREES_PER_100M_LAT, StubMapsClient, install_stub
+
+ORIGIN = (-23.5505, -46.6333)
+UPDATE_INTERVAL = 10 # Segundos entre atualizações de um usuário normal (como o frontend)
+WALK_PER_UPDATE = 14 # Metros andados entre atualizações
+ROUTE_LENGTH = 600 # A rota do stub: 300 m para leste e 300 m para o norte
+DEGRADED_MODES = ("cached", "tracking", "status")
+
+
+class FakeClock:
+    """Relógio controlado pelo benchmark (segundos)."""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def offset(point, east: float, north: float):
+    """Ponto deslocado em metros."""
+    lat, lng = point
+    return (lat + north / 100 * DEGREES_PER_100M_LAT,
+            lng + east / 100 * DEGREES_PER_100M_LAT / math.cos(math.radians(lat)))
+
+
+class User:
+    """Usuário que segue a rota em "L" do stub, às vezes desviando (desvio = rota nova)."""
+
+    def __init__(self, rng: random.Random, kind: str, origins: list, client: str):
+        self.rng = rng
+        self.kind = kind
+        self.client = client
+        self.origins = origins
+        self.session_id = None
+        self.route_version = None
+        self.start()
+
+    def start(self):
+        self.session_id = self.route_version = None
+        self.route_origin = self.rng.choice(self.origins)
+        self.walked = 0.0
+
+    def position(self, deviation: float):
+        if self.kind == "loop": # Defeito 1: "sai da rota" a cada envio, sempre em células novas
+            self.route_origin = offset(self.route_origin, 0, -80)
+            return self.route_origin
+        if self.kind == "no-session": # Defeito 2: perde a sessão e pede uma navegação nova a cada envio
+            self.session_id = self.route_version = None
+            self.route_origin = offset(self.route_origin, 40, 0)
+            return self.route_origin
+        self.walked = min(self.walked + WALK_PER_UPDATE, ROUTE_LENGTH)
+        if self.session_id and self.rng.random() < deviation:
+            self.route_origin = offset(self.route_origin, min(self.walked, 300), max(self.walked - 300, 0) - 80)
+            self.walked = 0.0
+            return self.route_origin
+        return offset(self.route_origin, min(self.walked, 300), max(self.walked - 300, 0))
+
+    async def update(self, deviation: float) -> dict:
+        latitude, longitude = self.position(deviation)
+        location = main.LocationData(latitude=latitude, longitude=longitude, destination="Destino", session_id=self.session_id)
+        data = await main.update_navigation(location, f'"{self.route_version}"' if self.route_version else None,
+                                            client=self.client)
+        self.session_id = data.get("sessionId", self.session_id)
+        self.route_version = data.get("routeVersion", self.route_version)
+        progress = data.get("progress")
+        if progress is not None and progress.arrived:
+            self.start()
+        return data
+
+
+def degraded_counts() -> dict:
+    return {mode: sum(DEGRADED_NAVIGATION._values.get((mode, reason), 0) for reason in
+                      ("session_rate", "client_rate", "global_rate", "daily_budget", "budget_reserve")) for mode in DEGRADED_MODES}
+
+
+async def check_isolation():
+    """Admissão por chamador: pedidos agrupados e atualizações em segundo plano (veja o início do módulo)."""
+    install_stub(main, StubMapsClient(latency=0.05))
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+    main.admission = AdmissionController(session_rate_per_minute=1, session_burst=1, daily_budget=0)
+    main.admission.admit("abusive") # Gasta a única ficha da sessão
+
+    async def directions(session_id: str):
+        try:
+            return await main.get_google_directions(ORIGIN[0], ORIGIN[1], "Destino", session_id=session_id)
+        except AdmissionDenied as denied:
+            return denied
+
+    abusive, innocent = await asyncio.gather(directions("abusive"), directions("innocent"))
+    assert isinstance(abusive, AdmissionDenied), f"Sessão sem fichas admitida: {abusive}"
+    assert isinstance(innocent, Route), f"Sessão com fichas recusada junto com a outra: {innocent}"
+
+    main.route_cache.ttl_seconds = 0 # A rota vira vencida: servida do cache e atualizada em segundo plano
+    assert isinstance(await directions("abusive"), Route), "Rota vencida do cache não servida à sessão sem fichas"
+    await asyncio.sleep(0.2)
+    stats = main.route_cache.snapshot()
+    assert stats["refreshes"] == 1 and stats["refresh_errors"] == 0, f"Atualização em segundo plano falhou: {stats}"
+    print(f"Admissão por chamador: ok ({main.admission.snapshot()})")
+
+
+async def run_scenario(args, limited: bool) -> bool:
+    rng = random.Random(args.seed)
+    clock = FakeClock()
+    wall_start = 1.7e9 - (1.7e9 - 8 * 3600) % 86400 # Meia-noite no fuso da cota (UTC-8): começa um dia novo
+    if limited:
+        main.admission = AdmissionController(
+            session_rate_per_minute=args.session_rate, session_burst=args.session_burst,
+            client_rate_per_minute=args.client_rate, client_burst=args.client_burst,
+            global_rate_per_second=args.global_rate, global_burst=args.global_burst,
+            daily_budget=args.budget, clock=clock, wall_clock=lambda: wall_start + clock())
+    else:
+        main.admission = AdmissionController(0, 0, 0, 0, 0, 0, 0, clock=clock)
+    stub = StubMapsClient()
+    install_stub(main, stub)
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend(), ttl_seconds=0, stale_seconds=0) # Todo o cache está vencido
+    main.navigation_sessions = main.SessionStore()
+    main.reroute_prefetcher.budget = 0 # Só as rotas pedidas pelos usuários (o pré-cálculo tem benchmark próprio)
+
+    origins = [offset(ORIGIN, 500 * (i % 10), 500 * (i // 10)) for i in range(args.origins)]
+    users = [User(rng, "normal", origins, f"10.0.{index // 250}.{index % 250}") for index in range(args.users)]
+    runaways = [User(rng, "loop", origins, "10.9.0.1"), User(rng, "no-session", origins, "10.9.0.2")]
+    deviation = args.deviation / 60 * UPDATE_INTERVAL
+
+    print(f"\n{'COM' if limited else 'SEM'} controle de admissão"
+          + (f" (sessão {args.session_rate:g}/min, global {args.global_rate:g}/s, cota {args.budget}/dia)" if limited else ""))
+    print(f"{'minutos':>9} {'Google':>7} {'cache':>6} {'acomp.':>7} {'aviso':>6} | normais: {'ok':>6} {'degr.':>6} | "
+          f"com defeito: {'ok':>6} {'degr.':>6}")
+    useless = 0
+    window = Counter()
+    calls_before, degraded_before = 0, degraded_counts()
+    started = time.perf_counter()
+    for second in range(args.minutes * 60):
+        clock.now = second
+        batch = [user for index, user in enumerate(users) if (second + index) % UPDATE_INTERVAL == 0]
+        batch += [user for user in runaways for _ in range(args.runaway_rate)]
+        for user in batch:
+            data = await user.update(deviation)
+            group = "normal" if user.kind == "normal" else "runaway"
+            window[group, "degraded" if data.get("degraded") else "ok"] += 1
+            if not data.get("instructions") and not data.get("progress"):
+                useless += 1
+        if (second + 1) % (args.window * 60) == 0:
+            degraded = degraded_counts()
+            delta = {mode: degraded[mode] - degraded_before[mode] for mode in DEGRADED_MODES}
+            print(f"{(second + 1) // 60 - args.window:>3}-{(second + 1) // 60:<5} {stub.directions_calls - calls_before:>7} "
+                  f"{delta['cached']:>6} {delta['tracking']:>7} {delta['status']:>6} | "
+                  f"{window['normal', 'ok']:>15} {window['normal', 'degraded']:>6} | "
+                  f"{window['runaway', 'ok']:>19} {window['runaway', 'degraded']:>6}")
+            calls_before, degraded_before, window = stub.directions_calls, degraded, Counter()
+    elapsed = time.perf_counter() - started
+
+    print(f"Chamadas ao Google: {stub.directions_calls} | decisões: {main.admission.snapshot()} | "
+          f"{elapsed:.1f} s de execução")
+    ok = useless == 0
+    if useless:
+        print(f"FALHA: {useless} atualizações sem instruções nem progresso")
+    if limited and stub.directions_calls > args.budget:
+        print(f"FALHA: {stub.directions_calls} chamadas ao Google acima da cota de {args.budget}")
+        ok = False
+    return ok
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--minutes", type=int, default=60, help="Tempo simulado")
+    parser.add_argument("--window", type=int, default=10, help="Minutos por linha do relatório")
+    parser.add_argument("--origins", type=int, default=40, help="Pontos de partida distintos dos usuários normais")
+    parser.add_argument("--deviation", type=float, default=0.05, help="Desvios de rota por minuto de um usuário normal")
+    parser.add_argument("--runaway-rate", type=int, default=10, help="Envios por segundo de cada cliente com defeito")
+    parser.add_argument("--budget", type=int, default=4000, help="Cota diária de chamadas")
+    parser.add_argument("--session-rate", type=float, default=6, help="Rotas por minuto por sessão")
+    parser.add_argument("--session-burst", type=float, default=3)
+    parser.add_argument("--client-rate", type=float, default=30, help="Navegações novas por minuto por IP")
+    parser.add_argument("--client-burst", type=float, default=10)
+    parser.add_argument("--global-rate", type=float, default=2, help="Rotas por segundo no worker")
+    parser.add_argument("--global-burst", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    async def run():
+        main.initialize_providers()
+        await check_isolation()
+        unlimited = await run_scenario(args, limited=False)
+        limited = await run_scenario(args, limited=True)
+        await main.share_dispatcher.stop() # Como no encerramento do app: sem isso o agendador pode segurar o fim do loop
+        return unlimited and limited
+
+    if not asyncio.run(run()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,81 @@
+"""
+Benchmark: N chamadas simultâneas a um Directions "lento" (simulado localmente).
+
+Compara a chamada síncrona inline (como era feito em get_google_directions) com o
+GoogleDirectionsProvider (pool de threads + semáforo + timeout) e mede, além da vazão,
+o atraso do loop de eventos — ou seja, quanto as outras requisições ficariam paradas.
+
+Uso:
+    python benchmarks/bench_directions_pool.py --calls 64 --latency 0.3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import GoogleDirectionsProvider
+
+
+class SlowDirectionsClient:
+    """Imita googlemaps.Client.directions com uma latência fixa de rede."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def directions(self, **kwargs):
+        time.sleep(self.latency)
+        return [{"legs": [], "summary": "stub"}]
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Retorna o maior atraso observado de um timer de `interval` segundos no loop."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(mode: str, calls: int, latency: float, workers: int) -> None:
+    client = SlowDirectionsClient(latency)
+    provider = GoogleDirectionsProvider(client, max_workers=workers, max_concurrency=calls, timeout=latency * 10 + 5)
+
+    async def inline_call():
+        return client.directions(origin="0,0", destination="x") # Bloqueia o loop, como antes
+
+    async def provider_call():
+        return await provider.directions("0,0", "x")
+
+    call = inline_call if mode == "inline" else provider_call
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    await asyncio.sleep(0.02) # Deixa o medidor de atraso começar
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    worst_lag = await lag_task
+    provider.shutdown()
+    print(f"{mode:>8}: {calls} chamadas em {elapsed:.2f}s | {calls / elapsed:.1f} req/s | "
+          f"maior atraso do loop: {worst_lag * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latência simulada do Directions (s)")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    for mode in ("inline", "provider"):
+        asyncio.run(run(mode, args.calls, args.latency, args.workers))
+
+
+if __name__ == "__main__":
+    main()
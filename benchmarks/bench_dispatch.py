@@ -0,0 +1,126 @@
+"""
+Benchmark da fila de compartilhamento (dispatch.py) contra um servidor SMTP falso local.
+
+    inline   como era antes: cada atualização de GPS abre uma conexão SMTP e envia o e-mail
+             antes de responder (sequencial por requisição, concorrência limitada a --concurrency).
+    fila     as atualizações só enfileiram; a fila coalesce por usuário, envia em lotes por uma
+             conexão SMTP, e drena em segundo plano.
+    falhas   o servidor recusa --failure-rate das mensagens; as retentativas com backoff entregam o resto.
+    spool    envios pendentes sobrevivem a um "reinício" do dispatcher (spool SQLite).
+
+Uso:
+    python benchmarks/bench_dispatch.py --walkers 500 --ticks 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from dispatch import SMTPEmailSender, ShareDispatcher, ShareEntry, location_message
+from stubs import FakeSMTPServer
+
+
+def smtp_sender(server: FakeSMTPServer) -> SMTPEmailSender:
+    return SMTPEmailSender(host="127.0.0.1", port=server.port, starttls=False)
+
+
+def dispatcher(server: FakeSMTPServer, recipients: list, spool_path=None, **kwargs) -> ShareDispatcher:
+    return ShareDispatcher({"email": smtp_sender(server)}, {"email": recipients}, spool_path=spool_path, **kwargs)
+
+
+async def inline(server: FakeSMTPServer, walkers: int, ticks: int, concurrency: int):
+    sender = smtp_sender(server)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def tick(walker: int):
+        async with semaphore:
+            start = time.perf_counter()
+            payload = {"destination": "Destino", "text": location_message(-23.55, -46.63, "Destino")}
+            await sender.send_batch([ShareEntry(f"email|familia@exemplo.com|{walker}", "email", "familia@exemplo.com", payload)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(tick(walker) for _ in range(ticks) for walker in range(walkers)))
+    elapsed = time.perf_counter() - start
+    print(f"inline   {walkers * ticks} atualizações em {elapsed:.2f}s | latência da requisição "
+          f"p50={statistics.median(latencies) * 1000:.1f} ms | e-mails enviados: {server.messages} "
+          f"| conexões SMTP: {server.connections}")
+
+
+async def queued(server: FakeSMTPServer, walkers: int, ticks: int):
+    share = dispatcher(server, ["familia@exemplo.com"], coalesce_seconds=60, rate_per_minute=100000)
+    enqueue_times = []
+    start = time.perf_counter()
+    for tick in range(ticks):
+        for walker in range(walkers):
+            begin = time.perf_counter()
+            share.enqueue("email", f"walker-{walker}", -23.55 + tick * 1e-4, -46.63, "Destino")
+            enqueue_times.append(time.perf_counter() - begin)
+        await asyncio.sleep(0) # Deixa o agendador/workers rodarem entre os "ticks"
+    # Todos os usuários já enviaram uma vez; as demais atualizações ficam para a próxima janela
+    while share.stats["sent"] < walkers:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    await share.stop()
+    print(f"fila     {walkers * ticks} atualizações | enfileirar p50={statistics.median(enqueue_times) * 1e6:.1f} µs "
+          f"| {share.stats['sent']} e-mails em {elapsed:.2f}s ({share.stats['sent'] / elapsed:.0f}/s) "
+          f"em {share.stats['batches']} lotes | coalescidas: {share.stats['coalesced']} "
+          f"| conexões SMTP: {server.connections}")
+
+
+async def failures(server: FakeSMTPServer, walkers: int):
+    share = dispatcher(server, ["familia@exemplo.com"], rate_per_minute=100000, retry_base=0.05, max_attempts=8)
+    start = time.perf_counter()
+    for walker in range(walkers):
+        share.enqueue("email", f"walker-{walker}", -23.55, -46.63, "Destino", urgent=True)
+    await share.drain(timeout=30)
+    elapsed = time.perf_counter() - start
+    await share.stop()
+    print(f"falhas   {walkers} e-mails com {server.faults.failure_rate:.0%} de recusa: entregues={server.messages} "
+          f"recusas={server.rejected} retentativas={share.stats['retries']} descartados={share.stats['failed']} "
+          f"em {elapsed:.2f}s")
+
+
+async def spool(server: FakeSMTPServer, directory: str):
+    path = os.path.join(directory, "spool.sqlite3")
+    first = dispatcher(server, ["a@exemplo.com", "b@exemplo.com"], spool_path=path)
+    for walker in range(100):
+        first.enqueue("email", f"walker-{walker}", -23.55, -46.63, "Destino") # Sai só depois da janela
+    await first.stop() # "Reinício" com 200 envios pendentes
+    second = dispatcher(server, ["a@exemplo.com", "b@exemplo.com"], spool_path=path)
+    print(f"spool    pendentes antes do reinício: {len(first.pending)} | restaurados depois: {second.stats['restored']}")
+    await second.stop()
+
+
+async def run(args):
+    with FakeSMTPServer(connect_latency=args.connect_latency, message_latency=args.message_latency) as server:
+        await inline(server, args.walkers // 5, args.ticks, args.concurrency)
+    with FakeSMTPServer(connect_latency=args.connect_latency, message_latency=args.message_latency) as server:
+        await queued(server, args.walkers, args.ticks)
+    with FakeSMTPServer(message_latency=args.message_latency, failure_rate=args.failure_rate) as server:
+        await failures(server, args.walkers)
+    with FakeSMTPServer() as server, tempfile.TemporaryDirectory() as directory:
+        await spool(server, directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--walkers", type=int, default=500, help="Usuários navegando ao mesmo tempo")
+    parser.add_argument("--ticks", type=int, default=10, help="Atualizações de GPS por usuário")
+    parser.add_argument("--concurrency", type=int, default=16, help="Envios simultâneos no modo inline")
+    parser.add_argument("--connect-latency", type=float, default=0.02, help="Latência do handshake SMTP (s)")
+    parser.add_argument("--message-latency", type=float, default=0.002, help="Latência por mensagem (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Benchmark do envio das localizações em lote (POST /navigate/fixes) e do filtro de gps_filter.py.
+
+Simula caminhadas com curvas, GPS com ruído proporcional à precisão informada e saltos de
+multipercurso (dezenas de metros, às vezes em sequência). Compara o erro da posição usada pela
+navegação em cada envio:
+
+    última     o que o cliente mandava antes: só a localização mais recente do intervalo
+    filtrada   a estimativa do filtro de Kalman após o lote inteiro
+
+e mede quantas localizações por segundo o filtro e o endpoint (com validação do Pydantic e
+acompanhamento da rota, sem rede) processam num único worker.
+
+Uso:
+    python benchmarks/bench_gps_filter.py --walks 50 --minutes 10 --batch 10 --outliers 0.05
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+os.environ.setdefault("SHARE_SPOOL_PATH", "")
+os.environ.setdefault("TTS_ENGINE", "")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from geometry import METERS_PER_DEGREE
+from gps_filter import ACCURACY_TO_SIGMA, PositionFilter
+
+ORIGIN = (-23.5505, -46.6333)
+WALKING_SPEED = 1.4 # m/s
+
+
+def simulate_walk(rng: np.random.Generator, seconds: int, outlier_rate: float):
+    """Uma localização por segundo: trajeto real (metros), localizações (lat, lng), precisão e horário (ms)."""
+    # Trechos retos de 20 a 120 s com curvas de 90 graus e pequenas variações de velocidade
+    headings = []
+    while len(headings) < seconds:
+        heading = rng.choice([0, 90, 180, 270])
+        headings.extend([heading] * int(rng.integers(20, 120)))
+    headings = np.radians(np.array(headings[:seconds], dtype=np.float64))
+    speed = WALKING_SPEED * rng.uniform(0.8, 1.2, seconds)
+    true = np.cumsum(speed * (np.sin(headings) + 1j * np.cos(headings)))
+
+    accuracy = rng.uniform(4, 15, seconds)
+    measured = true + (rng.normal(size=seconds) + 1j * rng.normal(size=seconds)) * accuracy * ACCURACY_TO_SIGMA
+    # Multipercurso: saltos de 30 a 80 m, que duram de 1 a 3 localizações seguidas
+    starts = np.flatnonzero(rng.random(seconds) < outlier_rate / 2)
+    for start in starts:
+        jump = rng.uniform(30, 80) * np.exp(1j * rng.uniform(0, 2 * np.pi))
+        measured[start:start + int(rng.integers(1, 4))] += jump
+
+    meters_per_degree_lng = METERS_PER_DEGREE * math.cos(math.radians(ORIGIN[0]))
+    latitudes = ORIGIN[0] + measured.imag / METERS_PER_DEGREE
+    longitudes = ORIGIN[1] + measured.real / meters_per_degree_lng
+    timestamps = 1.7e12 + np.arange(seconds) * 1000.0
+    return true, measured, latitudes, longitudes, accuracy, timestamps
+
+
+def to_meters(latitude: float, longitude: float) -> complex:
+    east = (longitude - ORIGIN[1]) * METERS_PER_DEGREE * math.cos(math.radians(ORIGIN[0]))
+    return complex(east, (latitude - ORIGIN[0]) * METERS_PER_DEGREE)
+
+
+def accuracy_report(args):
+    rng = np.random.default_rng(args.seed)
+    raw_errors, filtered_errors = [], []
+    for _ in range(args.walks):
+        true, measured, latitudes, longitudes, accuracy, timestamps = simulate_walk(rng, args.minutes * 60, args.outliers)
+        position_filter = PositionFilter()
+        for start in range(0, len(true), args.batch):
+            end = min(start + args.batch, len(true))
+            position = position_filter.update(latitudes[start:end], longitudes[start:end], accuracy[start:end],
+                                              timestamps[start:end])
+            raw_errors.append(abs(measured[end - 1] - true[end - 1]))
+            filtered_errors.append(abs(to_meters(position.latitude, position.longitude) - true[end - 1]))
+    raw_errors, filtered_errors = np.array(raw_errors), np.array(filtered_errors)
+    print(f"{args.walks} caminhadas de {args.minutes} min, envio a cada {args.batch} localizações, "
+          f"{args.outliers:.0%} de saltos de multipercurso")
+    for name, errors in (("última", raw_errors), ("filtrada", filtered_errors)):
+        print(f"  {name:9} erro médio {errors.mean():6.1f} m | p95 {np.percentile(errors, 95):6.1f} m | "
+              f"máx {errors.max():6.1f} m | envios com erro > 25 m: {(errors > 25).mean():6.2%}")
+
+
+def filter_throughput(args):
+    rng = np.random.default_rng(args.seed)
+    _, _, latitudes, longitudes, accuracy, timestamps = simulate_walk(rng, 36000, args.outliers)
+    for batch in (args.batch, 100, 600):
+        position_filter = PositionFilter()
+        started = time.perf_counter()
+        for start in range(0, len(timestamps), batch):
+            position_filter.update(latitudes[start:start + batch], longitudes[start:start + batch],
+                                   accuracy[start:start + batch], timestamps[start:start + batch])
+        elapsed = time.perf_counter() - started
+        print(f"  filtro, lotes de {batch:3}:   {len(timestamps) / elapsed:10,.0f} localizações/s")
+
+
+async def endpoint_throughput(args):
+    import httpx
+    import main
+    from stubs import StubMapsClient, install_stub
+
+    install_stub(main, StubMapsClient())
+    rng = np.random.default_rng(args.seed)
+    walks = [simulate_walk(rng, args.minutes * 60, args.outliers) for _ in range(args.sessions)]
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            sessions = []
+            for _, _, latitudes, longitudes, _, _ in walks:
+                first = await client.post("/navigate/", json={"latitude": latitudes[0], "longitude": longitudes[0],
+                                                              "destination": "Destino"})
+                sessions.append((first.json()["sessionId"], first.headers["etag"]))
+
+            async def send(index: int, start: int):
+                _, _, latitudes, longitudes, accuracy, timestamps = walks[index]
+                session_id, etag = sessions[index]
+                fixes = [{"latitude": latitudes[i], "longitude": longitudes[i], "accuracy": accuracy[i],
+                          "timestamp": timestamps[i]} for i in range(start, min(start + args.batch, len(timestamps)))]
+                response = await client.post("/navigate/fixes", headers={"If-None-Match": etag},
+                                             json={"destination": "Destino", "session_id": session_id, "fixes": fixes})
+                return response.status_code, len(fixes)
+
+            started = time.perf_counter()
+            results = []
+            for start in range(1, args.minutes * 60, args.batch):
+                results.extend(await asyncio.gather(*(send(index, start) for index in range(len(walks)))))
+            elapsed = time.perf_counter() - started
+    fixes = sum(count for _, count in results)
+    errors = sum(1 for status, _ in results if status != 200)
+    print(f"  /navigate/fixes, lotes de {args.batch}: {fixes / elapsed:8,.0f} localizações/s "
+          f"({len(results) / elapsed:,.0f} envios/s, {args.sessions} sessões, {errors} erros)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--walks", type=int, default=50)
+    parser.add_argument("--minutes", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=10, help="Localizações por envio (1 por segundo)")
+    parser.add_argument("--outliers", type=float, default=0.05, help="Fração de localizações com salto de multipercurso")
+    parser.add_argument("--sessions", type=int, default=50, help="Sessões simultâneas no teste do endpoint")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    accuracy_report(args)
+    print("Vazão (um worker):")
+    filter_throughput(args)
+    asyncio.run(endpoint_throughput(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,74 @@
+"""
+Benchmark do custo do log e das métricas no caminho de uma requisição.
+
+Compara, por mensagem, o print() que /navigate/ fazia (uma dúzia por requisição) com o logging
+em fila de logs.py, tanto para mensagens escritas (INFO) quanto para as de cada requisição,
+que com o nível padrão são descartadas (DEBUG). Mede também o custo de `metrics.stage()` e de
+uma coleta de /metrics. Os prints e o log vão para um arquivo, para não medir o terminal
+(num terminal ou pipe cheio, o print bloqueia a requisição; o log em fila não). Num laço
+fechado, o custo do INFO inclui a disputa pelo GIL com a thread de escrita, ocupada o tempo todo.
+
+Uso:
+    python benchmarks/bench_logging.py --messages 20000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from logs import setup_logging, stop_logging
+from metrics import REGISTRY, stage
+
+
+def per_call(fn, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+    count = args.messages
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "print.log"), "w", encoding="utf-8") as output:
+            stdout, sys.stdout = sys.stdout, output
+            try:
+                printed = per_call(lambda i: print(f"Sessão {i}: passo 3, {i * 0.5:.0f} metros restantes."), count)
+                flushed = per_call(lambda i: print(f"Sessão {i}: passo 3, {i * 0.5:.0f} metros restantes.", flush=True), count)
+            finally:
+                sys.stdout = stdout
+
+        with open(os.path.join(directory, "queue.log"), "w", encoding="utf-8") as output:
+            setup_logging("INFO", stream=output)
+            logger = logging.getLogger("bench")
+            written = per_call(lambda i: logger.info("Sessão %s: passo 3, %.0f metros restantes.", i, i * 0.5), count)
+            filtered = per_call(lambda i: logger.debug("Sessão %s: passo 3, %.0f metros restantes.", i, i * 0.5), count)
+            stop_logging()
+
+    def timed_stage(i):
+        with stage("bench"):
+            pass
+
+    staged = per_call(timed_stage, count)
+    start = time.perf_counter()
+    text = REGISTRY.render()
+    render = (time.perf_counter() - start) * 1000
+
+    print(f"print()                       {printed:6.2f} µs/mensagem ({flushed:6.2f} µs com flush, como num terminal)")
+    print(f"logging em fila, INFO         {written:6.2f} µs/mensagem (escrita em outra thread)")
+    print(f"logging em fila, DEBUG        {filtered:6.2f} µs/mensagem (descartada pelo nível)")
+    print(f"metrics.stage()               {staged:6.2f} µs/etapa")
+    print(f"GET /metrics (render)         {render:6.2f} ms ({len(text.splitlines())} linhas)")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,126 @@
+"""
+Benchmark do roteador offline: ALT (A* + landmarks) contra Dijkstra simples.
+
+Gera um extrato .osm sintético (grade de ruas com quarteirões de ~100 m, algumas ruas
+interrompidas, uma passarela diagonal e uma via expressa que deve ser ignorada), carrega
+o grafo e compara as duas buscas nas mesmas consultas aleatórias, verificando que as
+distâncias encontradas são iguais.
+
+Uso:
+    python benchmarks/bench_offline_router.py --size 120 --queries 200
+    python benchmarks/bench_offline_router.py --osm data/sample.osm
+    python benchmarks/bench_offline_router.py --write-sample data/sample.osm   # regenera o extrato de teste
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from offline_router import OfflineRouter, parse_osm
+
+ORIGIN = (-23.5503, -46.6339) # Praça da Sé, São Paulo
+BLOCK_DEGREES = 0.0009 # ~100 m
+
+
+def write_grid_osm(path: str, size: int, seed: int = 7):
+    """Escreve uma grade size x size de ruas em formato OSM XML."""
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="SmartPath benchmark">']
+    node_id = lambda row, col: 1 + row * size + col
+    for row in range(size):
+        for col in range(size):
+            lat = ORIGIN[0] - row * BLOCK_DEGREES + rng.uniform(-0.00004, 0.00004)
+            lng = ORIGIN[1] + col * BLOCK_DEGREES + rng.uniform(-0.00004, 0.00004)
+            lines.append(f'  <node id="{node_id(row, col)}" lat="{lat:.7f}" lon="{lng:.7f}"/>')
+
+    way_id = 1
+
+    def way(refs, tags):
+        nonlocal way_id
+        lines.append(f'  <way id="{way_id}">')
+        lines.extend(f'    <nd ref="{ref}"/>' for ref in refs)
+        lines.extend(f'    <tag k="{key}" v="{value}"/>' for key, value in tags.items())
+        lines.append("  </way>")
+        way_id += 1
+
+    for row in range(size):
+        # Ruas leste-oeste, algumas interrompidas no meio (quarteirão fechado)
+        cut = rng.randrange(1, size - 1) if row % 4 == 2 else None
+        segments = [range(0, cut), range(cut + 1, size)] if cut else [range(size)]
+        for columns in segments:
+            if len(columns) > 1:
+                way([node_id(row, col) for col in columns], {"highway": "residential", "name": f"Rua {row + 1}"})
+    for col in range(size):
+        way([node_id(row, col) for row in range(size)],
+            {"highway": "secondary" if col % 5 == 0 else "residential", "name": f"Avenida {col + 1}"})
+    # Passarela diagonal (atalho só para pedestres) e via expressa (sem acesso a pé)
+    diagonal = min(size, 6)
+    way([node_id(i, i) for i in range(diagonal)], {"highway": "footway"})
+    way([node_id(size - 1, col) for col in range(size)], {"highway": "motorway", "name": "Via Expressa"})
+    lines.append("</osm>")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def benchmark(osm_path: str, queries: int, landmarks: int):
+    start = time.perf_counter()
+    graph = parse_osm(osm_path)
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    router = OfflineRouter(graph, landmarks)
+    landmark_time = time.perf_counter() - start
+    edge_bytes = graph.indptr.nbytes + graph.indices.nbytes + graph.weights.nbytes + graph.edge_names.nbytes
+    print(f"Grafo: {graph.node_count} nós, {len(graph.indices)} arestas | CSR {edge_bytes / 1024:.0f} KiB | "
+          f"leitura {parse_time:.2f}s | {landmarks} landmarks em {landmark_time:.2f}s")
+
+    rng = random.Random(1)
+    pairs = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(queries)]
+    timings = {}
+    for label, use_landmarks in (("dijkstra", False), ("alt", True)):
+        results = []
+        start = time.perf_counter()
+        for source, target in pairs:
+            heuristic = router.heuristic(target) if use_landmarks else None
+            results.append(graph.shortest_path(source, target, heuristic)[0])
+        timings[label] = (time.perf_counter() - start, results)
+
+    dijkstra_time, dijkstra_results = timings["dijkstra"]
+    alt_time, alt_results = timings["alt"]
+    mismatches = sum(abs(a - b) > 0.01 for a, b in zip(dijkstra_results, alt_results))
+    print(f"Dijkstra: {dijkstra_time / queries * 1000:.2f} ms/rota | ALT: {alt_time / queries * 1000:.2f} ms/rota | "
+          f"aceleração {dijkstra_time / alt_time:.1f}x | divergências: {mismatches}")
+
+    start = time.perf_counter()
+    for source, target in pairs[:50]:
+        router.directions(f"{graph.coords[source][0]},{graph.coords[source][1]}",
+                          f"{graph.coords[target][0]},{graph.coords[target][1]}")
+    print(f"directions() completo (rota + passos + polylines): {(time.perf_counter() - start) / min(50, queries) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=120, help="Lado da grade sintética (size x size cruzamentos)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--landmarks", type=int, default=8)
+    parser.add_argument("--osm", help="Usar um extrato .osm existente em vez da grade sintética")
+    parser.add_argument("--write-sample", metavar="PATH", help="Gerar o extrato de teste pequeno e sair")
+    args = parser.parse_args()
+
+    if args.write_sample:
+        write_grid_osm(args.write_sample, size=12)
+        return
+    if args.osm:
+        benchmark(args.osm, args.queries, args.landmarks)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "grid.osm")
+        write_grid_osm(path, args.size)
+        benchmark(path, args.queries, args.landmarks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark do refinamento de instruções em segundo plano (refinement.py), com Gemini falso.
+
+Compara a latência de /navigate/ com o refinamento inline (como era antes: a resposta
+esperava o modelo terminar) e em segundo plano, e mede quando o texto refinado chega
+ao cliente (primeiro trecho e texto completo). Também verifica o cache por conteúdo
+(rotas idênticas não chamam o modelo de novo) e o fallback por prazo.
+
+Uso:
+    python benchmarks/bench_refinement.py --sessions 50 --first-chunk 0.8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+
+import main
+from refinement import InstructionRefiner, RefinementCache
+from route_cache import InMemoryRouteCacheBackend, RouteCache
+from stubs import FakeRefinementModel, StubMapsClient, install_stub
+
+
+def location(index: int) -> "main.LocationData":
+    # Origens a ~1 km umas das outras: rotas distintas no cache de rotas, mas com a mesma lista de passos
+    return main.LocationData(latitude=-23.55 + index * 0.01, longitude=-46.63, destination="Destino")
+
+
+async def consume(refinement_id: str, started: float) -> tuple:
+    first_chunk = None
+    async for event, data in await main.refiner.events(refinement_id):
+        if event == "chunk" and first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        if event == "done":
+            return first_chunk, time.perf_counter() - started, data["refined"]
+
+
+async def navigate(index: int, inline: bool) -> dict:
+    started = time.perf_counter()
+    data = await main.update_navigation(location(index))
+    if inline: # Comportamento antigo: a resposta só sai depois do texto refinado
+        await consume(data["refinementId"], started)
+    result = {"navigate": time.perf_counter() - started}
+    if not inline:
+        result["first_chunk"], result["done"], result["refined"] = await consume(data["refinementId"], started)
+    return result
+
+
+def p50(values):
+    return statistics.median(values) * 1000
+
+
+async def run(args):
+    install_stub(main, StubMapsClient(args.maps_latency))
+
+    for inline in (True, False):
+        model = FakeRefinementModel(args.first_chunk, args.chunk_delay)
+        main.refiner = InstructionRefiner(model, RefinementCache(path=None))
+        main.navigation_sessions = main.SessionStore()
+        main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+        results = await asyncio.gather(*(navigate(index, inline) for index in range(args.sessions)))
+        label = "inline (antes)" if inline else "segundo plano"
+        line = f"{label:<15} /navigate/ p50={p50([r['navigate'] for r in results]):7.1f} ms"
+        if not inline:
+            line += (f" | 1º trecho p50={p50([r['first_chunk'] for r in results]):7.1f} ms"
+                     f" | texto completo p50={p50([r['done'] for r in results]):7.1f} ms")
+        print(f"{line} | chamadas ao modelo: {model.calls} para {args.sessions} sessões")
+
+    # Rota idêntica depois: resultado já em cache, entregue de imediato
+    started = time.perf_counter()
+    data = await main.update_navigation(location(args.sessions + 1))
+    _, done, refined = await consume(data["refinementId"], started)
+    print(f"rota idêntica   texto refinado em {done * 1000:.1f} ms (cache, refined={refined}) | "
+          f"chamadas ao modelo: {main.refiner.model.calls}")
+
+    # Modelo que não responde: o texto original é entregue no prazo
+    main.refiner = InstructionRefiner(FakeRefinementModel(hang=True), RefinementCache(path=None), deadline=args.deadline)
+    main.navigation_sessions = main.SessionStore()
+    result = await navigate(0, inline=False)
+    print(f"modelo travado  /navigate/ {result['navigate'] * 1000:.1f} ms | texto original entregue em "
+          f"{result['done'] * 1000:.0f} ms (prazo {args.deadline * 1000:.0f} ms, refined={result['refined']})")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--first-chunk", type=float, default=0.8, help="Latência até o primeiro trecho do modelo (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.1, help="Intervalo entre trechos (s)")
+    parser.add_argument("--maps-latency", type=float, default=0.1, help="Latência do Directions falso (s)")
+    parser.add_argument("--deadline", type=float, default=1.0, help="Prazo do modelo no cenário travado (s)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
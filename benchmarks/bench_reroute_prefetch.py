@@ -0,0 +1,157 @@
+"""
+Benchmark do pré-cálculo de rotas alternativas (reroute_prefetch.py).
+
+Simula caminhantes na rota em "L" do stub (300 m para leste, depois 300 m para o norte) com
+o Directions falso com latência. Na esquina, uma parte deles erra a conversão e segue reto
+para o leste até a navegação perceber o desvio. Roda o mesmo cenário com o pré-cálculo
+desligado e ligado e compara:
+
+    - o tempo da atualização que detecta o desvio (o silêncio até a rota nova);
+    - quantos desvios foram atendidos por uma rota pronta;
+    - as chamadas ao Directions por caminhante (o custo do pré-cálculo).
+
+Antes, confere que um pré-cálculo recusado pela admissão (sem folga no limite global) não
+derruba o recálculo de um usuário que pede a mesma rota ao mesmo tempo.
+
+Uso:
+    python benchmarks/bench_reroute_prefetch.py --walkers 100 --miss 0.3 --latency 0.3
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+os.environ.setdefault("SHARE_SPOOL_PATH", "")
+os.environ.setdefault("TTS_ENGINE", "")
+os.environ.setdefault("USE_GEMINI_FOR_REFINEMENT", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import main
+from admission import PREFETCH_HEADROOM, AdmissionController, AdmissionDenied
+from reroute_prefetch import REROUTE_PREFETCH_BUDGET, ReroutePrefetcher
+from route_cache import InMemoryRouteCacheBackend, RouteCache
+from route_model import Route
+from stubs import DEGREES_PER_100M_LAT, StubMapsClient, install_stub
+
+ORIGIN = (-23.5505, -46.6333)
+EAST_LEG = 300
+NORTH_LEG = 300
+
+
+def offset(point, east: float, north: float):
+    """Ponto deslocado em metros."""
+    lat, lng = point
+    return (lat + north / 100 * DEGREES_PER_100M_LAT,
+            lng + east / 100 * DEGREES_PER_100M_LAT / math.cos(math.radians(lat)))
+
+
+async def walker(index: int, rng: random.Random, args, results: dict):
+    """Anda pela rota; se `misses`, passa da esquina e segue para o leste até ser recolocado na rota."""
+    origin = offset(ORIGIN, 700 * (index % 20), 700 * (index // 20)) # Origens distintas: sem acertos do cache de rotas
+    misses = rng.random() < args.miss
+    session_id = route_version = None
+    await asyncio.sleep(rng.uniform(0, args.interval * 20)) # Espalha os inícios
+    walked, overshoot = 0.0, 0.0
+    while walked < EAST_LEG + NORTH_LEG:
+        if misses and walked >= EAST_LEG:
+            overshoot += args.step
+            point = offset(origin, EAST_LEG + overshoot, 0)
+        else:
+            point = offset(origin, min(walked, EAST_LEG), max(walked - EAST_LEG, 0))
+        location = main.LocationData(latitude=point[0], longitude=point[1], destination="Destino", session_id=session_id)
+        started = time.perf_counter()
+        data = await main.update_navigation(location, f'"{route_version}"' if route_version else None)
+        elapsed = time.perf_counter() - started
+        session_id = data.get("sessionId", session_id)
+        route_version = data.get("routeVersion", route_version)
+        if data.get("rerouted"):
+            results["reroute_seconds"].append(elapsed)
+            return # A rota nova (do stub) parte daqui: o caminhante foi recolocado na rota
+        walked += args.step
+        await asyncio.sleep(args.interval)
+
+
+async def check_prefetch_denial():
+    """Pré-cálculo recusado e recálculo do usuário para a mesma rota, ao mesmo tempo."""
+    install_stub(main, StubMapsClient(latency=0.05))
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+    main.admission = AdmissionController(global_rate_per_second=0.1, global_burst=10, daily_budget=0)
+    for _ in range(6): # Abaixo da folga exigida do balde global: pré-cálculos são recusados
+        main.admission.admit()
+
+    async def directions(**kwargs):
+        try:
+            return await main.get_google_directions(ORIGIN[0], ORIGIN[1], "Destino", **kwargs)
+        except AdmissionDenied as denied:
+            return denied
+
+    prefetch, reroute = await asyncio.gather(directions(prefetch=True), directions(session_id="user", reroute=True))
+    assert isinstance(prefetch, AdmissionDenied) and prefetch.reason == PREFETCH_HEADROOM, f"Pré-cálculo admitido: {prefetch}"
+    assert isinstance(reroute, Route), f"Recálculo do usuário recusado junto com o pré-cálculo: {reroute}"
+    print("Pré-cálculo recusado não afeta o recálculo do usuário: ok")
+
+
+async def run_scenario(args, budget: int) -> dict:
+    stub = StubMapsClient(args.latency)
+    install_stub(main, stub)
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+    main.navigation_sessions = main.SessionStore()
+    main.admission = AdmissionController(daily_budget=0)
+    main.reroute_prefetcher = prefetcher = ReroutePrefetcher(main.reroute_prefetcher.fetch, budget=budget)
+    rng = random.Random(args.seed)
+    results = {"reroute_seconds": []}
+    await asyncio.gather(*(walker(index, rng, args, results) for index in range(args.walkers)))
+    await asyncio.sleep(args.latency * 4) # Pré-cálculos ainda em andamento também custam chamadas
+    results["directions_calls"] = stub.directions_calls
+    results["prefetch"] = prefetcher.snapshot()
+    return results
+
+
+def report(name: str, args, results: dict):
+    values = sorted(results["reroute_seconds"])
+    line = f"  {name:10} desvios: {len(values):4}"
+    if len(values) >= 2:
+        cuts = statistics.quantiles(values, n=100)
+        line += (f" | atualização do desvio p50={cuts[49] * 1000:7.1f} ms p95={cuts[94] * 1000:7.1f} ms "
+                 f"máx={values[-1] * 1000:7.1f} ms")
+    stats = results["prefetch"]
+    line += (f" | rotas prontas usadas: {stats['hits']:4} | chamadas ao Directions: {results['directions_calls']} "
+             f"({results['directions_calls'] / args.walkers:.2f} por caminhante)")
+    print(line)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--walkers", type=int, default=100)
+    parser.add_argument("--miss", type=float, default=0.3, help="Fração de caminhantes que passa da esquina")
+    parser.add_argument("--latency", type=float, default=0.3, help="Latência simulada do Directions (s)")
+    parser.add_argument("--step", type=float, default=14, help="Metros andados entre atualizações")
+    parser.add_argument("--interval", type=float, default=0.5, help="Intervalo entre atualizações (s), tempo acelerado")
+    parser.add_argument("--budget", type=int, default=REROUTE_PREFETCH_BUDGET, help="Chamadas de pré-cálculo por rota")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    async def run():
+        main.initialize_providers()
+        await check_prefetch_denial()
+        print(f"{args.walkers} caminhantes, {args.miss:.0%} passam da esquina, Directions com {args.latency * 1000:.0f} ms")
+        report("sem", args, await run_scenario(args, budget=0))
+        with_prefetch = await run_scenario(args, budget=args.budget)
+        report("com", args, with_prefetch)
+        print(f"  pré-cálculo: {with_prefetch['prefetch']}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main_cli()
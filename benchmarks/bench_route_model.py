@@ -0,0 +1,171 @@
+"""
+Benchmark da representação compacta de rotas (route_model.py) contra o dict da Directions API.
+
+Gera rotas no formato da resposta do Google (passos com html_instructions, polylines,
+distâncias, manobras, nomes de rua repetidos entre rotas) e compara:
+
+    memória    N rotas guardadas como dict (como ficavam no cache e nas sessões) e como `Route`
+    tamanho    JSON (como o cache em SQLite gravava) e `Route.to_bytes`
+    leitura    json.loads do cache contra Route.from_bytes
+    formatação o texto das instruções montado a partir do dict (regex por passo, como antes)
+               contra process_google_directions_response sobre `Route`
+
+Uso:
+    python benchmarks/bench_route_model.py --routes 2000 --steps 15
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+os.environ.setdefault("TTS_ENGINE", "")
+
+import main
+from directions_format import format_distance, format_duration
+from geometry import encode_polyline
+from route_model import MANEUVERS, Route, StringTable
+
+STREETS = [f"{kind} {name} {number}" for kind in ("R.", "Av.", "Al.") for name in
+           ("Augusta", "Paulista", "da Consolação", "Frei Caneca", "Haddock Lobo", "Bela Cintra", "Oscar Freire",
+            "Teodoro Sampaio", "Cardeal Arcoverde", "dos Pinheiros") for number in range(10)]
+TURNS = [("Vire à <b>esquerda</b>", "turn-left"), ("Vire à <b>direita</b>", "turn-right"),
+         ("Curva suave à <b>direita</b>", "turn-slight-right"), ("Continue em frente", "straight"),
+         ("Mantenha-se à <b>esquerda</b>", "keep-left")]
+
+
+def google_route(rng: random.Random, steps: int) -> dict:
+    """Rota no formato da Directions API, com 5 a 30 pontos por passo e ruas de um conjunto comum."""
+    lat, lng = -23.55 + rng.uniform(-0.05, 0.05), -46.63 + rng.uniform(-0.05, 0.05)
+    path = [(lat, lng)]
+    step_list = []
+    for i in range(steps):
+        points = [path[-1]]
+        for _ in range(rng.randint(5, 30)):
+            points.append((points[-1][0] + rng.uniform(-1e-4, 1e-4), points[-1][1] + rng.uniform(-1e-4, 1e-4)))
+        path.extend(points[1:])
+        distance = rng.randint(20, 400)
+        text, maneuver = ("Siga para o <b>norte</b>", None) if i == 0 else rng.choice(TURNS)
+        step = {
+            "html_instructions": f"{text} na <b>{rng.choice(STREETS)}</b>",
+            "distance": {"value": distance, "text": format_distance(distance)},
+            "duration": {"value": int(distance / 1.3), "text": format_duration(distance / 1.3)},
+            "start_location": {"lat": points[0][0], "lng": points[0][1]},
+            "end_location": {"lat": points[-1][0], "lng": points[-1][1]},
+            "polyline": {"points": encode_polyline(points)},
+            "travel_mode": "WALKING",
+        }
+        if maneuver:
+            step["maneuver"] = maneuver
+        step_list.append(step)
+    total = sum(step["distance"]["value"] for step in step_list)
+    return {
+        "bounds": {"northeast": {"lat": max(p[0] for p in path), "lng": max(p[1] for p in path)},
+                   "southwest": {"lat": min(p[0] for p in path), "lng": min(p[1] for p in path)}},
+        "copyrights": "Dados cartográficos ©2025 Google",
+        "legs": [{
+            "steps": step_list,
+            "start_address": f"{rng.choice(STREETS)}, {rng.randint(1, 2000)} - São Paulo, SP",
+            "end_address": f"{rng.choice(STREETS)}, {rng.randint(1, 2000)} - São Paulo, SP",
+            "distance": {"value": total, "text": format_distance(total)},
+            "duration": {"value": int(total / 1.3), "text": format_duration(total / 1.3)},
+            "start_location": step_list[0]["start_location"],
+            "end_location": step_list[-1]["end_location"],
+            "traffic_speed_entry": [],
+            "via_waypoint": [],
+        }],
+        "overview_polyline": {"points": encode_polyline(path[::4] + [path[-1]])},
+        "summary": STREETS[0],
+        "warnings": ["A rota a pé está em versão Beta."],
+        "waypoint_order": [],
+    }
+
+
+def legacy_instructions(directions_data: dict) -> str:
+    """Formatação antiga, direto sobre o dict (regex e cadeias de .get por passo)."""
+    leg = directions_data["legs"][0]
+    instructions = [f"Início da navegação. Saindo de {leg.get('start_address', 'sua localização atual')} "
+                    f"em direção a {leg.get('end_address', 'seu destino')}."]
+    for i, step in enumerate(leg.get("steps")):
+        text = re.sub(r'<[^>]+>', '', step.get("html_instructions", "Instrução desconhecida"))
+        distance_meters = step.get("distance", {}).get("value", 0)
+        distance_str = f"{distance_meters:.0f} metros" if distance_meters > 0 else "uma curta distância"
+        street_name = (step.get("street_number", "") + " " + step.get("street_name", "")).strip()
+        line = f"{i + 1}. {text}"
+        if street_name:
+            line += f" na {street_name}"
+        instructions.append(line + f" (andar por {distance_str})")
+    total = leg.get("distance", {}).get("value", 0)
+    instructions.append(f"{len(leg['steps']) + 1}. Você chegou ao seu destino. Distância total: {total:.0f} metros.")
+    return "\n".join(instructions)
+
+
+def measure_memory(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del held
+    return used
+
+
+def per_call(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    routes = [google_route(rng, max(2, int(rng.gauss(args.steps, args.steps / 3)))) for _ in range(args.routes)]
+    texts = [json.dumps(route) for route in routes]
+    blobs = [Route.from_directions(route).to_bytes() for route in routes]
+    steps = statistics.mean(len(route["legs"][0]["steps"]) for route in routes)
+    print(f"{args.routes} rotas, {steps:.1f} passos em média")
+
+    dict_memory = measure_memory(lambda: [json.loads(text) for text in texts])
+    route_memory = measure_memory(lambda: (lambda table: [Route.from_bytes(blob, table) for blob in blobs])(StringTable()))
+    print(f"memória    dict {dict_memory / args.routes / 1024:7.1f} KB/rota | Route {route_memory / args.routes / 1024:6.1f} KB/rota "
+          f"({dict_memory / route_memory:.1f}x menor)")
+
+    json_size = statistics.mean(len(text.encode("utf-8")) for text in texts)
+    blob_size = statistics.mean(len(blob) for blob in blobs)
+    print(f"tamanho    JSON {json_size / 1024:7.1f} KB/rota | binário {blob_size / 1024:6.2f} KB/rota "
+          f"({json_size / blob_size:.1f}x menor)")
+
+    print(f"leitura    json.loads {per_call(json.loads, texts):7.1f} µs | Route.from_bytes {per_call(Route.from_bytes, blobs):6.1f} µs "
+          f"| conversão única do dict (Route.from_directions) {per_call(Route.from_directions, routes):6.1f} µs")
+
+    parsed = [Route.from_bytes(blob) for blob in blobs]
+    start = time.perf_counter()
+    for route in parsed:
+        await main.process_google_directions_response(route)
+    route_format = (time.perf_counter() - start) / len(parsed) * 1e6
+    print(f"formatação dict (regex por passo) {per_call(legacy_instructions, routes):7.1f} µs | Route {route_format:6.1f} µs")
+    assert {MANEUVERS[code] for route in parsed for code in route.maneuvers.tolist()} <= set(MANEUVERS)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=15, help="Passos por rota (média)")
+    parser.add_argument("--seed", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+"""
+Benchmark do pool de provedores de rota (routing.py): hedge, fallback e circuit breaker.
+
+Usa o cliente Google falso (com cauda lenta e falhas injetáveis) e um servidor OSRM falso
+real (HTTP local). Cenários:
+
+    tail    o Google responde em --latency, mas --tail-probability das chamadas demoram
+            --tail-latency. Compara só Google com Google + OSRM (hedge no p95).
+    outage  o Google falha em todas as chamadas. Mostra o circuito abrindo e o fallback
+            para o OSRM mantendo a latência baixa.
+
+Antes, confere as manobras da resposta do OSRM falso convertida para o formato da Directions API.
+
+Uso:
+    python benchmarks/bench_routing.py --requests 400 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from providers import GoogleDirectionsProvider, OSRMDirectionsProvider, osrm_to_directions
+from routing import RoutingPool
+from stubs import FaultInjector, StubMapsClient, StubOSRMServer, synthetic_osrm_response
+
+DESTINATION = "place_id:stub-destino"
+COORDINATES = "-23.5610,-46.6560"
+
+
+def check_osrm_conversion():
+    """A rota em "L" do stub: saída para o leste, segue em frente e vira à esquerda para o norte."""
+    route = osrm_to_directions(synthetic_osrm_response(-23.5505, -46.6333)["routes"][0])
+    maneuvers = [step.get("maneuver") for step in route["legs"][0]["steps"]]
+    assert maneuvers == [None, "straight", "turn-left"], f"Manobras do OSRM convertidas errado: {maneuvers}"
+
+
+async def measure(pool: RoutingPool, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(index: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await pool.directions(f"{-23.55 + index * 1e-5},-46.63", DESTINATION, coordinates=COORDINATES)
+                if not result:
+                    failures += 1
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98], "max": max(latencies), "failures": failures}
+
+
+def report(label: str, result: dict, pool: RoutingPool):
+    print(f"{label:<28} p50={result['p50'] * 1000:7.1f} ms  p95={result['p95'] * 1000:7.1f} ms  "
+          f"p99={result['p99'] * 1000:7.1f} ms  max={result['max'] * 1000:7.1f} ms  falhas={result['failures']}")
+    for name, stats in pool.snapshot()["providers"].items():
+        print(f"    {name:<8} chamadas={stats['calls']} vitórias={stats['wins']} hedges={stats['hedged']} "
+              f"falhas={stats['failures']} canceladas={stats['cancelled']} puladas(circuito)={stats['skipped_open']} "
+              f"estado={stats['state']}")
+
+
+async def run(args):
+    check_osrm_conversion()
+    with StubOSRMServer(faults=FaultInjector(latency=args.osrm_latency)) as osrm_server:
+        def build_pool(google_client, with_osrm: bool) -> RoutingPool:
+            providers = {"google": GoogleDirectionsProvider(google_client, max_workers=64, max_concurrency=256)}
+            if with_osrm:
+                providers["osrm"] = OSRMDirectionsProvider(osrm_server.url, max_workers=64, max_concurrency=256)
+            return RoutingPool.from_providers(providers, order=["google", "osrm"], budgets=f"google={args.budget}",
+                                              deadline=args.deadline)
+
+        print(f"Cenário 'tail': Google {args.latency * 1000:.0f} ms, {args.tail_probability:.0%} das chamadas "
+              f"em {args.tail_latency * 1000:.0f} ms; OSRM {args.osrm_latency * 1000:.0f} ms")
+        for with_osrm in (False, True):
+            client = StubMapsClient(args.latency, args.tail_latency, args.tail_probability)
+            pool = build_pool(client, with_osrm)
+            await measure(pool, 40, args.concurrency) # Aquecimento: coleta latências para o p95
+            report("google + osrm (hedge)" if with_osrm else "só google", await measure(pool, args.requests, args.concurrency), pool)
+
+        print("\nCenário 'outage': Google falhando em todas as chamadas")
+        for with_osrm in (False, True):
+            client = StubMapsClient(args.latency, failure_rate=1.0)
+            pool = build_pool(client, with_osrm)
+            report("google + osrm (fallback)" if with_osrm else "só google", await measure(pool, args.requests, args.concurrency), pool)
+            print(f"    chamadas reais ao Google: {client.directions_calls} de {args.requests} requisições")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.08, help="Latência típica do Google falso (s)")
+    parser.add_argument("--tail-latency", type=float, default=3.0, help="Latência da cauda lenta do Google falso (s)")
+    parser.add_argument("--tail-probability", type=float, default=0.05)
+    parser.add_argument("--osrm-latency", type=float, default=0.03, help="Latência do OSRM falso (s)")
+    parser.add_argument("--budget", type=float, default=4.0, help="Orçamento do Google (s)")
+    parser.add_argument("--deadline", type=float, default=6.0, help="Prazo total por rota (s)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Benchmark do acompanhamento ao vivo (share_links.py): um usuário navegando, muitos acompanhantes.
+
+Duas partes:
+
+    ponta a ponta   sobe o backend em um subprocesso com o cliente Google Maps falso; um
+                    caminhante envia localizações por /navigate/ws, cria o link em
+                    /navigate/{sessão}/share e N acompanhantes (metade SSE, metade WebSocket)
+                    recebem as posições. Mede a latência publicação -> acompanhante (horário
+                    da posição, mesmo relógio) e a memória do servidor antes e depois.
+    em processo     PositionHub com milhares de compartilhamentos (cada um com alguns
+                    acompanhantes, parte deles lenta). Mede o custo de cada publicação, a
+                    latência de entrega aos acompanhantes rápidos, as posições descartadas
+                    para os lentos e a memória por compartilhamento (tracemalloc).
+
+Uso:
+    python benchmarks/bench_share_fanout.py --watchers 50 --topics 5000 --topic-watchers 2
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+import websockets
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from load_test import worker_memory
+from share_links import PositionHub
+from stubs import DEGREES_PER_100M_LAT
+
+ORIGIN = (-23.5505, -46.6333)
+EAST_LEG = 300 # A rota do stub começa com 300 m para o leste
+
+
+def serve(port: int):
+    """Executa o backend com o stub do Google Maps (usado no subprocesso)."""
+    import uvicorn
+    os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+    os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+    os.environ.setdefault("SHARE_SPOOL_PATH", "")
+    os.environ.setdefault("TTS_ENGINE", "")
+    os.environ.setdefault("USE_GEMINI_FOR_REFINEMENT", "false")
+    os.environ.setdefault("SHARE_LINK_MAX_WATCHERS", "10000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import main
+    from stubs import StubMapsClient, install_stub
+
+    install_stub(main, StubMapsClient())
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def quantiles(values: list) -> str:
+    if len(values) < 2:
+        return "sem amostras suficientes"
+    cuts = statistics.quantiles(values, n=100)
+    return f"p50={cuts[49]:.1f} ms p95={cuts[94]:.1f} ms p99={cuts[98]:.1f} ms máx={max(values):.1f} ms"
+
+
+# --- Ponta a ponta ---
+
+async def walk(base_url: str, fixes: int, interval: float, session_ready: asyncio.Future, watchers_ready: asyncio.Event):
+    """Segue o primeiro trecho da rota do stub enviando uma localização a cada `interval` segundos."""
+    async with websockets.connect(base_url.replace("http", "ws") + "/navigate/ws", ping_interval=None) as ws:
+        await ws.send(json.dumps({"type": "start", "destination": "Destino"}))
+        await ws.send(json.dumps({"type": "fix", "latitude": ORIGIN[0], "longitude": ORIGIN[1]}))
+        while True:
+            message = json.loads(await ws.recv())
+            if message["type"] == "route":
+                session_ready.set_result(message["sessionId"])
+                break
+        await watchers_ready.wait()
+        step = EAST_LEG * 0.8 / fixes / 100 * DEGREES_PER_100M_LAT / math.cos(math.radians(ORIGIN[0])) # Graus de longitude
+        for index in range(fixes):
+            await ws.send(json.dumps({"type": "fix", "latitude": ORIGIN[0], "longitude": ORIGIN[1] + index * step}))
+            await asyncio.sleep(interval)
+
+
+async def sse_watcher(base_url: str, events_url: str, latencies: list, counters: dict, connected: asyncio.Event):
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        async with client.stream("GET", events_url) as response:
+            counters["connected"] += 1
+            connected.set()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: ") and event == "position":
+                    latencies.append(time.time() * 1000 - json.loads(line[6:])["timestamp"])
+                    counters["received"] += 1
+                elif line.startswith("data: ") and event == "end":
+                    return
+
+
+async def ws_watcher(base_url: str, ws_url: str, latencies: list, counters: dict, connected: asyncio.Event):
+    async with websockets.connect(base_url.replace("http", "ws") + ws_url, ping_interval=None) as ws:
+        counters["connected"] += 1
+        connected.set()
+        async for raw in ws:
+            message = json.loads(raw)
+            if message["type"] == "position":
+                latencies.append(time.time() * 1000 - message["timestamp"])
+                counters["received"] += 1
+            elif message["type"] == "end":
+                return
+
+
+async def end_to_end(args, server_pid: int):
+    base_url = f"http://127.0.0.1:{args.port}"
+    loop = asyncio.get_running_loop()
+    session_ready, watchers_ready = loop.create_future(), asyncio.Event()
+    walker = asyncio.create_task(walk(base_url, args.fixes, args.interval, session_ready, watchers_ready))
+    session_id = await session_ready
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        link = (await client.post(f"/navigate/{session_id}/share")).json()
+    before = worker_memory(server_pid)
+
+    latencies = {"sse": [], "ws": []}
+    counters = {"connected": 0, "received": 0}
+    watchers, connections = [], []
+    for index in range(args.watchers):
+        connected = asyncio.Event()
+        connections.append(connected)
+        if index % 2:
+            watchers.append(asyncio.create_task(ws_watcher(base_url, link["wsUrl"], latencies["ws"], counters, connected)))
+        else:
+            watchers.append(asyncio.create_task(sse_watcher(base_url, link["eventsUrl"], latencies["sse"], counters, connected)))
+    await asyncio.gather(*(connected.wait() for connected in connections))
+    during = worker_memory(server_pid)
+    watchers_ready.set()
+    await walker
+    await asyncio.sleep(1) # Últimas entregas
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        hub = (await client.get("/share_stats/")).json()["live"]
+    for task in watchers:
+        task.cancel()
+    await asyncio.gather(*watchers, return_exceptions=True)
+
+    print(f"Ponta a ponta: 1 caminhante, {counters['connected']}/{args.watchers} acompanhantes, "
+          f"{args.fixes} localizações a cada {args.interval * 1000:.0f} ms")
+    for kind, values in latencies.items():
+        print(f"  publicação -> acompanhante {kind:3} ({len(values)}): {quantiles(values)}")
+    print(f"  posições recebidas: {counters['received']} | hub: {hub}")
+    if before and during:
+        print(f"  memória do servidor: {before[0]['rss_mb']:.1f} MB antes dos acompanhantes, "
+              f"{during[0]['rss_mb']:.1f} MB com {args.watchers} conectados")
+
+
+# --- Em processo ---
+
+async def hub_watcher(hub: PositionHub, topic, slow: bool, delay: float, latencies: list):
+    hub.attach(topic)
+    try:
+        async for position in hub.updates(topic):
+            if position is None:
+                continue
+            position.sse() if len(latencies) % 2 else position.json() # Serializa (uma vez por posição, compartilhada)
+            if slow:
+                await asyncio.sleep(delay)
+            else:
+                latencies.append((time.perf_counter() - position.payload["sent"]) * 1000)
+    finally:
+        hub.detach(topic)
+
+
+async def in_process(args):
+    hub = PositionHub(max_topics=args.topics, max_watchers=args.topic_watchers, heartbeat_seconds=3600)
+    expires_at = time.time() + 3600
+    latencies = []
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    topics = [hub.open(f"share{index}", expires_at) for index in range(args.topics)]
+    tasks = []
+    for index, topic in enumerate(topics):
+        for watcher in range(args.topic_watchers):
+            slow = (index * args.topic_watchers + watcher) % round(1 / args.slow) == 0 if args.slow else False
+            tasks.append(asyncio.create_task(hub_watcher(hub, topic, slow, args.slow_delay, latencies)))
+    await asyncio.sleep(0)
+    for topic in topics:
+        hub.publish(topic.share_id, {"latitude": ORIGIN[0], "longitude": ORIGIN[1], "destination": "Destino",
+                                     "timestamp": int(time.time() * 1000), "sent": time.perf_counter()})
+    await asyncio.sleep(0.5)
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    latencies.clear()
+
+    publish_seconds = 0.0
+    started = time.perf_counter()
+    for round_index in range(args.rounds):
+        tick = time.perf_counter()
+        for index, topic in enumerate(topics):
+            hub.publish(topic.share_id, {"latitude": ORIGIN[0] + round_index * 1e-5, "longitude": ORIGIN[1] + index * 1e-5,
+                                         "destination": "Destino", "timestamp": int(time.time() * 1000),
+                                         "sent": time.perf_counter()})
+        publish_seconds += time.perf_counter() - tick
+        await asyncio.sleep(max(args.tick - (time.perf_counter() - tick), 0))
+    elapsed = time.perf_counter() - started
+    for topic in topics:
+        hub.close(topic.share_id)
+    await asyncio.gather(*tasks)
+
+    publishes = args.rounds * args.topics
+    stats = hub.snapshot()
+    print(f"Em processo: {args.topics} compartilhamentos x {args.topic_watchers} acompanhantes "
+          f"({args.slow:.0%} lentos, {args.slow_delay:g} s por posição), {args.rounds} rodadas a cada {args.tick * 1000:.0f} ms")
+    print(f"  publicação: {publish_seconds / publishes * 1e6:.2f} µs cada "
+          f"({publishes / publish_seconds:,.0f}/s) | entregas: {stats['delivered']:,} em {elapsed:.1f} s "
+          f"({stats['delivered'] / elapsed:,.0f}/s)")
+    print(f"  publicação -> acompanhante rápido ({len(latencies)}): {quantiles(latencies)}")
+    print(f"  posições descartadas para os lentos: {stats['skipped_stale']:,}")
+    print(f"  memória: {memory / 1e6:.1f} MB ({memory / args.topics:,.0f} bytes por compartilhamento com "
+          f"{args.topic_watchers} acompanhantes e a última posição)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--watchers", type=int, default=50, help="Acompanhantes do caminhante (ponta a ponta)")
+    parser.add_argument("--fixes", type=int, default=100, help="Localizações enviadas pelo caminhante")
+    parser.add_argument("--interval", type=float, default=0.1, help="Intervalo entre localizações (s)")
+    parser.add_argument("--topics", type=int, default=5000, help="Compartilhamentos simultâneos (em processo)")
+    parser.add_argument("--topic-watchers", type=int, default=2, help="Acompanhantes por compartilhamento (em processo)")
+    parser.add_argument("--rounds", type=int, default=10, help="Publicações por compartilhamento (em processo)")
+    parser.add_argument("--tick", type=float, default=1.0, help="Intervalo entre rodadas de publicação (s)")
+    parser.add_argument("--slow", type=float, default=0.1, help="Fração de acompanhantes lentos")
+    parser.add_argument("--slow-delay", type=float, default=3.0, help="Tempo de um acompanhante lento por posição (s)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(args.port)], stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(3) # Aguarda o servidor subir
+        asyncio.run(end_to_end(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+    asyncio.run(in_process(args))
+
+
+if __name__ == "__main__":
+    main_cli()
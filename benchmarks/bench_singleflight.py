@@ -0,0 +1,88 @@
+"""
+Verificação/benchmark do agrupamento de requisições idênticas (single-flight).
+
+Dispara N chamadas simultâneas e idênticas a `get_google_directions` usando um cliente
+Google Maps local (stub) com latência, e conta quantas chamadas chegaram ao "upstream".
+Também verifica que um erro do provedor é entregue a todos os que aguardavam.
+
+Uso:
+    python benchmarks/bench_singleflight.py --requests 1000 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEOCODE_CACHE_PATH", "") # Sem cache em disco: cada execução começa vazia
+
+import main
+from geocoding import GeocodeCache, Geocoder
+from providers import GoogleDirectionsProvider
+from route_cache import InMemoryRouteCacheBackend, RouteCache
+from routing import RoutingPool
+from singleflight import SingleFlight
+
+ROUTE = {"legs": [{"steps": [], "distance": {"value": 100}, "duration": {"value": 80}}],
+         "overview_polyline": {"points": ""}}
+
+
+class CountingStubClient:
+    """Cliente Google Maps falso que conta as chamadas recebidas."""
+
+    def __init__(self, latency: float, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.directions_calls = 0
+        self.geocode_calls = 0
+
+    def directions(self, **kwargs):
+        self.directions_calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("falha simulada do provedor")
+        return [ROUTE]
+
+    def geocode(self, address, **kwargs):
+        self.geocode_calls += 1
+        time.sleep(self.latency)
+        return [{"place_id": "stub-place", "geometry": {"location": {"lat": -23.55, "lng": -46.63}}}]
+
+
+async def run(requests: int, latency: float, fail: bool) -> None:
+    client = CountingStubClient(latency, fail)
+    main.initialize_providers() # Antes de trocar o provedor: a primeira chamada não pode sobrescrevê-lo
+    main.directions_provider = GoogleDirectionsProvider(client, max_concurrency=requests)
+    main.geocoder = Geocoder(main.directions_provider, GeocodeCache(path=None))
+    main.routing_pool = RoutingPool.from_providers({"google": main.directions_provider}, order=["google"])
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+    main.directions_flight = SingleFlight("directions")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(main.get_google_directions(-23.5612, -46.6559, "Hospital das Clínicas")
+                                     for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    assert all(result is results[0] for result in results), "Nem todos os chamadores receberam o mesmo resultado"
+    assert (results[0] is None) == fail, "Resultado inesperado"
+    assert client.directions_calls == 1, f"Esperada 1 chamada ao Directions, houve {client.directions_calls}"
+    assert client.geocode_calls == 1, f"Esperada 1 chamada ao Geocoding, houve {client.geocode_calls}"
+    label = "com erro" if fail else "sucesso"
+    print(f"{label:>9}: {requests} requisições em {elapsed:.2f}s | chamadas upstream: "
+          f"directions={client.directions_calls}, geocode={client.geocode_calls} | "
+          f"agrupadas: {main.directions_flight.stats['coalesced']}")
+    main.directions_provider.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latência simulada do provedor (s)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(run(args.requests, args.latency, fail=False))
+    asyncio.run(run(args.requests, args.latency, fail=True))
@@ -0,0 +1,147 @@
+"""
+Benchmark da partida a frio do backend, com orçamento de tempo verificado.
+
+Cada rodada é um processo Python novo (como um worker do uvicorn ou uma instância serverless
+recém-criada) que mede:
+
+    importação     `import main`, e quais SDKs pesados já foram carregados nesse ponto
+    lifespan       inicialização dos provedores (initialize_providers) antes de aceitar requisições
+    1ª requisição  POST /navigate/ com o cliente googlemaps real apontado para o servidor local
+                   de rotas gravadas (stubs.StubDirectionsServer), sem cache
+    2ª requisição  outra rota, já com tudo quente
+
+Imprime a mediana das rodadas e termina com código 1 se a importação ou a primeira requisição
+passarem do orçamento (--import-budget, --first-request-budget).
+
+Uso:
+    python benchmarks/bench_startup.py --runs 5 --import-budget 0.6 --first-request-budget 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+# SDKs que não devem ser importados junto com o módulo (só quando usados)
+HEAVY_MODULES = ("google.generativeai", "googlemaps", "google.cloud.texttospeech")
+
+
+async def child(fixture_path: str):
+    """Executado no processo novo: mede importação, lifespan e as duas primeiras requisições."""
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+    loaded_on_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    import httpx
+
+    with open(fixture_path, encoding="utf-8") as f:
+        fixture = json.load(f)
+    latitude, longitude = fixture["origin"]
+    body = {"latitude": latitude, "longitude": longitude, "destination": fixture["destination"]}
+
+    started = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        startup_seconds = time.perf_counter() - started
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            started = time.perf_counter()
+            first = await client.post("/navigate/", json=body)
+            first_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            second = await client.post("/navigate/", json={**body, "latitude": latitude + 0.001}) # Outra célula: sem cache
+            second_seconds = time.perf_counter() - started
+            ready = await client.get("/readyz")
+    print(json.dumps({
+        "import_s": import_seconds,
+        "startup_s": startup_seconds,
+        "first_request_s": first_seconds,
+        "second_request_s": second_seconds,
+        "status": [first.status_code, second.status_code, ready.status_code],
+        "routed": "routeData" in first.json(),
+        "loaded_on_import": loaded_on_import,
+        "loaded_after_requests": [name for name in HEAVY_MODULES if name in sys.modules],
+        "providers": ready.json()["providers"],
+    }))
+
+
+def run_child(stub_url: str, fixture_path: str) -> dict:
+    env = {
+        **os.environ,
+        "Maps_API_KEY": "AIzaStartupBenchStubKey",
+        "MAPS_API_BASE_URL": stub_url,
+        "GOOGLE_API_KEY": "", # Sem chamadas reais ao Gemini
+        "ROUTING_PROVIDERS": "google",
+        "ROUTE_CACHE_BACKEND": "memory",
+        "GEOCODE_CACHE_PATH": "",
+        "REFINEMENT_CACHE_PATH": "",
+        "SHARE_SPOOL_PATH": "",
+        "TTS_ENGINE": "",
+        "LOG_LEVEL": "WARNING",
+    }
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", fixture_path], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise SystemExit(f"Rodada falhou:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência do Directions/Geocoding falso (s)")
+    parser.add_argument("--import-budget", type=float, default=0.6, help="Máximo para `import main` (s, mediana)")
+    parser.add_argument("--first-request-budget", type=float, default=0.25,
+                        help="Máximo para a primeira requisição, descontada a latência do Google (s, mediana)")
+    parser.add_argument("--child", metavar="FIXTURE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT_DIR)
+        asyncio.run(child(args.child))
+        return
+
+    from load_test import FIXTURES_DIR, load_fixtures
+    from stubs import FaultInjector, StubDirectionsServer
+
+    fixtures = load_fixtures()
+    name = sorted(fixtures)[0]
+    with StubDirectionsServer(fixtures, faults=FaultInjector(args.latency)) as stub:
+        runs = [run_child(stub.url, os.path.join(FIXTURES_DIR, f"{name}.json")) for _ in range(args.runs)]
+
+    def median(key):
+        return statistics.median(run[key] for run in runs)
+
+    upstream = 2 * args.latency # Geocoding + Directions na primeira requisição
+    first_overhead = median("first_request_s") - upstream
+    print(f"{args.runs} rodadas, fixture '{name}', rota obtida: {all(run['routed'] for run in runs)}")
+    print(f"importação     {median('import_s') * 1000:7.1f} ms (orçamento {args.import_budget * 1000:.0f} ms) | "
+          f"SDKs carregados: {runs[0]['loaded_on_import'] or 'nenhum'}")
+    print(f"lifespan       {median('startup_s') * 1000:7.1f} ms | provedores: {runs[0]['providers']}")
+    print(f"1ª requisição  {median('first_request_s') * 1000:7.1f} ms (sem o Google: {first_overhead * 1000:.1f} ms, "
+          f"orçamento {args.first_request_budget * 1000:.0f} ms)")
+    print(f"2ª requisição  {median('second_request_s') * 1000:7.1f} ms | SDKs carregados no fim: "
+          f"{runs[0]['loaded_after_requests'] or 'nenhum'}")
+
+    failures = []
+    if median("import_s") > args.import_budget:
+        failures.append("importação")
+    if first_overhead > args.first_request_budget:
+        failures.append("primeira requisição")
+    if any(run["status"][:2] != [200, 200] for run in runs):
+        failures.append("requisições com erro")
+    if failures:
+        print(f"ACIMA DO ORÇAMENTO: {', '.join(failures)}")
+        sys.exit(1)
+    print("Dentro do orçamento.")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,116 @@
+"""
+Benchmark do áudio das instruções sintetizado no servidor (tts.py), com motor de TTS falso.
+
+Cada sessão planeja uma rota com frases próprias e o cliente pede o áudio de cada passo
+quando chega a hora de falá-lo (um passo a cada --step-interval segundos), por GET /tts/{id}.
+Compara a espera pelo áudio sem pré-cálculo (síntese sob demanda) e com a síntese dos próximos
+passos iniciada quando a rota é planejada. Depois verifica a rota repetida (só cache), as
+requisições com Range/If-None-Match e a remoção dos arquivos antigos quando o cache enche.
+
+Uso:
+    python benchmarks/bench_tts.py --sessions 20 --steps 8 --latency 0.4 --workers 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("ROUTE_CACHE_BACKEND", "memory")
+os.environ.setdefault("TTS_ENGINE", "")
+
+import httpx
+
+import main
+from stubs import FakeTTSEngine
+from tts import AudioCache, SpeechSynthesizer
+
+
+def instructions(session: int, steps: int) -> str:
+    lines = [f"Início da navegação. Saindo de Rua {session}, 1 em direção a Praça {session}."]
+    lines += [f"{i + 1}. Vire à direita na Rua {session}-{i} (andar por {50 + i * 10} metros)" for i in range(steps)]
+    lines.append(f"{steps + 1}. Você chegou ao seu destino.")
+    return "\n".join(lines)
+
+
+async def walk(client: httpx.AsyncClient, session: int, steps: int, step_interval: float) -> list:
+    """Planeja a rota e pede o áudio de cada linha na hora de falá-la; retorna a espera de cada pedido."""
+    ids = main.speech.prepare(instructions(session, steps))
+    waits = []
+    for index, audio_id in enumerate(ids):
+        if index:
+            await asyncio.sleep(step_interval) # Caminhando até o próximo passo
+        started = time.perf_counter()
+        response = await client.get(f"/tts/{audio_id}")
+        response.raise_for_status()
+        waits.append(time.perf_counter() - started)
+    return waits
+
+
+def report(label: str, results: list, engine: FakeTTSEngine):
+    first = [waits[0] for waits in results]
+    upcoming = [wait for waits in results for wait in waits[1:]]
+    print(f"{label:<18} 1ª frase p50={statistics.median(first) * 1000:7.1f} ms | "
+          f"próximos passos p50={statistics.median(upcoming) * 1000:6.1f} ms "
+          f"max={max(upcoming) * 1000:6.1f} ms | sínteses: {engine.calls}")
+
+
+async def run(args):
+    main.initialize_providers() # Sem lifespan aqui: inicializa antes de trocar o `speech`
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        with tempfile.TemporaryDirectory() as directory:
+            for label, precompute in (("sob demanda", 0), ("pré-calculado", args.steps + 2)):
+                engine = FakeTTSEngine(args.latency)
+                if main.speech:
+                    await main.speech.stop()
+                main.speech = SpeechSynthesizer(engine, AudioCache(os.path.join(directory, label)),
+                                                workers=args.workers, precompute=precompute)
+                results = await asyncio.gather(*(walk(client, session, args.steps, args.step_interval)
+                                                 for session in range(args.sessions)))
+                report(label, results, engine)
+
+            # Mesma rota planejada de novo (outro usuário, mesmo trajeto): nenhuma síntese nova
+            calls = engine.calls
+            results = await asyncio.gather(*(walk(client, session, args.steps, 0) for session in range(args.sessions)))
+            report("rota repetida", results, engine)
+            print(f"{'':<18} sínteses novas: {engine.calls - calls}")
+
+            audio_id = main.speech.prepare(instructions(0, args.steps))[1]
+            full = await client.get(f"/tts/{audio_id}")
+            partial = await client.get(f"/tts/{audio_id}", headers={"Range": "bytes=0-1023"})
+            cached = await client.get(f"/tts/{audio_id}", headers={"If-None-Match": full.headers["etag"]})
+            print(f"HTTP               200 {len(full.content)} bytes ({full.headers['cache-control']}) | "
+                  f"Range {partial.status_code} {partial.headers.get('content-range')} | "
+                  f"If-None-Match {cached.status_code}")
+
+            # Cache pequeno: os arquivos usados há mais tempo saem primeiro
+            engine = FakeTTSEngine(0)
+            cache = AudioCache(os.path.join(directory, "pequeno"), max_bytes=args.small_cache_kb * 1024, in_use_seconds=0)
+            await main.speech.stop()
+            main.speech = SpeechSynthesizer(engine, cache, precompute=0)
+            for session in range(args.sessions): # Uma sessão por vez: sem a carência, nada pode estar sendo enviado
+                await walk(client, session, args.steps, 0)
+            print(f"cache de {args.small_cache_kb} KB    {cache.snapshot()}")
+            await main.speech.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=8, help="Passos por rota")
+    parser.add_argument("--latency", type=float, default=0.4, help="Latência da síntese de uma frase (s)")
+    parser.add_argument("--step-interval", type=float, default=2.0, help="Intervalo entre os passos falados (s)")
+    parser.add_argument("--workers", type=int, default=8, help="Sínteses simultâneas (TTS_WORKERS)")
+    parser.add_argument("--small-cache-kb", type=int, default=2048)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
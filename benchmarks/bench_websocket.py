@@ -0,0 +1,132 @@
+"""
+Teste de carga da navegação ao vivo (WebSocket /navigate/ws).
+
+Sobe o backend em um subprocesso com o cliente Google Maps falso (benchmarks/stubs.py) e
+abre N conexões simultâneas. Cada conexão "caminha" pela rota enviando uma localização a
+cada `--interval` segundos e mede o tempo até a resposta do servidor.
+
+Uso:
+    python benchmarks/bench_websocket.py --connections 1000 --duration 30
+    # Para 10k conexões, aumente o limite de arquivos abertos antes: ulimit -n 65536
+
+Também é possível apontar para um servidor já em execução com --url.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from stubs import DEGREES_PER_100M_LAT
+
+
+def serve(port: int, latency: float):
+    """Executa o backend com o stub do Google Maps (usado no subprocesso)."""
+    import uvicorn
+    sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+    os.environ.setdefault("DIRECTIONS_CLIENT_RATE_PER_MINUTE", "0") # Todas as conexões saem do mesmo IP (127.0.0.1)
+    import main
+    from stubs import StubMapsClient, install_stub
+
+    install_stub(main, StubMapsClient(latency))
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", ws_max_queue=4)
+
+
+async def walker(url: str, index: int, duration: float, interval: float, latencies: dict, counters: dict):
+    # Origens espalhadas (~2 km) para que as rotas não sejam todas iguais
+    latitude = -23.55 + random.uniform(-0.01, 0.01)
+    longitude = -46.63 + random.uniform(-0.01, 0.01)
+    try:
+        async with websockets.connect(url, open_timeout=60, ping_interval=None) as ws:
+            counters["connected"] += 1
+            await ws.send(json.dumps({"type": "start", "destination": f"Destino {index % 50}"}))
+            deadline = time.monotonic() + duration
+            await asyncio.sleep(random.uniform(0, interval)) # Espalha os envios no tempo
+            step = 0
+            while time.monotonic() < deadline:
+                # Caminha ~5 m para o leste a cada localização
+                fix_longitude = longitude + step * DEGREES_PER_100M_LAT * 0.05
+                sent = time.perf_counter()
+                await ws.send(json.dumps({"type": "fix", "latitude": latitude, "longitude": fix_longitude}))
+                while True:
+                    message = json.loads(await ws.recv())
+                    if message["type"] in ("route", "progress", "error"):
+                        break
+                    if message["type"] == "ping":
+                        await ws.send(json.dumps({"type": "pong"}))
+                # "route" inclui a chamada ao Directions; "progress" é o caminho quente (sem upstream)
+                latencies.setdefault(message["type"], []).append(time.perf_counter() - sent)
+                counters["messages"] += 1
+                step += 1
+                await asyncio.sleep(interval)
+    except Exception as e:
+        counters["errors"] += 1
+        counters.setdefault("last_error", repr(e))
+
+
+async def run_load(url: str, connections: int, duration: float, interval: float, ramp: float):
+    latencies = {}
+    counters = {"connected": 0, "messages": 0, "errors": 0}
+    start = time.perf_counter()
+    tasks = []
+    for index in range(connections):
+        tasks.append(asyncio.create_task(walker(url, index, duration, interval, latencies, counters)))
+        if ramp:
+            await asyncio.sleep(ramp / connections)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    print(f"Conexões: {counters['connected']}/{connections} | erros: {counters['errors']} "
+          f"| mensagens: {counters['messages']} em {elapsed:.1f}s ({counters['messages'] / elapsed:.0f}/s)")
+    for kind, values in sorted(latencies.items()):
+        if len(values) < 2:
+            continue
+        quantiles = statistics.quantiles(values, n=100)
+        print(f"Latência localização -> '{kind}' ({len(values)}): p50={quantiles[49] * 1000:.1f} ms "
+              f"p95={quantiles[94] * 1000:.1f} ms p99={quantiles[98] * 1000:.1f} ms")
+    if "last_error" in counters:
+        print(f"Último erro: {counters['last_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30, help="Duração de cada caminhada (s)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Intervalo entre localizações (s)")
+    parser.add_argument("--ramp", type=float, default=10, help="Tempo para abrir todas as conexões (s)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latência simulada do Directions (s)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="Servidor já em execução (ex.: ws://127.0.0.1:8000/navigate/ws)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.latency)
+        return
+
+    server = None
+    url = args.url
+    if not url:
+        url = f"ws://127.0.0.1:{args.port}/navigate/ws"
+        server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(args.port),
+                                   "--latency", str(args.latency)], stdout=subprocess.DEVNULL)
+        time.sleep(3) # Aguarda o servidor subir
+    try:
+        asyncio.run(run_load(url, args.connections, args.duration, args.interval, args.ramp))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
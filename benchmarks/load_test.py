@@ -0,0 +1,374 @@
+"""
+Teste de carga de /navigate/ com o backend real e um servidor Directions/Geocoding local.
+
+Sobe o app com uvicorn (--workers processos) apontando o cliente `googlemaps` para um servidor
+local (stubs.StubDirectionsServer, via MAPS_API_BASE_URL) que responde com rotas gravadas em
+benchmarks/fixtures/directions/*.json, com latência e falhas configuráveis. N caminhantes
+simulados percorrem essas rotas com ruído de GPS, enviando a localização na mesma cadência do
+frontend (BACKEND_UPDATE_INTERVAL, 10 s; --speedup comprime o tempo), com session_id e
+If-None-Match como o script.js.
+
+Relata latência p50/p95/p99 (rota nova x só progresso), vazão, chamadas ao "Google" e memória
+por worker, e grava o resultado em benchmarks/results/ para comparar entre commits.
+
+Uso:
+    python benchmarks/load_test.py --walkers 200 --duration 60 --workers 2 --latency 0.15
+    python benchmarks/load_test.py --walkers 200 --duration 60 --compare benchmarks/results/<anterior>.json
+    python benchmarks/load_test.py --write-sample-fixtures          # fixtures a partir de data/sample.osm
+    python benchmarks/load_test.py --record "Av. Paulista, 1578" --origin=-23.5614,-46.6559 --name paulista
+                                                                     # grava uma rota real (usa Maps_API_KEY)
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from geometry import METERS_PER_DEGREE
+from route_model import Route
+from stubs import FaultInjector, StubDirectionsServer
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures", "directions")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+UPDATE_INTERVAL_SECONDS = 10 # BACKEND_UPDATE_INTERVAL do script.js
+WALKING_SPEED_MPS = 1.3
+GPS_NOISE_METERS = 5 # Desvio padrão do erro do GPS de um celular ao ar livre
+
+
+# --- Fixtures ---
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> dict:
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+    return fixtures
+
+
+def save_fixture(directory: str, name: str, fixture: dict):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+
+def write_sample_fixtures(directory: str = FIXTURES_DIR):
+    """Gera fixtures com o roteador offline sobre data/sample.osm (mesmo formato da Directions API)."""
+    from offline_router import OfflineRouter
+
+    router = OfflineRouter.from_osm()
+    path = router.graph.coords
+    south, north = float(path[:, 0].min()), float(path[:, 0].max())
+    west, east = float(path[:, 1].min()), float(path[:, 1].max())
+    margin = 0.1
+    corners = {
+        "noroeste-sudeste": ((north - margin * (north - south), west + margin * (east - west)),
+                             (south + margin * (north - south), east - margin * (east - west))),
+        "sudoeste-nordeste": ((south + margin * (north - south), west + margin * (east - west)),
+                              (north - margin * (north - south), east - margin * (east - west))),
+        "oeste-leste": (((north + south) / 2, west + margin * (east - west)), ((north + south) / 2, east - margin * (east - west))),
+        "norte-sul": ((north - margin * (north - south), (west + east) / 2), (south + margin * (north - south), (west + east) / 2)),
+    }
+    for name, (origin, destination) in corners.items():
+        routes = router.directions(f"{origin[0]},{origin[1]}", f"{destination[0]},{destination[1]}")
+        leg = routes[0]["legs"][0]
+        end = leg["end_location"]
+        save_fixture(directory, name, {
+            "destination": f"Ponto de teste {name}",
+            "origin": [leg["start_location"]["lat"], leg["start_location"]["lng"]],
+            "place": {"formatted_address": leg["end_address"], "lat": end["lat"], "lng": end["lng"]},
+            "source": "offline_router (data/sample.osm)",
+            "route": routes[0],
+        })
+        print(f"Fixture '{name}': {len(leg['steps'])} passos, {leg['distance']['value']} m")
+
+
+def record_fixture(destination: str, origin: str, name: str, directory: str = FIXTURES_DIR):
+    """Grava uma rota real da Directions API (consome cota: uma chamada de Directions e uma de Geocoding)."""
+    import googlemaps
+
+    client = googlemaps.Client(key=os.environ["Maps_API_KEY"])
+    places = client.geocode(destination, language="pt-BR")
+    if not places:
+        raise SystemExit(f"Destino '{destination}' não encontrado.")
+    location = places[0]["geometry"]["location"]
+    routes = client.directions(origin, f"place_id:{places[0]['place_id']}", mode="walking", language="pt-BR", units="metric")
+    if not routes:
+        raise SystemExit("Nenhuma rota encontrada.")
+    latitude, longitude = (float(value) for value in origin.split(","))
+    save_fixture(directory, name, {
+        "destination": destination,
+        "origin": [latitude, longitude],
+        "place": {"formatted_address": places[0].get("formatted_address", destination), **location},
+        "source": "Google Directions API",
+        "route": routes[0],
+    })
+    print(f"Fixture '{name}' gravada com {len(routes[0]['legs'][0]['steps'])} passos.")
+
+
+# --- Caminhantes ---
+
+class Walk:
+    """Posições ao longo da rota de uma fixture, com ruído de GPS."""
+
+    def __init__(self, fixture: dict):
+        self.destination = fixture["destination"]
+        self.path = Route.from_directions(fixture["route"]).coordinates()
+        scale = np.array([METERS_PER_DEGREE, METERS_PER_DEGREE * math.cos(math.radians(self.path[0, 0]))])
+        segments = np.linalg.norm(np.diff(self.path, axis=0) * scale, axis=1)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(segments)))
+        self.length = float(self.cumulative[-1])
+        self.scale = scale
+
+    def position(self, walked: float, rng: random.Random) -> tuple:
+        walked = min(walked, self.length)
+        latitude = float(np.interp(walked, self.cumulative, self.path[:, 0]))
+        longitude = float(np.interp(walked, self.cumulative, self.path[:, 1]))
+        return (latitude + rng.gauss(0, GPS_NOISE_METERS) / self.scale[0],
+                longitude + rng.gauss(0, GPS_NOISE_METERS) / self.scale[1])
+
+
+async def walker(base_url: str, walks: list, rng: random.Random, interval: float, deadline: float, stats: dict):
+    """Caminha de uma fixture à outra até o fim do teste, como o frontend (sessão + If-None-Match)."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client: # Conexão própria: fica no mesmo worker
+        await asyncio.sleep(rng.uniform(0, interval)) # Espalha os envios no tempo
+        while time.monotonic() < deadline:
+            walk = rng.choice(walks)
+            walked = 0.0
+            session_id = route_version = None
+            while time.monotonic() < deadline:
+                latitude, longitude = walk.position(walked, rng)
+                body = {"latitude": latitude, "longitude": longitude, "destination": walk.destination,
+                        "session_id": session_id}
+                headers = {"If-None-Match": f'"{route_version}"'} if route_version else {}
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/navigate/", json=body, headers=headers)
+                    elapsed = time.perf_counter() - started
+                    response.raise_for_status()
+                    data = response.json()
+                except Exception as e:
+                    stats["errors"] += 1
+                    stats["last_error"] = repr(e)
+                    await asyncio.sleep(interval)
+                    continue
+                kind = "progress" if data.get("unchanged") else "route" if data.get("routeData") else "other"
+                stats["latencies"].setdefault(kind, []).append(elapsed)
+                if data.get("progress", {}).get("arrived") or walked >= walk.length:
+                    stats["arrivals"] += 1
+                    break
+                session_id = data.get("sessionId", session_id)
+                route_version = data.get("routeVersion", route_version)
+                walked += WALKING_SPEED_MPS * UPDATE_INTERVAL_SECONDS
+                await asyncio.sleep(interval)
+
+
+# --- Servidor ---
+
+def start_app(port: int, workers: int, stub_url: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "Maps_API_KEY": "AIzaLoadTestStubKey", # O cliente googlemaps exige o prefixo "AIza"
+        "MAPS_API_BASE_URL": stub_url,
+        "GOOGLE_API_KEY": "", # Sem Gemini
+        "ROUTING_PROVIDERS": "google",
+        "ROUTE_CACHE_BACKEND": "memory",
+        "GEOCODE_CACHE_PATH": "",
+        "REFINEMENT_CACHE_PATH": "",
+        "SHARE_SPOOL_PATH": "",
+        "TTS_ENGINE": "",
+        "DIRECTIONS_CLIENT_RATE_PER_MINUTE": "0", # Todos os caminhantes saem do mesmo IP (127.0.0.1)
+    }
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"],
+                            cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/routing_stats/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("O backend não respondeu a tempo.")
+
+
+def worker_memory(pid: int) -> list:
+    """RSS atual e pico (MB) de cada worker do uvicorn (Linux, via /proc)."""
+    def status(process: int) -> dict:
+        with open(f"/proc/{process}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss_mb": int(fields["VmRSS"].split()[0]) / 1024, "peak_mb": int(fields["VmHWM"].split()[0]) / 1024}
+
+    try:
+        children = []
+        for stat_path in glob.glob("/proc/[0-9]*/stat"):
+            try:
+                with open(stat_path) as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                if int(fields[1]) == pid:
+                    process = int(stat_path.split("/")[2])
+                    with open(f"/proc/{process}/cmdline", "rb") as f:
+                        if b"resource_tracker" not in f.read():
+                            children.append(process)
+            except (OSError, IndexError, ValueError):
+                continue
+        return [status(process) for process in (children or [pid])]
+    except OSError:
+        return []
+
+
+# --- Resultados ---
+
+def summarize(values: list) -> dict:
+    if len(values) < 2:
+        return {"count": len(values)}
+    quantiles = statistics.quantiles(values, n=100)
+    return {"count": len(values), "p50_ms": quantiles[49] * 1000, "p95_ms": quantiles[94] * 1000,
+            "p99_ms": quantiles[98] * 1000, "max_ms": max(values) * 1000}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=30).stdout.strip() or "desconhecida"
+    except (OSError, subprocess.SubprocessError):
+        return "desconhecida"
+
+
+def print_report(results: dict):
+    totals = results["totals"]
+    print(f"{totals['requests']} requisições em {totals['elapsed_s']:.1f}s ({totals['throughput_rps']:.1f}/s) | "
+          f"erros: {totals['errors']} | chegadas: {totals['arrivals']}")
+    for kind, summary in results["latency"].items():
+        if "p50_ms" in summary:
+            print(f"  {kind:<9} ({summary['count']:>6}) p50={summary['p50_ms']:7.1f} ms  p95={summary['p95_ms']:7.1f} ms  "
+                  f"p99={summary['p99_ms']:7.1f} ms  max={summary['max_ms']:7.1f} ms")
+    upstream = results["upstream"]
+    print(f"  chamadas ao Google: directions={upstream['directions']} geocode={upstream['geocode']} "
+          f"({upstream['directions'] / max(totals['requests'], 1):.3f} por requisição)")
+    for index, memory in enumerate(results["memory"]):
+        print(f"  worker {index}: RSS {memory['rss_mb']:.0f} MB (pico {memory['peak_mb']:.0f} MB)")
+
+
+def compare(previous: dict, current: dict):
+    """Diferenças entre duas execuções (valores maiores são piores, exceto a vazão)."""
+    print(f"\nComparação com {previous['revision']} ({previous['timestamp']}):")
+    rows = [("vazão (req/s)", previous["totals"]["throughput_rps"], current["totals"]["throughput_rps"]),
+            ("chamadas ao Directions", previous["upstream"]["directions"], current["upstream"]["directions"])]
+    for kind in current["latency"]:
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric in current["latency"][kind] and metric in previous["latency"].get(kind, {}):
+                rows.append((f"{kind} {metric}", previous["latency"][kind][metric], current["latency"][kind][metric]))
+    if previous["memory"] and current["memory"]:
+        rows.append(("pico de memória/worker (MB)", max(m["peak_mb"] for m in previous["memory"]),
+                     max(m["peak_mb"] for m in current["memory"])))
+    for label, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"  {label:<28} {before:10.1f} -> {after:10.1f} ({change:+.1f}%)")
+
+
+async def run(args) -> dict:
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"Nenhuma fixture em {args.fixtures}. Use --write-sample-fixtures ou --record.")
+    walks = [Walk(fixture) for fixture in fixtures.values()]
+    faults = FaultInjector(args.latency, args.tail_latency, args.tail_probability, args.failure_rate, seed=args.seed)
+    base_url = f"http://127.0.0.1:{args.port}"
+    interval = UPDATE_INTERVAL_SECONDS / args.speedup
+
+    with StubDirectionsServer(fixtures, faults=faults) as stub:
+        server = start_app(args.port, args.workers, stub.url)
+        try:
+            await wait_ready(base_url)
+            stats = {"latencies": {}, "errors": 0, "arrivals": 0}
+            rng = random.Random(args.seed)
+            deadline = time.monotonic() + args.duration
+            start = time.perf_counter()
+            await asyncio.gather(*(walker(base_url, walks, random.Random(rng.random()), interval, deadline, stats)
+                                   for _ in range(args.walkers)))
+            elapsed = time.perf_counter() - start
+            memory = worker_memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+    requests = sum(len(values) for values in stats["latencies"].values())
+    every = [value for values in stats["latencies"].values() for value in values]
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "fixtures": sorted(fixtures),
+        "totals": {"requests": requests, "errors": stats["errors"], "arrivals": stats["arrivals"],
+                   "elapsed_s": elapsed, "throughput_rps": requests / elapsed},
+        "latency": {"all": summarize(every), **{kind: summarize(values) for kind, values in sorted(stats["latencies"].items())}},
+        "upstream": {"directions": stub.calls["directions"], "geocode": stub.calls["geocode"], "failed": stub.calls["failed"]},
+        "memory": memory,
+    }
+    if stats.get("last_error"):
+        results["last_error"] = stats["last_error"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--walkers", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=60, help="Duração do teste (s)")
+    parser.add_argument("--workers", type=int, default=1, help="Processos do uvicorn")
+    parser.add_argument("--speedup", type=float, default=10, help="Compressão do tempo (10: uma atualização por segundo)")
+    parser.add_argument("--latency", type=float, default=0.15, help="Latência do Directions/Geocoding falso (s)")
+    parser.add_argument("--tail-latency", type=float, default=1.5)
+    parser.add_argument("--tail-probability", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--output", help="Arquivo de resultados (padrão: benchmarks/results/load-<data>-<commit>.json)")
+    parser.add_argument("--compare", help="Resultado anterior para comparar")
+    parser.add_argument("--write-sample-fixtures", action="store_true")
+    parser.add_argument("--record", metavar="DESTINO", help="Grava uma fixture real da Directions API")
+    parser.add_argument("--origin", help="Origem \"lat,lng\" para --record")
+    parser.add_argument("--name", help="Nome da fixture gravada com --record")
+    args = parser.parse_args()
+
+    if args.write_sample_fixtures:
+        write_sample_fixtures(args.fixtures)
+        return
+    if args.record:
+        if not args.origin or not args.name:
+            parser.error("--record exige --origin e --name")
+        record_fixture(args.record, args.origin, args.name, args.fixtures)
+        return
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}-{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(f"Resultados gravados em {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
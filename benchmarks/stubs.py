@@ -0,0 +1,384 @@
+"""
+Cliente Google Maps, servidores Directions/Geocoding e OSRM, modelo Gemini, servidor SMTP e
+motor de TTS falsos para os benchmarks (não consomem cota nem enviam mensagens de verdade).
+
+A rota gerada parte exatamente da origem pedida: segue 300 m para leste e depois 300 m
+para o norte, em três passos, no mesmo formato da resposta da Directions API (ou do OSRM).
+Ambos permitem injetar latência, cauda lenta e falhas, para testar hedge e circuit breaker.
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geometry import encode_polyline
+
+DEGREES_PER_100M_LAT = 100 / 111195.0
+
+
+def synthetic_route(latitude: float, longitude: float) -> dict:
+    """Rota em "L" (leste e depois norte) começando em (latitude, longitude)."""
+    degrees_per_100m_lng = DEGREES_PER_100M_LAT / math.cos(math.radians(latitude))
+    east = [(latitude, longitude + i * degrees_per_100m_lng) for i in range(4)]
+    north = [(latitude + i * DEGREES_PER_100M_LAT, east[-1][1]) for i in range(4)]
+    pieces = [("Siga para o <b>leste</b> na <b>R. Stub</b>", east[:3]),
+              ("Continue na <b>R. Stub</b>", east[2:]),
+              ("Vire à <b>esquerda</b> na <b>Av. Benchmark</b>", north)]
+    steps = []
+    for text, points in pieces:
+        distance = 100 * (len(points) - 1)
+        steps.append({
+            "html_instructions": text,
+            "distance": {"value": distance, "text": f"{distance} m"},
+            "duration": {"value": int(distance / 1.3), "text": ""},
+            "start_location": {"lat": points[0][0], "lng": points[0][1]},
+            "end_location": {"lat": points[-1][0], "lng": points[-1][1]},
+            "polyline": {"points": encode_polyline(points)},
+            "travel_mode": "WALKING",
+        })
+    path = east + north[1:]
+    return {
+        "legs": [{
+            "steps": steps,
+            "start_address": "R. Stub, 1",
+            "end_address": "Av. Benchmark, 300",
+            "distance": {"value": 600, "text": "600 m"},
+            "duration": {"value": 461, "text": "8 min"},
+            "start_location": steps[0]["start_location"],
+            "end_location": steps[-1]["end_location"],
+        }],
+        "overview_polyline": {"points": encode_polyline(path)},
+        "summary": "R. Stub",
+    }
+
+
+class FakeRefinementModel:
+    """
+    Imita GeminiStreamingModel: devolve as instruções do prompt reescritas, linha a linha,
+    com latência até o primeiro trecho e entre trechos. `hang=True` simula um modelo que não responde.
+    """
+
+    def __init__(self, first_chunk_latency: float = 0.8, chunk_delay: float = 0.1, fail: bool = False, hang: bool = False):
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_delay = chunk_delay
+        self.fail = fail
+        self.hang = hang
+        self.calls = 0
+
+    async def stream(self, prompt: str):
+        self.calls += 1
+        await asyncio.sleep(3600 if self.hang else self.first_chunk_latency)
+        if self.fail:
+            raise RuntimeError("falha simulada do Gemini")
+        original = prompt.split("Instruções originais:")[1].split("Formato desejado:")[0].strip()
+        for line in original.splitlines():
+            yield f"{line.strip()} Preste atenção ao piso e aos obstáculos.\n"
+            await asyncio.sleep(self.chunk_delay)
+
+
+class FakeTTSEngine:
+    """Imita os motores de tts.py: WAV de silêncio com ~60 ms por caractere, após `latency` segundos."""
+
+    extension = "wav"
+
+    def __init__(self, latency: float = 0.4, sample_rate: int = 16000):
+        self.latency = latency
+        self.sample_rate = sample_rate
+        self.identity = f"fake:{sample_rate}"
+        self.calls = 0
+
+    def synthesize(self, text: str) -> bytes:
+        self.calls += 1
+        time.sleep(self.latency)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(self.sample_rate)
+            audio.writeframes(b"\0\0" * int(self.sample_rate * 0.06 * len(text)))
+        return buffer.getvalue()
+
+
+class FaultInjector:
+    """Latência base + cauda lenta ocasional + falhas aleatórias."""
+
+    def __init__(self, latency: float = 0.0, tail_latency: float = 0.0, tail_probability: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_probability = tail_probability
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def wait(self) -> bool:
+        """Dorme a latência sorteada; retorna False se esta chamada deve falhar."""
+        slow = self.random.random() < self.tail_probability
+        time.sleep(self.tail_latency if slow else self.latency)
+        return self.random.random() >= self.failure_rate
+
+
+class StubMapsClient:
+    """Imita os métodos do googlemaps.Client usados pelo backend, com latência configurável."""
+
+    def __init__(self, latency: float = 0.0, tail_latency: float = 0.0, tail_probability: float = 0.0,
+                 failure_rate: float = 0.0):
+        self.latency = latency
+        self.faults = FaultInjector(latency, tail_latency, tail_probability, failure_rate)
+        self.directions_calls = 0
+        self.geocode_calls = 0
+
+    def directions(self, origin: str, destination: str, **kwargs):
+        self.directions_calls += 1
+        if not self.faults.wait():
+            raise RuntimeError("falha simulada do Google Directions")
+        latitude, longitude = (float(value) for value in origin.split(","))
+        return [synthetic_route(latitude, longitude)]
+
+    def geocode(self, address: str, **kwargs):
+        self.geocode_calls += 1
+        time.sleep(self.latency)
+        return [{"place_id": f"stub:{address}", "formatted_address": address,
+                 "geometry": {"location": {"lat": -23.55, "lng": -46.63}}}]
+
+
+def install_stub(main_module, client: StubMapsClient):
+    """
+    Substitui o cliente Google Maps do backend (módulo `main`) pelo stub. Os demais provedores
+    (Gemini, TTS) são inicializados antes, como no lifespan, para que ele não sobrescreva o stub.
+    """
+    from geocoding import Geocoder
+    from providers import GoogleDirectionsProvider
+    from routing import RoutingPool
+
+    main_module.initialize_providers()
+    main_module.gmaps = client
+    main_module.directions_provider = GoogleDirectionsProvider(client)
+    main_module.geocoder = Geocoder(main_module.directions_provider, main_module.geocode_cache)
+    main_module.routing_pool = RoutingPool.from_providers({"google": main_module.directions_provider}, order=["google"])
+
+
+def synthetic_osrm_response(latitude: float, longitude: float) -> dict:
+    """A mesma rota de `synthetic_route`, no formato de /route/v1 do OSRM (steps=true, geometries=polyline)."""
+    from geometry import decode_polyline
+
+    steps = []
+    bearing_before = 0
+    for step in synthetic_route(latitude, longitude)["legs"][0]["steps"]:
+        points = decode_polyline(step["polyline"]["points"])
+        (lat_a, lng_a), (lat_b, lng_b) = points[0], points[1]
+        bearing_after = round(math.degrees(math.atan2((lng_b - lng_a) * math.cos(math.radians(lat_a)), lat_b - lat_a)) % 360)
+        steps.append({
+            "geometry": step["polyline"]["points"],
+            "maneuver": {"type": "depart" if not steps else "turn", "bearing_before": bearing_before,
+                         "bearing_after": bearing_after, "location": [lng_a, lat_a]},
+            "name": "R. Stub" if bearing_after == 90 else "Av. Benchmark",
+            "distance": step["distance"]["value"],
+            "duration": step["duration"]["value"],
+        })
+        bearing_before = bearing_after
+    end = steps[-1]["maneuver"]["location"]
+    steps.append({"geometry": encode_polyline([(end[1], end[0])] * 2), "name": "Av. Benchmark", "distance": 0, "duration": 0,
+                  "maneuver": {"type": "arrive", "bearing_before": 0, "bearing_after": 0, "location": end}})
+    return {"code": "Ok", "routes": [{"legs": [{"steps": steps}], "distance": 600, "duration": 461}]}
+
+
+class StubOSRMServer:
+    """Servidor HTTP compatível com /route/v1 do OSRM, em uma thread, com falhas injetáveis."""
+
+    def __init__(self, port: int = 0, faults: FaultInjector = None):
+        self.faults = faults or FaultInjector()
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if not stub.faults.wait():
+                    self._reply(500, {"code": "InternalError", "message": "falha simulada"})
+                    return
+                try:
+                    coordinates = urlparse(self.path).path.rsplit("/", 1)[1]
+                    longitude, latitude = (float(value) for value in coordinates.split(";")[0].split(","))
+                except (IndexError, ValueError):
+                    self._reply(400, {"code": "InvalidQuery", "message": "coordenadas inválidas"})
+                    return
+                self._reply(200, synthetic_osrm_response(latitude, longitude))
+
+            def _reply(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        server_class = type("StubServer", (ThreadingHTTPServer,), {"request_queue_size": 1024}) # Backlog padrão (5) causa atrasos de 1 s
+        self.server = server_class(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubOSRMServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubDirectionsServer:
+    """
+    Servidor HTTP local que imita as APIs Directions e Geocoding do Google a partir de fixtures
+    gravadas (benchmarks/fixtures/directions/*.json). O backend fala com ele pelo cliente
+    `googlemaps` de verdade, apontado para cá com MAPS_API_BASE_URL.
+
+    O geocoding devolve `place_id` "fixture-<nome>" para o texto de destino da fixture, e o
+    Directions devolve a rota gravada para esse place_id (qualquer origem).
+    """
+
+    def __init__(self, fixtures: dict, port: int = 0, faults: FaultInjector = None):
+        self.fixtures = fixtures
+        self.faults = faults or FaultInjector()
+        self.calls = {"directions": 0, "geocode": 0, "failed": 0}
+        self._by_text = {fixture["destination"].strip().lower(): name for name, fixture in fixtures.items()}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, como a API real
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                api = url.path.rstrip("/").split("/")[-2] if url.path.endswith("/json") else ""
+                if api not in ("directions", "geocode"):
+                    self._reply(404, {"status": "NOT_FOUND"})
+                    return
+                stub.calls[api] += 1
+                if not stub.faults.wait():
+                    stub.calls["failed"] += 1
+                    self._reply(500, {"status": "UNKNOWN_ERROR"})
+                    return
+                self._reply(200, stub.directions(query) if api == "directions" else stub.geocode(query))
+
+            def _reply(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        server_class = type("StubServer", (ThreadingHTTPServer,), {"request_queue_size": 1024})
+        self.server = server_class(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _fixture_for(self, destination: str):
+        if destination.startswith("place_id:fixture-"):
+            return self.fixtures.get(destination[len("place_id:fixture-"):])
+        name = self._by_text.get(destination.strip().lower())
+        return self.fixtures.get(name) if name else None
+
+    def directions(self, query: dict) -> dict:
+        fixture = self._fixture_for(query.get("destination", ""))
+        if fixture is None:
+            return {"status": "ZERO_RESULTS", "routes": []}
+        return {"status": "OK", "routes": [fixture["route"]], "geocoded_waypoints": []}
+
+    def geocode(self, query: dict) -> dict:
+        name = self._by_text.get(query.get("address", "").strip().lower())
+        if name is None:
+            return {"status": "ZERO_RESULTS", "results": []}
+        place = self.fixtures[name]["place"]
+        return {"status": "OK", "results": [{
+            "place_id": f"fixture-{name}",
+            "formatted_address": place["formatted_address"],
+            "geometry": {"location": {"lat": place["lat"], "lng": place["lng"]}},
+        }]}
+
+    def __enter__(self) -> "StubDirectionsServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeSMTPServer:
+    """Servidor SMTP mínimo (sem TLS/autenticação) que conta as mensagens recebidas."""
+
+    def __init__(self, port: int = 0, connect_latency: float = 0.0, message_latency: float = 0.0,
+                 failure_rate: float = 0.0):
+        self.connect_latency = connect_latency
+        self.message_latency = message_latency
+        self.faults = FaultInjector(message_latency, failure_rate=failure_rate)
+        self.connections = 0
+        self.messages = 0
+        self.rejected = 0
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub.connections += 1
+                time.sleep(stub.connect_latency)
+                self.wfile.write(b"220 fake-smtp\r\n")
+                in_data = False
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    if in_data:
+                        if line == b".\r\n":
+                            in_data = False
+                            if stub.faults.wait():
+                                stub.messages += 1
+                                self.wfile.write(b"250 queued\r\n")
+                            else:
+                                stub.rejected += 1
+                                self.wfile.write(b"451 falha simulada\r\n")
+                        continue
+                    command = line[:4].upper()
+                    if command == b"DATA":
+                        in_data = True
+                        self.wfile.write(b"354 end with .\r\n")
+                    elif command == b"QUIT":
+                        self.wfile.write(b"221 bye\r\n")
+                        return
+                    elif command in (b"EHLO", b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                        self.wfile.write(b"250 ok\r\n")
+                    else:
+                        self.wfile.write(b"502 not implemented\r\n")
+
+        server_class = type("FakeSMTP", (socketserver.ThreadingTCPServer,),
+                            {"request_queue_size": 1024, "allow_reuse_address": True, "daemon_threads": True})
+        self.server = server_class(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeSMTPServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
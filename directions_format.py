@@ -0,0 +1,89 @@
+"""
+Montagem de respostas no formato da Google Directions API.
+
+Os motores de rota alternativos (roteador offline, servidores OSRM) convertem seus
+resultados para este formato, para que process_google_directions_response, as sessões
+de navegação e o cache de rotas funcionem sem saber qual motor respondeu.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from geometry import encode_polyline
+
+_CARDINALS = ("norte", "nordeste", "leste", "sudeste", "sul", "sudoeste", "oeste", "noroeste")
+STRAIGHT_DEGREES = 30 # Mudanças de direção abaixo disso são "siga em frente"; a partir disso, manobra
+
+
+def format_distance(meters: float) -> str:
+    return f"{meters / 1000:.1f} km".replace(".", ",") if meters >= 1000 else f"{meters:.0f} m"
+
+
+def format_duration(seconds: float) -> str:
+    minutes = max(1, round(seconds / 60))
+    return f"{minutes} min"
+
+
+def cardinal_direction(bearing: float) -> str:
+    """Ponto cardeal/colateral ("norte", "sudeste"...) de uma direção em graus a partir do norte."""
+    return _CARDINALS[int(((bearing + 22.5) % 360) // 45)]
+
+
+def turn_text(delta: float) -> Tuple[str, str]:
+    """Texto da manobra e código no estilo do Google a partir da mudança de direção (graus)."""
+    if abs(delta) < STRAIGHT_DEGREES:
+        return "Continue em frente", "straight"
+    if abs(delta) > 150:
+        return "Faça o retorno", "uturn-right" if delta > 0 else "uturn-left"
+    if delta > 0:
+        return ("Vire à <b>direita</b>", "turn-right") if delta >= 60 else ("Vire levemente à <b>direita</b>", "turn-slight-right")
+    return ("Vire à <b>esquerda</b>", "turn-left") if delta <= -60 else ("Vire levemente à <b>esquerda</b>", "turn-slight-left")
+
+
+def bearing_change(bearing: float, previous_bearing: float) -> float:
+    """Mudança de direção em graus, de -180 (esquerda) a 180 (direita)."""
+    return (bearing - previous_bearing + 540) % 360 - 180
+
+
+def step_instruction(number: int, bearing: float, previous_bearing: Optional[float],
+                     way_name: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Instrução HTML e código de manobra de um passo (o primeiro passo indica a direção de saída)."""
+    on_way = f" na <b>{way_name}</b>" if way_name else ""
+    if number == 0 or previous_bearing is None:
+        return f"Siga na direção <b>{cardinal_direction(bearing)}</b>{on_way}", None
+    turn, maneuver = turn_text(bearing_change(bearing, previous_bearing))
+    return f"{turn}{on_way}", maneuver
+
+
+def make_step(text: str, maneuver: Optional[str], distance: float, duration: float,
+              points: Sequence[Tuple[float, float]]) -> dict:
+    step = {
+        "html_instructions": text,
+        "distance": {"value": round(distance), "text": format_distance(distance)},
+        "duration": {"value": round(duration), "text": format_duration(duration)},
+        "start_location": {"lat": points[0][0], "lng": points[0][1]},
+        "end_location": {"lat": points[-1][0], "lng": points[-1][1]},
+        "polyline": {"points": encode_polyline(points)},
+        "travel_mode": "WALKING",
+    }
+    if maneuver:
+        step["maneuver"] = maneuver
+    return step
+
+
+def make_route(steps: List[dict], path: Sequence[Tuple[float, float]], start_address: str, end_address: str,
+               warning: str) -> dict:
+    total = sum(step["distance"]["value"] for step in steps)
+    total_duration = sum(step["duration"]["value"] for step in steps)
+    return {
+        "legs": [{
+            "steps": steps,
+            "start_address": start_address,
+            "end_address": end_address,
+            "distance": {"value": total, "text": format_distance(total)},
+            "duration": {"value": total_duration, "text": format_duration(total_duration)},
+            "start_location": {"lat": path[0][0], "lng": path[0][1]},
+            "end_location": {"lat": path[-1][0], "lng": path[-1][1]},
+        }],
+        "overview_polyline": {"points": encode_polyline(path)},
+        "summary": start_address,
+        "warnings": [warning],
+    }
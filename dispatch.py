@@ -0,0 +1,397 @@
+"""
+Fila de envio do compartilhamento de localização (e-mail / WhatsApp), fora do caminho da requisição.
+
+Antes, /navigate/ aguardava `send_email` e `send_whatsapp_message` a cada atualização de GPS.
+Agora a requisição apenas enfileira (operação O(1) em memória) e tarefas de fundo fazem o resto:
+
+- Coalescência: por (canal, destinatário, usuário) existe no máximo um envio pendente; novas
+  localizações substituem a pendente, e depois de um envio o próximo só sai após SHARE_COALESCE_SECONDS.
+- Limite por destinatário: token bucket de SHARE_RECIPIENT_RATE_PER_MINUTE envios por minuto.
+- Lotes: envios prontos do mesmo canal são entregues juntos ao `sender` (ex.: uma conexão SMTP
+  para vários e-mails), até SHARE_BATCH_SIZE por lote.
+- Retentativas com backoff exponencial (e jitter) até SHARE_MAX_ATTEMPTS; depois o envio é descartado.
+- Memória limitada (SHARE_QUEUE_MAX pendentes) e spool em SQLite: o que está pendente sobrevive a
+  reinícios (gravado em lote a cada ciclo do agendador, numa thread própria, fora do loop de eventos).
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import smtplib
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARE_COALESCE_SECONDS = float(os.getenv("SHARE_COALESCE_SECONDS", "60")) # Intervalo mínimo entre envios para o mesmo usuário/destinatário
+SHARE_RECIPIENT_RATE_PER_MINUTE = float(os.getenv("SHARE_RECIPIENT_RATE_PER_MINUTE", "10")) # Envios por minuto para um mesmo destinatário
+SHARE_BATCH_SIZE = int(os.getenv("SHARE_BATCH_SIZE", "50")) # Mensagens por lote de um canal
+SHARE_WORKERS = int(os.getenv("SHARE_WORKERS", "4")) # Lotes enviados em paralelo
+SHARE_MAX_ATTEMPTS = int(os.getenv("SHARE_MAX_ATTEMPTS", "5")) # Tentativas antes de descartar um envio
+SHARE_RETRY_BASE_SECONDS = float(os.getenv("SHARE_RETRY_BASE_SECONDS", "2")) # Backoff: base * 2^(tentativa - 1)
+SHARE_QUEUE_MAX = int(os.getenv("SHARE_QUEUE_MAX", "10000")) # Envios pendentes em memória
+SHARE_SPOOL_PATH = os.getenv("SHARE_SPOOL_PATH", "share_spool.sqlite3") # Vazio desativa o spool em disco
+SHARE_EMAIL_RECIPIENTS = [r.strip() for r in os.getenv("SHARE_EMAIL_RECIPIENTS", "contato@exemplo.com").split(",") if r.strip()]
+SHARE_WHATSAPP_RECIPIENTS = [r.strip() for r in os.getenv("SHARE_WHATSAPP_RECIPIENTS", "55XXYYYYYYYYY").split(",") if r.strip()]
+SMTP_HOST = os.getenv("SMTP_HOST", "") # Vazio: e-mails apenas simulados (impressos no log)
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_FROM = os.getenv("SMTP_FROM", "smartpath@exemplo.com")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+
+
+def location_message(latitude: float, longitude: float, destination: str, link: Optional[str] = None) -> str:
+    maps_link = f"https://www.google.com/maps?q={latitude},{longitude}"
+    message = f"Minha localização: {maps_link}. Navegando para: {destination}"
+    if link:
+        message += f". Acompanhe ao vivo: {link}"
+    return message
+
+
+class ShareEntry:
+    """Um envio pendente (já coalescido) para um destinatário."""
+    __slots__ = ("key", "channel", "recipient", "payload", "attempts", "not_before", "in_flight", "version")
+
+    def __init__(self, key: str, channel: str, recipient: str, payload: dict, attempts: int = 0, not_before: float = 0.0):
+        self.key = key
+        self.channel = channel
+        self.recipient = recipient
+        self.payload = payload
+        self.attempts = attempts
+        self.not_before = not_before
+        self.in_flight = False
+        self.version = 0 # Incrementada a cada coalescência (detecta localização nova durante o envio)
+
+
+class LogSender:
+    """Envio simulado: apenas registra as mensagens (comportamento anterior do protótipo)."""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+
+    async def send_batch(self, entries: List[ShareEntry]) -> List[bool]:
+        for entry in entries:
+            logger.info("Simulando envio por %s para %s: %s", self.channel, entry.recipient, entry.payload["text"])
+        return [True] * len(entries)
+
+
+class SMTPEmailSender:
+    """Envia um lote de e-mails por uma única conexão SMTP (em uma thread, fora do loop de eventos)."""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, user: str = SMTP_USER, password: str = SMTP_PASSWORD,
+                 sender: str = SMTP_FROM, starttls: bool = SMTP_STARTTLS, timeout: float = 10, max_workers: int = SHARE_WORKERS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender
+        self.starttls = starttls
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="smtp")
+
+    def _send(self, entries: List[ShareEntry]) -> List[bool]:
+        results = []
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+            for entry in entries:
+                message = EmailMessage()
+                message["From"] = self.sender
+                message["To"] = entry.recipient
+                message["Subject"] = f"SmartPath: localização atual (destino: {entry.payload['destination']})"
+                message.set_content(entry.payload["text"])
+                try:
+                    smtp.send_message(message)
+                    results.append(True)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                    # Recusa de uma mensagem: só ela é retentada; erros de conexão falham o lote inteiro
+                    results.append(False)
+        return results
+
+    async def send_batch(self, entries: List[ShareEntry]) -> List[bool]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._send, entries)
+
+
+class TokenBucket:
+    """Limite de taxa por destinatário."""
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+
+class ShareDispatcher:
+    """Fila em memória + spool SQLite + agendador + workers de envio."""
+
+    def __init__(self, senders: Dict[str, object], recipients: Dict[str, List[str]],
+                 coalesce_seconds: float = SHARE_COALESCE_SECONDS, rate_per_minute: float = SHARE_RECIPIENT_RATE_PER_MINUTE,
+                 batch_size: int = SHARE_BATCH_SIZE, workers: int = SHARE_WORKERS, max_attempts: int = SHARE_MAX_ATTEMPTS,
+                 retry_base: float = SHARE_RETRY_BASE_SECONDS, max_pending: int = SHARE_QUEUE_MAX,
+                 spool_path: Optional[str] = SHARE_SPOOL_PATH):
+        self.senders = senders
+        self.recipients = recipients
+        self.coalesce_seconds = coalesce_seconds
+        self.rate_per_second = rate_per_minute / 60
+        self.rate_capacity = max(1.0, rate_per_minute)
+        self.batch_size = batch_size
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.max_pending = max_pending
+        self.pending: Dict[str, ShareEntry] = {}
+        self._last_sent: Dict[str, float] = {} # chave -> momento do último envio (janela de coalescência)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._dirty = set() # Chaves alteradas desde a última gravação no spool
+        self._deleted = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_due = 0.0 # Próximo horário em que o agendador acordará sozinho
+        self._stopping = False
+        self._batches: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"enqueued": 0, "coalesced": 0, "dropped": 0, "sent": 0, "batches": 0, "retries": 0,
+                      "failed": 0, "rate_limited": 0, "restored": 0, "spool_errors": 0}
+        self.spool_path = spool_path
+        self._writer = None
+        self._writer_db = None # Conexão usada só pela thread de gravação
+        if spool_path:
+            db = sqlite3.connect(spool_path)
+            try:
+                db.execute("CREATE TABLE IF NOT EXISTS share_spool (key TEXT PRIMARY KEY, channel TEXT, recipient TEXT, "
+                           "payload TEXT, attempts INTEGER, not_before REAL)")
+                db.commit()
+                self._restore(db)
+            finally:
+                db.close()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="share-spool")
+
+    def _restore(self, db: sqlite3.Connection):
+        """Recarrega os envios pendentes gravados antes de um reinício."""
+        now_wall, now = time.time(), time.monotonic()
+        for key, channel, recipient, payload, attempts, not_before in db.execute(
+                "SELECT key, channel, recipient, payload, attempts, not_before FROM share_spool"):
+            # not_before é gravado em tempo de relógio; convertido para o relógio monotônico do processo
+            self.pending[key] = ShareEntry(key, channel, recipient, json.loads(payload), attempts,
+                                           now + max(0.0, not_before - now_wall))
+            self.stats["restored"] += 1
+
+    # --- Caminho da requisição ---
+
+    def enqueue(self, channel: str, user: str, latitude: float, longitude: float, destination: str,
+                urgent: bool = False, link: Optional[str] = None) -> int:
+        """
+        Enfileira a localização para todos os destinatários do canal. Retorna quantos envios ficaram pendentes.
+        `link` é o link de acompanhamento ao vivo, incluído no texto quando o usuário compartilhou um.
+        """
+        self._ensure_started()
+        now = time.monotonic()
+        payload = {"latitude": latitude, "longitude": longitude, "destination": destination,
+                   "text": location_message(latitude, longitude, destination, link)}
+        queued = 0
+        for recipient in self.recipients.get(channel, []):
+            key = f"{channel}|{recipient}|{user}"
+            entry = self.pending.get(key)
+            if entry:
+                entry.payload = payload # Só a localização mais recente importa
+                entry.version += 1
+                if urgent:
+                    entry.not_before = min(entry.not_before, now)
+                self.stats["coalesced"] += 1
+            elif len(self.pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                continue
+            else:
+                not_before = now if urgent else self._last_sent.get(key, -self.coalesce_seconds) + self.coalesce_seconds
+                entry = self.pending[key] = ShareEntry(key, channel, recipient, payload, not_before=not_before)
+                self.stats["enqueued"] += 1
+            self._dirty.add(key)
+            queued += 1
+            if entry.not_before < self._next_due:
+                self._wakeup.set() # Só acorda o agendador se este envio vencer antes do próximo ciclo
+        return queued
+
+    # --- Tarefas de fundo ---
+
+    def start(self):
+        """Inicia o agendador e os workers (chamado no startup; também ocorre no primeiro enqueue)."""
+        self._ensure_started()
+
+    async def stop(self):
+        """Interrompe as tarefas e grava no spool o que ainda estiver pendente."""
+        self._stopping = True # No Python 3.11, wait_for pode engolir o cancelamento se o evento disparar junto
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._stopping = False
+        self._tasks = []
+        for entry in self.pending.values():
+            if entry.in_flight: # Envio interrompido: volta a ficar pendente
+                entry.in_flight = False
+                self._dirty.add(entry.key)
+        await self._flush_spool_and_wait()
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._batches = asyncio.Queue(maxsize=self.worker_count * 2) # Limita lotes prontos em memória
+        self._tasks = [asyncio.ensure_future(self._schedule())]
+        self._tasks += [asyncio.ensure_future(self._work()) for _ in range(self.worker_count)]
+
+    def _take_token(self, recipient: str, now: float) -> float:
+        """Consome um token do destinatário; retorna 0 se houver, ou quantos segundos faltam para o próximo."""
+        bucket = self._buckets.get(recipient)
+        if bucket is None:
+            bucket = self._buckets[recipient] = TokenBucket(self.rate_capacity, now)
+        bucket.tokens = min(self.rate_capacity, bucket.tokens + (now - bucket.updated) * self.rate_per_second)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate_per_second
+
+    async def _schedule(self):
+        while not self._stopping:
+            self._flush_spool()
+            now = time.monotonic()
+            ready: Dict[str, List[ShareEntry]] = {}
+            next_due = now + 5
+            for entry in list(self.pending.values()):
+                if entry.in_flight:
+                    continue
+                if entry.not_before > now:
+                    next_due = min(next_due, entry.not_before)
+                    continue
+                wait = self._take_token(entry.recipient, now)
+                if wait:
+                    self.stats["rate_limited"] += 1
+                    entry.not_before = now + wait
+                    next_due = min(next_due, entry.not_before)
+                    continue
+                entry.in_flight = True
+                ready.setdefault(entry.channel, []).append(entry)
+            for channel, entries in ready.items():
+                for start in range(0, len(entries), self.batch_size):
+                    await self._batches.put((channel, entries[start:start + self.batch_size]))
+            self._prune_last_sent(now)
+            self._wakeup.clear()
+            self._next_due = next_due
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.05, next_due - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            channel, entries = await self._batches.get()
+            versions = [entry.version for entry in entries]
+            try:
+                results = await self.senders[channel].send_batch(entries)
+            except Exception as e:
+                logger.warning("Falha ao enviar lote de %d mensagens por %s: %s", len(entries), channel, e)
+                results = [False] * len(entries)
+            if len(results) != len(entries):
+                results = [False] * len(entries)
+            self.stats["batches"] += 1
+            now = time.monotonic()
+            for entry, version, ok in zip(entries, versions, results):
+                entry.in_flight = False
+                if ok:
+                    self.stats["sent"] += 1
+                    self._last_sent[entry.key] = now
+                    if entry.version == version:
+                        self._remove(entry.key)
+                    else: # Chegou uma localização nova durante o envio: sai na próxima janela
+                        entry.attempts = 0
+                        entry.not_before = now + self.coalesce_seconds
+                        self._dirty.add(entry.key)
+                    continue
+                entry.attempts += 1
+                if entry.attempts >= self.max_attempts:
+                    self.stats["failed"] += 1
+                    self._remove(entry.key)
+                    continue
+                self.stats["retries"] += 1
+                backoff = self.retry_base * 2 ** (entry.attempts - 1)
+                entry.not_before = now + backoff * random.uniform(0.8, 1.2)
+                self._dirty.add(entry.key)
+            self._wakeup.set()
+
+    def _remove(self, key: str):
+        self.pending.pop(key, None)
+        self._dirty.discard(key)
+        self._deleted.add(key)
+
+    def _prune_last_sent(self, now: float):
+        if len(self._last_sent) > self.max_pending:
+            cutoff = now - self.coalesce_seconds
+            self._last_sent = {key: sent for key, sent in self._last_sent.items() if sent > cutoff}
+
+    def _flush_spool(self) -> Optional[Future]:
+        """
+        Envia para a thread do spool as alterações acumuladas desde o último ciclo (gravadas em uma
+        transação). As linhas são montadas aqui, no loop; só a escrita no SQLite sai dele.
+        """
+        if self._writer is None or not (self._dirty or self._deleted):
+            self._dirty.clear()
+            self._deleted.clear()
+            return None
+        offset = time.time() - time.monotonic()
+        rows = [(e.key, e.channel, e.recipient, json.dumps(e.payload), e.attempts, e.not_before + offset)
+                for e in (self.pending.get(key) for key in self._dirty) if e is not None]
+        deleted = [(key,) for key in self._deleted]
+        self._dirty.clear()
+        self._deleted.clear()
+        return self._writer.submit(self._write_spool, deleted, rows)
+
+    async def _flush_spool_and_wait(self):
+        """
+        Grava as alterações pendentes, espera a thread do spool terminar e fecha a conexão dela
+        (reaberta na próxima gravação).
+        """
+        self._flush_spool()
+        if self._writer is not None:
+            # Uma única thread: quando o fechamento roda, as gravações anteriores já terminaram
+            await asyncio.wrap_future(self._writer.submit(self._close_spool))
+
+    def _write_spool(self, deleted: list, rows: list):
+        try:
+            if self._writer_db is None:
+                self._writer_db = sqlite3.connect(self.spool_path)
+            with self._writer_db:
+                self._writer_db.executemany("DELETE FROM share_spool WHERE key = ?", deleted)
+                self._writer_db.executemany("INSERT OR REPLACE INTO share_spool VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e: # Os envios continuam na fila em memória
+            self.stats["spool_errors"] += 1
+            logger.warning("Erro ao gravar a fila de compartilhamento no spool: %s", e)
+
+    def _close_spool(self):
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+    async def drain(self, timeout: float = 10):
+        """Aguarda a fila esvaziar (envios com horário futuro contam como pendentes)."""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await self._flush_spool_and_wait()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": len(self.pending), "in_flight": sum(e.in_flight for e in self.pending.values())}
+
+
+def create_share_dispatcher() -> ShareDispatcher:
+    """Dispatcher com SMTP real se SMTP_HOST estiver configurado; WhatsApp permanece simulado."""
+    email_sender = SMTPEmailSender() if SMTP_HOST else LogSender("e-mail")
+    return ShareDispatcher(
+        senders={"email": email_sender, "whatsapp": LogSender("WhatsApp")},
+        recipients={"email": SHARE_EMAIL_RECIPIENTS, "whatsapp": SHARE_WHATSAPP_RECIPIENTS},
+    )
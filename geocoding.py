@@ -0,0 +1,267 @@
+"""
+Resolução de destinos (texto livre -> place_id e coordenadas) com cache.
+
+O destino chega como texto livre, muitas vezes vindo do reconhecimento de voz. Em vez de
+deixar a Directions API geocodificar o mesmo texto a cada atualização, o destino é resolvido
+uma vez pela Geocoding API e guardado em um cache LRU com expiração (TTL), indexado por uma
+forma normalizada do texto. Um segundo nível em disco (SQLite) mantém os resultados entre
+reinicializações do servidor; as leituras e gravações nele rodam numa thread própria, fora do
+loop de eventos.
+Destinos que a Geocoding API não encontra também ficam em cache, só em memória e por pouco
+tempo (GEOCODE_NEGATIVE_TTL_SECONDS): um destino impossível não é geocodificado (e cobrado)
+a cada atualização.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "5000")) # Entradas mantidas em memória
+GEOCODE_CACHE_TTL_SECONDS = float(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))) # 7 dias
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3") # Vazio desativa o cache em disco
+GEOCODE_NEGATIVE_TTL_SECONDS = float(os.getenv("GEOCODE_NEGATIVE_TTL_SECONDS", "300")) # Destino não encontrado: não consulta de novo por 5 min
+GEOCODE_REGION_DEGREES = float(os.getenv("GEOCODE_REGION_DEGREES", "0.5")) # Região (~50 km) usada para desambiguar o texto
+
+# Variações comuns (fala e digitação) reduzidas a uma única forma
+_WORD_VARIANTS = {
+    "avenida": "av", "av": "av",
+    "rua": "r", "r": "r",
+    "praca": "pca", "pca": "pca", "pc": "pca",
+    "alameda": "al", "al": "al",
+    "estrada": "estr", "estr": "estr",
+    "travessa": "tv", "tv": "tv", "trav": "tv",
+    "rodovia": "rod", "rod": "rod",
+    "doutor": "dr", "dr": "dr", "doutora": "dra", "dra": "dra",
+    "professor": "prof", "prof": "prof", "professora": "profa", "profa": "profa",
+    "santo": "sto", "sto": "sto", "santa": "sta", "sta": "sta",
+    "estacao": "est", "est": "est",
+    "hospital": "hosp", "hosp": "hosp",
+}
+# Comandos de voz que costumam ficar no início do texto ("me leve ate a praca" -> "praca").
+# A preposição e o artigo só são removidos logo depois de um comando: "Pará de Minas" fica intacto.
+_LEADING_COMMANDS = (
+    "iniciar navegacao", "comecar navegacao", "navegar", "me leve", "me leva", "quero ir", "ir",
+)
+_COMMAND_PREPOSITIONS = ("para", "ate", "ao", "a")
+_COMMAND_ARTICLES = ("a", "o", "as", "os")
+
+
+def normalize_destination(text: str) -> str:
+    """
+    Normaliza o texto do destino para uso como chave de cache: minúsculas, sem acentos,
+    sem pontuação, espaços simples, sem frases de comando de voz e com abreviações unificadas.
+    Só palavras inteiras do comando inicial são removidas; o resto do destino é mantido.
+    """
+    text = re.sub(r"\b[Nn][º°]", " ", text or "") # Sinal de número ("nº 1000"); o NFKD o tornaria "no"
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    text = re.sub(r"[º°ª]", " ", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    words = text.split()
+    for command in _LEADING_COMMANDS:
+        tokens = command.split(" ")
+        if words[:len(tokens)] == tokens and len(words) > len(tokens):
+            words = words[len(tokens):]
+            for connectors in (_COMMAND_PREPOSITIONS, _COMMAND_ARTICLES):
+                if len(words) > 1 and words[0] in connectors:
+                    words = words[1:]
+            break
+    return " ".join(_WORD_VARIANTS.get(word, word) for word in words)
+
+
+def region_cell(latitude: float, longitude: float) -> str:
+    """Célula de região (grade de GEOCODE_REGION_DEGREES graus) onde o usuário está."""
+    return f"{math.floor(latitude / GEOCODE_REGION_DEGREES)}:{math.floor(longitude / GEOCODE_REGION_DEGREES)}"
+
+
+class ResolvedPlace:
+    """Destino resolvido pela Geocoding API."""
+    __slots__ = ("place_id", "latitude", "longitude", "formatted_address")
+
+    def __init__(self, place_id: Optional[str], latitude: float, longitude: float, formatted_address: str = ""):
+        self.place_id = place_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.formatted_address = formatted_address
+
+    def as_directions_destination(self, prefer_coordinates: bool = False) -> str:
+        """Destino no formato aceito pela Directions API, sem nova geocodificação do texto."""
+        if self.place_id and not prefer_coordinates:
+            return f"place_id:{self.place_id}"
+        return f"{self.latitude},{self.longitude}"
+
+    def to_json(self) -> str:
+        return json.dumps({"place_id": self.place_id, "lat": self.latitude, "lng": self.longitude,
+                           "address": self.formatted_address})
+
+    @classmethod
+    def from_json(cls, raw: str) -> "ResolvedPlace":
+        data = json.loads(raw)
+        return cls(data["place_id"], data["lat"], data["lng"], data.get("address", ""))
+
+
+class GeocodeCache:
+    """Cache LRU + TTL em memória, com um segundo nível opcional em SQLite."""
+
+    def __init__(self, max_entries: int = GEOCODE_CACHE_SIZE, ttl_seconds: float = GEOCODE_CACHE_TTL_SECONDS,
+                 path: Optional[str] = GEOCODE_CACHE_PATH, negative_ttl_seconds: float = GEOCODE_NEGATIVE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, ResolvedPlace]]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict() # Destinos não encontrados -> expiração
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "negative_hits": 0, "write_errors": 0}
+        self.path = path
+        self._writer = None # Thread única que lê e grava o SQLite
+        self._writer_db = None # Conexão usada só por essa thread
+        if path:
+            db = sqlite3.connect(path)
+            try:
+                db.execute("CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, place TEXT, expires_at REAL)")
+                db.commit()
+            finally:
+                db.close()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocode-cache")
+
+    async def get(self, key: str) -> Optional[ResolvedPlace]:
+        """Destino em cache; numa falta da memória, o SQLite é lido na thread do cache."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, place = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return place
+            del self._entries[key]
+        if self._writer is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._writer, self._read, key)
+            if row and row[1] > time.time():
+                place = ResolvedPlace.from_json(row[0])
+                self._remember(key, place, row[1])
+                self.stats["disk_hits"] += 1
+                return place
+        self.stats["misses"] += 1
+        return None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._writer_db is None:
+            self._writer_db = sqlite3.connect(self.path)
+        return self._writer_db
+
+    def _read(self, key: str) -> Optional[tuple]:
+        try:
+            return self._connection().execute("SELECT place, expires_at FROM geocode WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e: # Tratado como falta: o destino é geocodificado de novo
+            logger.warning("Erro ao ler o destino resolvido do cache em disco: %s", e)
+            return None
+
+    def put(self, key: str, place: ResolvedPlace):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, place, expires_at)
+        self._missing.pop(key, None)
+        if self._writer is not None:
+            self._writer.submit(self._write, key, place.to_json(), expires_at)
+
+    def _write(self, key: str, place: str, expires_at: float):
+        try:
+            with self._connection() as db:
+                db.execute("INSERT OR REPLACE INTO geocode (key, place, expires_at) VALUES (?, ?, ?)",
+                           (key, place, expires_at))
+        except sqlite3.Error as e: # O destino continua no cache em memória
+            self.stats["write_errors"] += 1
+            logger.warning("Erro ao gravar o destino resolvido no cache em disco: %s", e)
+
+    def is_missing(self, key: str) -> bool:
+        """Se o destino foi procurado há pouco e não foi encontrado."""
+        expires_at = self._missing.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._missing[key]
+            return False
+        self.stats["negative_hits"] += 1
+        return True
+
+    def put_missing(self, key: str):
+        """Registra um destino não encontrado por GEOCODE_NEGATIVE_TTL_SECONDS (só em memória)."""
+        if self.negative_ttl_seconds <= 0:
+            return
+        self._missing[key] = time.time() + self.negative_ttl_seconds
+        self._missing.move_to_end(key)
+        while len(self._missing) > self.max_entries:
+            self._missing.popitem(last=False)
+
+    async def close(self):
+        """Espera as gravações pendentes e fecha o arquivo (chamado no encerramento do app)."""
+        if self._writer is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._close_writer)
+        self._writer.shutdown(wait=False)
+        self._writer = None
+
+    def _close_writer(self):
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+    def _remember(self, key: str, place: ResolvedPlace, expires_at: float):
+        self._entries[key] = (expires_at, place)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        """Contadores de acerto/erro do cache, para exposição em endpoint."""
+        return {**self.stats, "entries": len(self._entries), "missing": len(self._missing)}
+
+
+class Geocoder:
+    """Resolve destinos de texto livre usando o provedor do Google Maps e o cache."""
+
+    def __init__(self, provider, cache: GeocodeCache):
+        self.provider = provider
+        self.cache = cache
+        self.flight = SingleFlight("geocode") # Destinos iguais resolvidos ao mesmo tempo geram uma única chamada
+
+    async def resolve(self, destination: str, latitude: float, longitude: float) -> Optional[ResolvedPlace]:
+        """
+        Retorna o destino resolvido, consultando a Geocoding API apenas na primeira vez.
+        A busca é restrita à região onde o usuário está, para desambiguar nomes comuns.
+        """
+        normalized = normalize_destination(destination)
+        if not normalized:
+            return None
+        key = f"{region_cell(latitude, longitude)}|{normalized}"
+        if self.cache.is_missing(key):
+            return None
+        place = await self.cache.get(key)
+        if place is not None:
+            return place
+        return await self.flight.do(key, lambda: self._geocode(key, destination, latitude, longitude))
+
+    async def _geocode(self, key: str, destination: str, latitude: float, longitude: float) -> Optional[ResolvedPlace]:
+        south = math.floor(latitude / GEOCODE_REGION_DEGREES) * GEOCODE_REGION_DEGREES
+        west = math.floor(longitude / GEOCODE_REGION_DEGREES) * GEOCODE_REGION_DEGREES
+        bounds = {"southwest": (south, west),
+                  "northeast": (south + GEOCODE_REGION_DEGREES, west + GEOCODE_REGION_DEGREES)}
+        results = await self.provider.geocode(destination, bounds=bounds)
+        if not results:
+            self.cache.put_missing(key) # Erros do provedor não chegam aqui: só "não encontrado" fica em cache
+            return None
+        best = results[0]
+        location = best["geometry"]["location"]
+        place = ResolvedPlace(best.get("place_id"), location["lat"], location["lng"], best.get("formatted_address", ""))
+        self.cache.put(key, place)
+        return place
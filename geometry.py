@@ -0,0 +1,221 @@
+"""
+Funções de geometria usadas no backend para acompanhar o progresso na rota.
+
+Trabalha com polylines codificadas do Google (Encoded Polyline Algorithm Format) e
+distâncias em metros. As coordenadas ficam em arrays NumPy (N, 2) de (latitude, longitude)
+e as consultas ponto-rota são vetorizadas. Para distâncias curtas (uma rota a pé) é usada
+uma projeção equiretangular local, precisa o bastante e muito mais barata que fórmulas geodésicas.
+"""
+import math
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = math.pi / 180 * EARTH_RADIUS_METERS
+GRID_CELL_METERS = float(os.getenv("ROUTE_GRID_CELL_METERS", "60")) # Tamanho da célula do índice espacial
+
+# Limite de elementos (pontos x segmentos) processados de uma vez nas consultas em lote
+_BATCH_ELEMENTS = 1 << 20
+
+LatLng = Tuple[float, float]
+
+
+def decode_polyline(encoded: str) -> np.ndarray:
+    """
+    Decodifica uma polyline do Google em um array (N, 2) de (latitude, longitude).
+    A decodificação é feita sem laço Python: cada caractere vira um bloco de 5 bits e os
+    blocos de cada valor são somados com `np.add.reduceat`.
+    Levanta ValueError se a polyline estiver truncada ou tiver caracteres fora do formato.
+    """
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+    if not encoded.isascii():
+        raise ValueError("Polyline inválida: caracteres fora do formato.")
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if chunks.min() < 0 or chunks.max() > 0x3F:
+        raise ValueError("Polyline inválida: caracteres fora do formato.")
+    is_last = chunks < 0x20 # O último bloco de cada valor não tem o bit de continuação
+    value_ends = np.flatnonzero(is_last)
+    if not is_last[-1] or len(value_ends) % 2:
+        raise ValueError("Polyline inválida: truncada no meio de uma coordenada.")
+    value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+    value_of_chunk = np.repeat(np.arange(len(value_starts)), value_ends - value_starts + 1)
+    shifts = 5 * (np.arange(len(chunks)) - value_starts[value_of_chunk])
+    values = np.add.reduceat((chunks & 0x1F) << shifts, value_starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 1e5
+
+
+def encode_polyline(points) -> str:
+    """Codifica uma sequência de (latitude, longitude) no formato de polyline do Google."""
+    coords = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 1e5).astype(np.int64)
+    if not len(coords):
+        return ""
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).reshape(-1)
+    chars = []
+    for value in np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def haversine(a: LatLng, b: LatLng) -> float:
+    """Distância em metros entre dois pontos (latitude, longitude)."""
+    lat1, lng1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lng2 = math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(h)))
+
+
+class RouteIndex:
+    """
+    Índice espacial de uma rota para consultas "segmento/passo mais próximo, distância
+    transversal e distância ao longo da rota" a partir de uma localização GPS.
+
+    A rota é projetada uma única vez em metros (plano local centrado no primeiro ponto)
+    e cada segmento é registrado nas células de uma grade regular que seu retângulo envolvente,
+    expandido em uma célula, toca. Assim a célula do ponto já contém todos os segmentos a menos
+    de uma célula de distância; se nenhum estiver tão perto, a consulta cai para a busca
+    vetorizada em todos os segmentos.
+    """
+
+    def __init__(self, path: np.ndarray, step_end_indexes: Optional[np.ndarray] = None,
+                 cell_size: float = GRID_CELL_METERS):
+        path = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+        if len(path) == 0:
+            raise ValueError("A rota precisa ter pelo menos um ponto.")
+        if len(path) == 1:
+            path = np.vstack([path, path]) # Rota degenerada: um único segmento de comprimento zero
+        self.path = path
+        self.cell_size = cell_size
+        self.origin_lat, self.origin_lng = path[0]
+        self.scale_x = METERS_PER_DEGREE * math.cos(math.radians(self.origin_lat))
+
+        xy = self.to_local(path)
+        self.seg_start = xy[:-1]
+        self.seg_vector = xy[1:] - xy[:-1]
+        self.seg_length_sq = np.einsum("ij,ij->i", self.seg_vector, self.seg_vector)
+        self.seg_inv_length_sq = np.divide(1.0, self.seg_length_sq, out=np.zeros_like(self.seg_length_sq),
+                                           where=self.seg_length_sq > 0) # 0 => t = 0 em segmentos degenerados
+        self.cumulative = np.concatenate(([0.0], np.cumsum(np.sqrt(self.seg_length_sq))))
+        self.total_length = float(self.cumulative[-1])
+
+        # Passo ao qual cada segmento pertence (o segmento i liga os pontos i e i + 1)
+        if step_end_indexes is None:
+            step_end_indexes = np.array([len(path) - 1])
+        self.step_end_indexes = np.asarray(step_end_indexes, dtype=np.int64)
+        self.segment_steps = np.minimum(
+            np.searchsorted(self.step_end_indexes, np.arange(len(self.seg_start)), side="right"),
+            len(self.step_end_indexes) - 1,
+        )
+
+        self._all_segments = np.arange(len(self.seg_start))
+        self._grid = self._build_grid(xy)
+        self._all_columns = self._columns(self._all_segments)
+
+    def to_local(self, points: np.ndarray) -> np.ndarray:
+        """Converte (latitude, longitude) em coordenadas (x, y) em metros no plano local da rota."""
+        points = np.asarray(points, dtype=np.float64)
+        return np.stack(((points[..., 1] - self.origin_lng) * self.scale_x,
+                         (points[..., 0] - self.origin_lat) * METERS_PER_DEGREE), axis=-1)
+
+    def _build_grid(self, xy: np.ndarray) -> dict:
+        lo = np.floor(np.minimum(xy[:-1], xy[1:]) / self.cell_size).astype(np.int64) - 1
+        hi = np.floor(np.maximum(xy[:-1], xy[1:]) / self.cell_size).astype(np.int64) + 1
+        buckets = {}
+        for segment, ((x0, y0), (x1, y1)) in enumerate(zip(lo.tolist(), hi.tolist())):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    buckets.setdefault((cx, cy), []).append(segment)
+        return {cell: self._columns(np.array(segments, dtype=np.int64)) for cell, segments in buckets.items()}
+
+    def _columns(self, segments: np.ndarray) -> tuple:
+        """Colunas contíguas dos segmentos indicados, usadas pela consulta de um único ponto."""
+        return (segments, self.seg_start[segments, 0].copy(), self.seg_start[segments, 1].copy(),
+                self.seg_vector[segments, 0].copy(), self.seg_vector[segments, 1].copy(),
+                self.seg_inv_length_sq[segments])
+
+    def _project_point(self, x: float, y: float, columns: tuple) -> Tuple[int, float, float]:
+        """Projeção de um único ponto local (x, y) com operações 1D, sem broadcasting 3D."""
+        segments, start_x, start_y, vec_x, vec_y, inv_length_sq = columns
+        rel_x = x - start_x
+        rel_y = y - start_y
+        t = np.minimum(np.maximum((rel_x * vec_x + rel_y * vec_y) * inv_length_sq, 0.0), 1.0)
+        off_x = rel_x - t * vec_x
+        off_y = rel_y - t * vec_y
+        best = int(np.argmin(off_x * off_x + off_y * off_y))
+        segment = int(segments[best])
+        cross = math.hypot(off_x[best], off_y[best])
+        along = self.cumulative[segment] + t[best] * (self.cumulative[segment + 1] - self.cumulative[segment])
+        return segment, cross, float(along)
+
+    def _project(self, xy: np.ndarray, segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Projeta K pontos locais sobre os segmentos indicados (todos os pares, por broadcasting).
+        Retorna, para cada ponto, (segmento mais próximo, distância transversal, distância ao longo).
+        """
+        rel = xy[:, None, :] - self.seg_start[segments][None, :, :]
+        vec = self.seg_vector[segments]
+        length_sq = self.seg_length_sq[segments]
+        dot = np.einsum("kmj,mj->km", rel, vec)
+        t = np.clip(dot * self.seg_inv_length_sq[segments], 0.0, 1.0)
+        offset = rel - t[..., None] * vec
+        dist_sq = np.einsum("kmj,kmj->km", offset, offset)
+        best = np.argmin(dist_sq, axis=1)
+        rows = np.arange(len(xy))
+        best_segments = segments[best]
+        cross = np.sqrt(dist_sq[rows, best])
+        along = self.cumulative[best_segments] + t[rows, best] * np.sqrt(length_sq[best])
+        return best_segments, cross, along
+
+    def locate(self, latitude: float, longitude: float) -> Tuple[int, int, float, float]:
+        """
+        Localiza um ponto GPS em relação à rota.
+        Retorna (segmento, passo, distância transversal em metros, distância ao longo da rota em metros).
+        """
+        x = (longitude - self.origin_lng) * self.scale_x
+        y = (latitude - self.origin_lat) * METERS_PER_DEGREE
+        columns = self._grid.get((math.floor(x / self.cell_size), math.floor(y / self.cell_size)))
+        if columns is not None:
+            segment, cross, along = self._project_point(x, y, columns)
+            if cross <= self.cell_size: # Resultado exato: o vizinho mais próximo estava na célula
+                return segment, int(self.segment_steps[segment]), cross, along
+        segment, cross, along = self._project_point(x, y, self._all_columns)
+        return segment, int(self.segment_steps[segment]), cross, along
+
+    def locate_many(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Versão em lote de `locate` para um array (K, 2) de (latitude, longitude).
+        Retorna arrays (segmentos, passos, distâncias transversais, distâncias ao longo).
+        """
+        xy = self.to_local(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        count = len(xy)
+        segments = np.zeros(count, dtype=np.int64)
+        cross = np.full(count, np.inf)
+        along = np.zeros(count)
+
+        # Agrupa os pontos por célula da grade e projeta cada grupo só nos segmentos da célula
+        cells = np.floor(xy / self.cell_size).astype(np.int64)
+        unique_cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_cells) + 1))
+        for cell_number, (cx, cy) in enumerate(unique_cells.tolist()):
+            columns = self._grid.get((cx, cy))
+            if columns is None:
+                continue
+            candidates = columns[0]
+            members = order[bounds[cell_number]:bounds[cell_number + 1]]
+            segments[members], cross[members], along[members] = self._project(xy[members], candidates)
+
+        # Pontos longe da rota (sem vizinho a menos de uma célula): busca em todos os segmentos
+        far = np.flatnonzero(cross > self.cell_size)
+        chunk = max(1, _BATCH_ELEMENTS // len(self._all_segments))
+        for i in range(0, len(far), chunk):
+            members = far[i:i + chunk]
+            segments[members], cross[members], along[members] = self._project(xy[members], self._all_segments)
+        return segments, self.segment_steps[segments], cross, along
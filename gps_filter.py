@@ -0,0 +1,197 @@
+"""
+Suavização das localizações do GPS recebidas em lote (POST /navigate/fixes).
+
+O navegador entrega uma localização por segundo (ou mais), com ruído de alguns metros e, perto
+de prédios, saltos de dezenas de metros (multipercurso). Em vez de usar só a última localização
+de cada envio, o cliente manda todas as que juntou desde o envio anterior e o servidor estima
+posição, velocidade e direção com um filtro de Kalman de velocidade constante por sessão.
+
+Cada lote passa por duas etapas:
+
+1. Pré-processamento vetorizado (NumPy): descarta localizações inválidas, imprecisas demais ou
+   mais antigas que a última já usada, ordena por horário, projeta em metros (projeção
+   equiretangular local) e rejeita saltos em relação à mediana móvel do lote (filtro de Hampel).
+2. Filtro de Kalman, uma localização por vez: a recursão é sequencial, mas o estado são poucos
+   números de ponto flutuante. Leste/norte ficam num número complexo e, como o modelo é o mesmo
+   nos dois eixos, a covariância 2x2 é compartilhada. Localizações cuja inovação passa do limite
+   de Mahalanobis são rejeitadas; depois de várias rejeições seguidas (o usuário realmente
+   mudou de lugar) ou de uma pausa longa, o filtro recomeça na localização atual.
+
+A precisão informada pelo navegador (`coords.accuracy`) é o raio com 68% de confiança; o desvio
+padrão por eixo correspondente é accuracy / 1.51.
+"""
+import math
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from geometry import METERS_PER_DEGREE
+
+GPS_MAX_BATCH = int(os.getenv("GPS_MAX_BATCH", "600")) # Localizações aceitas por lote (10 min a 1 Hz)
+GPS_MAX_ACCURACY_METERS = float(os.getenv("GPS_MAX_ACCURACY_METERS", "100")) # Localizações menos precisas são descartadas
+GPS_ACCELERATION_NOISE = float(os.getenv("GPS_ACCELERATION_NOISE", "1.0")) # Desvio da aceleração do usuário (m/s²)
+GPS_OUTLIER_GATE = float(os.getenv("GPS_OUTLIER_GATE", "13.8")) # Limite de Mahalanobis (qui-quadrado, 2 graus, 99,9%)
+GPS_OUTLIER_MIN_METERS = float(os.getenv("GPS_OUTLIER_MIN_METERS", "25")) # Desvio mínimo da mediana do lote para rejeitar
+GPS_MAX_CONSECUTIVE_REJECTIONS = int(os.getenv("GPS_MAX_CONSECUTIVE_REJECTIONS", "4")) # Rejeições seguidas que reiniciam o filtro
+GPS_RESET_SECONDS = float(os.getenv("GPS_RESET_SECONDS", "30")) # Pausa entre localizações que reinicia o filtro
+
+ACCURACY_TO_SIGMA = 1 / 1.51 # Raio com 68% de confiança -> desvio padrão por eixo
+INITIAL_SPEED_SIGMA = 2.0 # Incerteza inicial da velocidade (m/s), a pé
+MIN_HEADING_SPEED = 0.3 # Abaixo disso (m/s) a direção é só ruído e não é informada
+HAMPEL_WINDOW = 5
+HAMPEL_SIGMAS = 3.0
+
+
+class FilteredPosition:
+    """Estimativa do filtro após um lote."""
+    __slots__ = ("latitude", "longitude", "accuracy", "speed", "heading", "timestamp", "accepted", "rejected")
+
+    def __init__(self, latitude: float, longitude: float, accuracy: float, speed: float,
+                 heading: Optional[float], timestamp: float, accepted: int, rejected: int):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accuracy = accuracy # Metros, mesma convenção de `coords.accuracy` (68%)
+        self.speed = speed # m/s
+        self.heading = heading # Graus a partir do norte, sentido horário; None parado
+        self.timestamp = timestamp # Horário (ms) da última localização usada
+        self.accepted = accepted # Localizações deste lote usadas pelo filtro
+        self.rejected = rejected # Localizações deste lote descartadas (inválidas, antigas ou saltos)
+
+
+class PositionFilter:
+    """Filtro de Kalman de velocidade constante de uma sessão (posição e velocidade em metros)."""
+
+    def __init__(self, acceleration_noise: float = GPS_ACCELERATION_NOISE, gate: float = GPS_OUTLIER_GATE):
+        self.q = acceleration_noise ** 2
+        self.gate = gate
+        self.origin = None # (latitude, longitude) da projeção local
+        self.meters_per_degree_lng = 0.0
+        self.time = None # Horário (s) da última localização usada
+        self.position = 0j # Leste + norte*j, em metros a partir da origem
+        self.velocity = 0j
+        self.p_pos = self.p_cross = self.p_vel = 0.0 # Covariância [[p_pos, p_cross], [p_cross, p_vel]] por eixo
+        self.rejections = 0 # Rejeições seguidas
+        self.stats = {"batches": 0, "fixes": 0, "accepted": 0, "invalid": 0, "stale": 0, "outliers": 0, "resets": 0}
+
+    def update(self, latitudes: Sequence[float], longitudes: Sequence[float], accuracies: Sequence[float],
+               timestamps: Sequence[float]) -> Optional[FilteredPosition]:
+        """
+        Processa um lote (horários em milissegundos, como `position.timestamp` no navegador).
+        Retorna a estimativa atual, ou None se o filtro ainda não tiver nenhuma localização válida.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        accuracies = np.asarray(accuracies, dtype=np.float64)
+        seconds = np.asarray(timestamps, dtype=np.float64) / 1000
+        total = len(seconds)
+        self.stats["batches"] += 1
+        self.stats["fixes"] += total
+
+        valid = (np.isfinite(latitudes) & np.isfinite(longitudes) & np.isfinite(seconds)
+                 & (np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180)
+                 & (accuracies > 0) & (accuracies <= GPS_MAX_ACCURACY_METERS))
+        self.stats["invalid"] += int(total - valid.sum())
+        fresh = valid & (seconds > self.time) if self.time is not None else valid
+        self.stats["stale"] += int(valid.sum() - fresh.sum())
+
+        indexes = np.flatnonzero(fresh)
+        indexes = indexes[np.argsort(seconds[indexes], kind="stable")]
+        if len(indexes) > 1: # Horários repetidos: fica a primeira
+            indexes = indexes[np.concatenate(([True], np.diff(seconds[indexes]) > 0))]
+        self.stats["stale"] += int(fresh.sum() - len(indexes))
+
+        accepted = 0
+        if len(indexes):
+            if self.origin is None:
+                self._set_origin(latitudes[indexes[0]], longitudes[indexes[0]])
+            points = self._project(latitudes[indexes], longitudes[indexes])
+            sigmas = accuracies[indexes] * ACCURACY_TO_SIGMA
+            keep = self._hampel(points, accuracies[indexes])
+            self.stats["outliers"] += int(len(keep) - keep.sum())
+            accepted = self._filter(points[keep].tolist(), (sigmas[keep] ** 2).tolist(), seconds[indexes][keep].tolist(),
+                                    latitudes[indexes][keep].tolist(), longitudes[indexes][keep].tolist())
+            self.stats["accepted"] += accepted
+
+        if self.time is None:
+            return None
+        return self._estimate(accepted, total - accepted)
+
+    def _set_origin(self, latitude: float, longitude: float):
+        self.origin = (float(latitude), float(longitude))
+        self.meters_per_degree_lng = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+
+    def _project(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        east = (longitudes - self.origin[1]) * self.meters_per_degree_lng
+        north = (latitudes - self.origin[0]) * METERS_PER_DEGREE
+        return east + 1j * north
+
+    @staticmethod
+    def _hampel(points: np.ndarray, accuracies: np.ndarray) -> np.ndarray:
+        """Máscara das localizações a manter: distância à mediana móvel do lote até max(mínimo, 3 x precisão)."""
+        if len(points) < 3:
+            return np.ones(len(points), dtype=bool)
+        pad = HAMPEL_WINDOW // 2
+        east = sliding_window_view(np.pad(points.real, pad, mode="edge"), HAMPEL_WINDOW)
+        north = sliding_window_view(np.pad(points.imag, pad, mode="edge"), HAMPEL_WINDOW)
+        median = np.median(east, axis=1) + 1j * np.median(north, axis=1)
+        return np.abs(points - median) <= np.maximum(GPS_OUTLIER_MIN_METERS, HAMPEL_SIGMAS * accuracies)
+
+    def _filter(self, points: list, variances: list, seconds: list, latitudes: list, longitudes: list) -> int:
+        """Recursão do filtro sobre as localizações já ordenadas; retorna quantas foram usadas."""
+        accepted = 0
+        q, gate = self.q, self.gate
+        for index, (z, r, t) in enumerate(zip(points, variances, seconds)):
+            if self.time is None or t - self.time > GPS_RESET_SECONDS or self.rejections >= GPS_MAX_CONSECUTIVE_REJECTIONS:
+                if self.time is not None:
+                    self.stats["resets"] += 1
+                    # Recentraliza a projeção para o erro da projeção não crescer em trajetos longos
+                    self._set_origin(latitudes[index], longitudes[index])
+                    z = 0j
+                    for rest in range(index + 1, len(points)):
+                        points[rest] = complex(self._project(np.float64(latitudes[rest]), np.float64(longitudes[rest])))
+                self.position, self.velocity = z, 0j
+                self.p_pos, self.p_cross, self.p_vel = r, 0.0, INITIAL_SPEED_SIGMA ** 2
+                self.time = t
+                self.rejections = 0
+                accepted += 1
+                continue
+
+            # Predição (velocidade constante, aceleração como ruído branco)
+            dt = t - self.time
+            p_pos = self.p_pos + dt * (2 * self.p_cross + dt * self.p_vel) + q * dt ** 3 / 3
+            p_cross = self.p_cross + dt * self.p_vel + q * dt ** 2 / 2
+            p_vel = self.p_vel + q * dt
+            predicted = self.position + self.velocity * dt
+
+            # Inovação e teste de Mahalanobis (mesma variância nos dois eixos)
+            innovation = z - predicted
+            s = p_pos + r
+            if (innovation.real ** 2 + innovation.imag ** 2) / s > gate:
+                self.rejections += 1
+                self.stats["outliers"] += 1
+                continue
+
+            gain_pos = p_pos / s
+            gain_vel = p_cross / s
+            self.position = predicted + gain_pos * innovation
+            self.velocity += gain_vel * innovation
+            self.p_pos = p_pos * (1 - gain_pos)
+            self.p_cross = p_cross * (1 - gain_pos)
+            self.p_vel = p_vel - gain_vel * p_cross
+            self.time = t
+            self.rejections = 0
+            accepted += 1
+        return accepted
+
+    def _estimate(self, accepted: int, rejected: int) -> FilteredPosition:
+        latitude = self.origin[0] + self.position.imag / METERS_PER_DEGREE
+        longitude = self.origin[1] + self.position.real / self.meters_per_degree_lng
+        speed = abs(self.velocity)
+        heading = math.degrees(math.atan2(self.velocity.real, self.velocity.imag)) % 360 if speed >= MIN_HEADING_SPEED else None
+        return FilteredPosition(latitude, longitude, math.sqrt(self.p_pos) / ACCURACY_TO_SIGMA, speed, heading,
+                                self.time * 1000, accepted, rejected)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
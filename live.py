@@ -0,0 +1,185 @@
+"""
+Navegação ao vivo por WebSocket.
+
+Em vez de o frontend fazer um POST em /navigate/ a cada intervalo, ele abre uma conexão
+WebSocket e envia as localizações do GPS assim que chegam. O servidor responde na hora com
+o progresso, avisos de manobra próxima ("em 20 metros, vire à esquerda") e rotas novas
+quando há desvio.
+
+Protocolo (mensagens JSON):
+    cliente -> servidor
+        {"type": "start", "destination": "...", "session_id": "... (opcional)", "route_version": "... (opcional)"}
+        {"type": "fix", "latitude": -23.5, "longitude": -46.6}
+        {"type": "pong"}
+    servidor -> cliente
+        {"type": "route", ...campos de NavigationResponse}   rota completa (início ou desvio)
+        {"type": "progress", ...campos de NavigationResponse} rota inalterada, só progresso
+        {"type": "approaching", "currentStep": 2, "distance": 18.5}
+        {"type": "ping"} / {"type": "error", "detail": "..."}
+
+Cada conexão tem uma tarefa de leitura e a tarefa do próprio endpoint, que processa as
+localizações. Se o processamento (ex.: recálculo de rota) demorar, apenas a localização mais
+recente fica pendente: as intermediárias são descartadas, o que mantém a memória por conexão
+constante e evita respostas atrasadas.
+
+Mensagens inválidas (frame binário, JSON malformado, algo que não seja um objeto, tipo
+desconhecido, campos ausentes ou localização fora da faixa) recebem um {"type": "error"} e a
+conexão continua.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15")) # Intervalo entre pings do servidor
+LIVE_IDLE_TIMEOUT_SECONDS = float(os.getenv("LIVE_IDLE_TIMEOUT_SECONDS", "60")) # Fecha conexões sem mensagens do cliente
+LIVE_SEND_TIMEOUT_SECONDS = float(os.getenv("LIVE_SEND_TIMEOUT_SECONDS", "5")) # Cliente que não lê a tempo é desconectado
+APPROACH_CUE_METERS = float(os.getenv("APPROACH_CUE_METERS", "20")) # Distância do aviso de manobra próxima
+
+# Assinatura: (latitude, longitude, destino, session_id, versão da rota conhecida) -> resposta de navegação
+NavigationUpdate = Callable[[float, float, str, Optional[str], Optional[str]], Awaitable[dict]]
+
+
+class LiveNavigationConnection:
+    """Estado e laço de uma conexão de navegação ao vivo."""
+
+    def __init__(self, websocket: WebSocket, update: NavigationUpdate):
+        self.websocket = websocket
+        self.update = update
+        self.destination: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.route_version: Optional[str] = None
+        self.last_received = time.monotonic()
+        self.dropped_fixes = 0 # Localizações substituídas por outras mais recentes antes de serem processadas
+        self.invalid_messages = 0 # Mensagens recusadas com {"type": "error"}
+        self._pending_fix: Optional[tuple] = None
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._cued_step: Optional[int] = None # Passo para o qual o aviso de manobra já foi enviado
+
+    async def run(self):
+        await self.websocket.accept()
+        reader = asyncio.create_task(self._read())
+        try:
+            await self._process()
+        finally:
+            reader.cancel()
+
+    async def _read(self):
+        """Lê as mensagens do cliente, guardando apenas a localização mais recente."""
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                self.last_received = time.monotonic()
+                raw = message.get("text")
+                # Frame binário: o protocolo é só de texto
+                error = "Envie as mensagens como texto JSON." if raw is None else self._handle_message(raw)
+                if error:
+                    self.invalid_messages += 1
+                    if not await self._send({"type": "error", "detail": error}):
+                        return
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self._closed = True
+            self._wakeup.set()
+
+    def _handle_message(self, raw: str) -> Optional[str]:
+        """Aplica uma mensagem do cliente; retorna a descrição do erro se ela for inválida."""
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return "Mensagem inválida: JSON malformado."
+        if not isinstance(message, dict):
+            return "Mensagem inválida: esperado um objeto JSON."
+        kind = message.get("type")
+        if kind == "start":
+            destination = message.get("destination")
+            session_id, route_version = message.get("session_id"), message.get("route_version")
+            if not isinstance(destination, str) or not destination.strip():
+                return "Mensagem 'start' sem destino."
+            if not all(value is None or isinstance(value, str) for value in (session_id, route_version)):
+                return "Mensagem 'start' inválida: session_id e route_version devem ser texto."
+            self.destination = destination
+            self.session_id = session_id
+            self.route_version = route_version # Versão que o cliente já tem (evita reenviar a rota)
+        elif kind == "fix":
+            fix = parse_fix(message)
+            if fix is None:
+                return "Localização inválida: latitude e longitude devem ser números dentro da faixa."
+            if self._pending_fix is not None:
+                self.dropped_fixes += 1
+            self._pending_fix = fix
+            self._wakeup.set()
+        elif kind != "pong":
+            return f"Tipo de mensagem desconhecido: {kind!r}."
+        return None
+
+    async def _process(self):
+        """Processa as localizações pendentes e envia heartbeats enquanto a conexão estiver aberta."""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if time.monotonic() - self.last_received > LIVE_IDLE_TIMEOUT_SECONDS:
+                    await self.websocket.close(code=1001)
+                    return
+                if not await self._send({"type": "ping"}):
+                    return
+                continue
+            self._wakeup.clear()
+            fix, self._pending_fix = self._pending_fix, None
+            if fix is None:
+                continue
+            if not self.destination:
+                await self._send({"type": "error", "detail": "Envie uma mensagem 'start' com o destino antes das localizações."})
+                continue
+            if not await self._handle_fix(*fix):
+                return
+
+    async def _handle_fix(self, latitude: float, longitude: float) -> bool:
+        data = await self.update(latitude, longitude, self.destination, self.session_id, self.route_version)
+        self.session_id = data.get("sessionId", self.session_id)
+        if data.get("routeVersion") and data.get("routeVersion") != self.route_version:
+            self.route_version = data["routeVersion"]
+            self._cued_step = None
+        if not await self._send({"type": "progress" if data.get("unchanged") else "route", **data}):
+            return False
+
+        progress = data.get("progress") or {}
+        if progress.get("arrived"):
+            await self.websocket.close(code=1000)
+            return False
+        step = progress.get("currentStep")
+        distance = progress.get("distanceToNextManeuver")
+        if step is not None and distance is not None and distance <= APPROACH_CUE_METERS and step != self._cued_step:
+            self._cued_step = step
+            return await self._send({"type": "approaching", "currentStep": step, "distance": distance})
+        return True
+
+    async def _send(self, message: dict) -> bool:
+        """Envia uma mensagem; retorna False (e encerra) se o cliente não a receber a tempo."""
+        try:
+            await asyncio.wait_for(self.websocket.send_text(json.dumps(message)), timeout=LIVE_SEND_TIMEOUT_SECONDS)
+            return True
+        except (asyncio.TimeoutError, WebSocketDisconnect, RuntimeError):
+            self._closed = True
+            return False
+
+
+def parse_fix(message: dict) -> Optional[tuple]:
+    """(latitude, longitude) de uma mensagem "fix", ou None se faltarem números válidos."""
+    latitude, longitude = message.get("latitude"), message.get("longitude")
+    # bool é subclasse de int, mas true/false não são coordenadas
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in (latitude, longitude)):
+        return None
+    latitude, longitude = float(latitude), float(longitude)
+    if not (math.isfinite(latitude) and math.isfinite(longitude)) or abs(latitude) > 90 or abs(longitude) > 180:
+        return None
+    return latitude, longitude
@@ -0,0 +1,68 @@
+"""
+Configuração do logging do backend.
+
+As mensagens vão para uma fila em memória (QueueHandler) e são formatadas e escritas por uma
+thread separada (QueueListener): o loop de eventos nunca espera a escrita no terminal. As
+mensagens de cada requisição usam o nível DEBUG e, com o nível padrão (INFO), são descartadas
+antes mesmo de formatadas.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper() # DEBUG mostra o passo a passo de cada requisição
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s: %(message)s")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000")) # Mensagens aguardando escrita; além disso, são descartadas
+
+_listener = None
+_handler = None
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enfileira o registro sem formatá-lo (a formatação fica com a thread de escrita) e o
+    descarta se a fila estiver cheia, em vez de bloquear a requisição.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel) # Espera espaço na fila: as mensagens anteriores são escritas antes de parar
+
+
+def setup_logging(level: str = LOG_LEVEL, stream=None):
+    """Instala o QueueHandler na raiz e inicia a thread de escrita (uma vez por processo)."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    _handler = _DroppingQueueHandler(records)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _listener = _Listener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Escreve as mensagens que ainda estão na fila e encerra a thread."""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
@@ -1,17 +1,63 @@
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
-import requests
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-import googlemaps # Importe a biblioteca do cliente Google Maps
-import re # Importar o módulo re para limpeza de HTML
+import asyncio
+import functools
+import json
+import logging
+import math
+import secrets
+import time
+from contextlib import asynccontextmanager
+from providers import (GoogleDirectionsProvider, OfflineDirectionsProvider, OSRMDirectionsProvider, build_pooled_session,
+                       DIRECTIONS_TIMEOUT_SECONDS, OSRM_URL)
+from sessions import SessionStore, RouteProgress
+from geocoding import GeocodeCache, Geocoder, normalize_destination
+from route_cache import RouteCache, create_route_cache_backend, route_cache_key
+from route_model import Route
+from singleflight import SingleFlight
+from live import LiveNavigationConnection, LIVE_SEND_TIMEOUT_SECONDS
+from offline_router import OfflineRouter, OFFLINE_OSM_PATH
+from routing import RoutingPool, ROUTING_PROVIDERS
+from refinement import GeminiStreamingModel, InstructionRefiner, RefinementCache, load_gemini_model
+from dispatch import create_share_dispatcher
+from tts import AudioCache, SpeechSynthesizer, create_tts_engine, media_type, CACHE_CONTROL
+from metrics import (REGISTRY, NAVIGATION_UPDATES, REROUTES, GPS_FIXES, DEGRADED_NAVIGATION, CONTENT_TYPE,
+                     ServerTimingMiddleware, gauge, snapshot_counters, stage)
+from admission import AdmissionController, AdmissionDenied, DAILY_BUDGET
+from gps_filter import FilteredPosition, PositionFilter, GPS_MAX_BATCH
+from reroute_prefetch import ReroutePrefetcher
+from share_links import PositionHub, ShareLinkSigner, WatcherLimitReached, SHARE_LINK_BASE_URL
+from logs import setup_logging
 
 load_dotenv()
-
-app = FastAPI()
+setup_logging() # Logging em fila: a escrita no terminal acontece fora do loop de eventos (logs.py)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize_providers() # Uma vez por worker, antes da primeira requisição
+    share_dispatcher.start() # Retoma os envios que ficaram no spool antes do último reinício
+    yield
+    await share_dispatcher.stop()
+    await reroute_prefetcher.stop()
+    await route_cache.close()
+    await geocode_cache.close()
+    if refiner:
+        await refiner.cache.close()
+    # Threads dos provedores (o do Google também atende o Geocoding, mesmo fora do pool de rotas)
+    for provider in {directions_provider, *(slot.provider for slot in routing_pool.slots)} - {None}:
+        provider.shutdown()
+    if speech:
+        await speech.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configuração do CORS para permitir requisições do frontend
 # Em produção, substitua "*" pela origem específica do seu frontend (ex: "https://seusite.com")
@@ -21,55 +67,193 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"], # Permite que o frontend leia a versão da rota e o tempo de cada etapa
 )
+# Duração de cada requisição e de suas etapas: histogramas em /metrics e cabeçalho Server-Timing
+app.add_middleware(ServerTimingMiddleware)
 
 # Configuração das APIs
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") # Chave para a API do Gemini
 Maps_API_KEY = os.getenv("Maps_API_KEY") # Chave para as APIs do Google Maps
-
-# Configurar Gemini
-USE_GEMINI_FOR_REFINEMENT = False
-if not GOOGLE_API_KEY:
-    print("Aviso: GOOGLE_API_KEY não configurada no arquivo .env. Gemini não será usado.")
-else:
-     try:
-         genai.configure(api_key=GOOGLE_API_KEY)
-         # Testar uma chamada simples para verificar a configuração
-         # model = genai.GenerativeModel('gemini-pro') # Use o modelo apropriado
-         # model.generate_content("test").text # Remover em produção
-         model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17') # Use o modelo apropriado
-         #USE_GEMINI_FOR_REFINEMENT = True # Desativado refinamento para melhorar a velocidade da consulta.
-         print("API do Gemini configurada com sucesso.")
-     except Exception as e:
-         print(f"Aviso: Falha ao configurar a API do Gemini. Gemini não será usado para refinar instruções: {e}")
-         USE_GEMINI_FOR_REFINEMENT = False
-
-
-# Crie o cliente Google Maps (usado no backend para a Directions API)
-gmaps = None # Inicializa como None
-if not Maps_API_KEY:
-    print("Aviso: Maps_API_KEY não configurada no arquivo .env. As funções que dependem dela não funcionarão.")
-else:
-    try:
-        gmaps = googlemaps.Client(key=Maps_API_KEY)
-        print("Cliente Google Maps inicializado com sucesso.")
-        # Opcional: Testar uma chamada simples da API Directions
-        # directions_test = gmaps.directions("Central Park, NY", "Times Square, NY")
-        # print(f"Teste da Google Directions API: {len(directions_test)} rotas encontradas.") # Remover em produção
-    except Exception as e:
-        print(f"Erro ao inicializar o cliente Google Maps: {e}")
-        gmaps = None # Garante que gmaps seja None em caso de erro
+MAPS_API_BASE_URL = os.getenv("MAPS_API_BASE_URL", "https://maps.googleapis.com") # Servidor local nos testes de carga (benchmarks/load_test.py)
+
+USE_GEMINI_FOR_REFINEMENT = os.getenv("USE_GEMINI_FOR_REFINEMENT", "true").lower() == "true"
+
+# Clientes dos provedores externos, caches e fila de compartilhamento (os que abrem arquivos SQLite).
+# Nada disso é criado na importação do módulo: `initialize_providers`
+# roda no lifespan (uma vez por worker, antes de aceitar requisições) ou, se o app for usado sem
+# lifespan, na primeira requisição que precisar deles. Os SDKs pesados só são importados quando
+# usados: o do Gemini no primeiro refinamento (refinement.py), o do Google Cloud TTS ao criar o motor.
+providers_initialized = False
+gmaps = None # Cliente Google Maps (Directions e Geocoding)
+directions_provider = None # Executa as chamadas do gmaps fora do loop de eventos (Directions e Geocoding)
+geocoder = None # Resolve o texto do destino uma única vez (com cache)
+routing_pool = None # Hedge, circuit breaker e fallback entre os provedores
+refiner = None # Agenda o refinamento das instruções e entrega o texto por /refinements/{id}
+tts_engine = None
+speech = None # Áudio das instruções sintetizado no servidor (TTS_ENGINE); sem motor, o frontend usa a fala do aparelho
+provider_errors = {} # Provedor -> erro na inicialização, para /readyz
+geocode_cache = None # Destinos resolvidos (memória + SQLite)
+route_cache = None # Rotas compartilhadas por célula de origem + destino
+share_dispatcher = None # Fila de envio do compartilhamento de localização (e-mail/WhatsApp); as requisições só enfileiram
+directions_flight = SingleFlight("directions") # Pedidos idênticos simultâneos geram uma única chamada ao Google
+
+
+def initialize_providers():
+    """
+    Cria os caches, a fila de compartilhamento e os clientes do Google Maps, dos provedores de rota,
+    do Gemini e do TTS (só na primeira chamada).
+    """
+    global providers_initialized, gmaps, directions_provider, geocoder, routing_pool, refiner, tts_engine, speech
+    global geocode_cache, route_cache, share_dispatcher
+    if providers_initialized:
+        return
+    providers_initialized = True
+    started = time.perf_counter()
+
+    # Caches e spool em disco: abrem (ou criam) os arquivos SQLite, e o spool recarrega os envios pendentes
+    geocode_cache = GeocodeCache()
+    route_cache = RouteCache(create_route_cache_backend())
+    share_dispatcher = create_share_dispatcher()
+
+    # Configurar Gemini: só a chave é guardada aqui; o SDK é importado e configurado no primeiro refinamento
+    # O refinamento roda em segundo plano (refinement.py) e não atrasa a resposta de /navigate/
+    if not GOOGLE_API_KEY:
+        logger.warning("GOOGLE_API_KEY não configurada no arquivo .env. Gemini não será usado.")
+    elif USE_GEMINI_FOR_REFINEMENT:
+        refiner = InstructionRefiner(GeminiStreamingModel(loader=functools.partial(load_gemini_model, GOOGLE_API_KEY)),
+                                     RefinementCache())
+
+    # Crie o cliente Google Maps (usado no backend para a Directions API)
+    if not Maps_API_KEY:
+        logger.warning("Maps_API_KEY não configurada no arquivo .env. As funções que dependem dela não funcionarão.")
+    else:
+        try:
+            import googlemaps
+
+            # Sessão com pool keep-alive compartilhada pelas threads do provedor
+            gmaps = googlemaps.Client(key=Maps_API_KEY, timeout=DIRECTIONS_TIMEOUT_SECONDS,
+                                      requests_session=build_pooled_session(), base_url=MAPS_API_BASE_URL)
+            directions_provider = GoogleDirectionsProvider(gmaps)
+            geocoder = Geocoder(directions_provider, geocode_cache)
+            logger.info("Cliente Google Maps inicializado com sucesso.")
+        except Exception as e:
+            logger.error("Erro ao inicializar o cliente Google Maps: %s", e)
+            provider_errors["google"] = str(e)
+            gmaps = directions_provider = geocoder = None
+
+    # Motores de rota disponíveis; ROUTING_PROVIDERS define quais são usados e em que ordem
+    # (ex.: "google,osrm,offline"). O Google continua sendo usado para geocodificar o destino, se a chave existir.
+    route_providers = {"google": directions_provider}
+    if OSRM_URL and "osrm" in ROUTING_PROVIDERS:
+        route_providers["osrm"] = OSRMDirectionsProvider(OSRM_URL)
+    if "offline" in ROUTING_PROVIDERS:
+        try:
+            route_providers["offline"] = OfflineDirectionsProvider(OfflineRouter.from_osm())
+            logger.info("Roteador offline carregado de %s.", OFFLINE_OSM_PATH)
+        except Exception as e:
+            logger.error("Erro ao carregar o roteador offline (%s): %s", OFFLINE_OSM_PATH, e)
+            provider_errors["offline"] = str(e)
+    routing_pool = RoutingPool.from_providers(route_providers)
+    logger.info("Provedores de rota ativos: %s", [slot.name for slot in routing_pool.slots])
+
+    tts_engine = create_tts_engine()
+    speech = SpeechSynthesizer(tts_engine, AudioCache()) if tts_engine else None
+    logger.info("Provedores inicializados em %.0f ms.", (time.perf_counter() - started) * 1000)
+
+
+def provider_states() -> dict:
+    """Estado de cada provedor: live, open/half_open (circuit breaker), pending/failed (Gemini), disabled ou o erro."""
+    routing = {slot.name: "live" if slot.breaker.state == "closed" else slot.breaker.state
+               for slot in routing_pool.slots} if routing_pool else {}
+    for name, error in provider_errors.items():
+        routing.setdefault(name, f"erro: {error}")
+    return {
+        "routing": routing,
+        "geocoding": "live" if geocoder else "disabled",
+        "gemini": getattr(refiner.model, "state", "live") if refiner else "disabled",
+        "tts": speech.engine.identity if speech else "disabled",
+    }
 
 # Modelo para receber dados de localização e destino do frontend
 class LocationData(BaseModel):
     latitude: float
     longitude: float
     destination: str
+    session_id: Optional[str] = None # Sessão de navegação retornada na primeira resposta
+
+# Uma localização do GPS como entregue por watchPosition no navegador
+class GPSFix(BaseModel):
+    latitude: float
+    longitude: float
+    accuracy: float # Metros (coords.accuracy)
+    timestamp: float # Milissegundos desde a época (position.timestamp)
+
+# Localizações acumuladas pelo cliente desde o último envio
+class FixBatch(BaseModel):
+    destination: str
+    session_id: Optional[str] = None
+    fixes: List[GPSFix] = Field(min_length=1, max_length=GPS_MAX_BATCH)
+
+# Posição estimada pelo servidor a partir de um lote de localizações
+class SmoothedPosition(BaseModel):
+    latitude: float
+    longitude: float
+    accuracy: float # Metros (68%), como coords.accuracy
+    speed: float # m/s
+    heading: Optional[float] = None # Graus a partir do norte; ausente quando parado
+    accepted: int # Localizações do lote usadas
+    rejected: int # Localizações do lote descartadas (imprecisas, antigas ou saltos)
+
+# Progresso do usuário na rota, calculado localmente pela sessão de navegação
+class NavigationProgress(BaseModel):
+    currentStep: int # Índice do passo atual (0 = primeiro passo)
+    distanceToNextManeuver: float # Metros até o fim do passo atual
+    remainingDistance: float # Metros até o destino
+    remainingDuration: float # Segundos estimados até o destino
+    offRoute: bool = False
+    arrived: bool = False
 
 # Modelo para a resposta enviada de volta ao frontend
+# Quando o cliente já tem a versão atual da rota (If-None-Match), a resposta é um "delta":
+# unchanged=True + progresso, sem instructions/routeData.
 class NavigationResponse(BaseModel):
-    instructions: str
+    instructions: Optional[str] = None
     routeData: Optional[dict] = None # Campo opcional para dados da rota (polyline)
+    sessionId: Optional[str] = None # Identificador da sessão de navegação
+    routeVersion: Optional[str] = None # Versão da rota (também enviada no cabeçalho ETag)
+    unchanged: bool = False # True quando a rota não mudou desde a versão informada pelo cliente
+    progress: Optional[NavigationProgress] = None
+    rerouted: bool = False # True quando a rota foi recalculada por desvio
+    refinementId: Optional[str] = None # Instruções refinadas pelo Gemini, entregues depois em /refinements/{id}
+    audioIds: Optional[List[Optional[str]]] = None # Áudio de cada linha de `instructions`, em /tts/{id}
+    position: Optional[SmoothedPosition] = None # Posição suavizada (apenas em /navigate/fixes)
+    degraded: Optional[str] = None # Sem cota para uma rota nova: "tracking" (segue a rota atual) ou "status" (só o aviso)
+    status: Optional[str] = None # Aviso a ser falado junto com o progresso (modo "tracking")
+    retryAfter: Optional[float] = None # Segundos até uma nova rota poder ser pedida (também no cabeçalho Retry-After)
+
+# Link de acompanhamento ao vivo de uma sessão
+class ShareLinkResponse(BaseModel):
+    token: str
+    url: str # Página de acompanhamento (watch.html) com o token
+    eventsUrl: str # Posições por Server-Sent Events
+    wsUrl: str # Posições por WebSocket
+    expiresAt: int # Epoch (s) em que o link expira
+
+
+# Sessões de navegação ativas (rota planejada + progresso), mantidas em memória
+navigation_sessions = SessionStore()
+
+# Limites de chamadas aos provedores de rota (por sessão, global e cota diária), verificados antes de cada chamada
+admission = AdmissionController()
+
+# Rotas alternativas pré-calculadas nas próximas manobras de cada sessão (reroute_prefetch.py)
+reroute_prefetcher = ReroutePrefetcher(
+    lambda latitude, longitude, destination: get_google_directions(latitude, longitude, destination, prefetch=True))
+
+# Acompanhamento ao vivo: a navegação publica a posição e os acompanhantes do link recebem por SSE ou WebSocket
+share_hub = PositionHub()
+share_signer = ShareLinkSigner()
 
 
 # --- Endpoint para fornecer a Chave da API do Google Maps para o frontend ---
@@ -80,107 +264,241 @@ async def get_Maps_api_key():
     A chave retornada deve ser restrita por HTTP referrer (seu domínio/endereço do frontend)
     no Google Cloud Console para segurança.
     """
-    print("Requisição recebida para /Maps_api_key/")
+    logger.debug("Requisição recebida para /Maps_api_key/")
     if not Maps_API_KEY:
-        print("Erro: Maps_API_KEY não configurada no backend.")
+        logger.error("Maps_API_KEY não configurada no backend.")
         raise HTTPException(status_code=500, detail="Chave da API do Google Maps não configurada no backend.")
-    print("Chave da API do Google Maps fornecida ao frontend.")
+    logger.debug("Chave da API do Google Maps fornecida ao frontend.")
     return {"apiKey": Maps_API_KEY}
 
+# --- Endpoint com os contadores dos caches do backend ---
+@app.get("/cache_stats/")
+async def get_cache_stats():
+    """Retorna os contadores de acerto/erro dos caches (útil para monitoramento)."""
+    initialize_providers()
+    return {
+        "geocoding": geocode_cache.snapshot(),
+        "routes": route_cache.snapshot(),
+        "coalescing": {
+            "directions": directions_flight.snapshot(),
+            "geocode": geocoder.flight.snapshot() if geocoder else None,
+        },
+        "refinement": refiner.snapshot() if refiner else None,
+        "tts": speech.snapshot() if speech else None,
+    }
+
+# --- Endpoints de saúde (liveness) e prontidão (readiness) ---
+@app.get("/healthz")
+async def health():
+    """O processo está de pé e o loop de eventos responde (não consulta nenhum provedor)."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness(response: Response):
+    """
+    Pronto para receber tráfego: provedores inicializados e pelo menos um provedor de rota com o
+    circuito fechado. Responde 503 caso contrário. Traz o estado de cada provedor.
+    """
+    states = provider_states()
+    ready = providers_initialized and any(state in ("live", "half_open") for state in states["routing"].values())
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "providers": states}
+
+# --- Métricas no formato do Prometheus ---
+def component_metrics():
+    """Contadores mantidos pelos componentes (os mesmos de /cache_stats/, /routing_stats/ e /share_stats/)."""
+    caches = {"geocoding": geocode_cache.snapshot(), "routes": route_cache.snapshot()}
+    if refiner:
+        caches["refinement"] = refiner.cache.snapshot()
+    if speech:
+        caches["tts"] = speech.cache.snapshot()
+    yield snapshot_counters("blindview_cache_events_total", "Acertos, erros e atualizações dos caches.", "cache", caches,
+                            exclude=("entries", "files", "bytes", "max_bytes"))
+    yield gauge("blindview_cache_entries", "Entradas em cada cache.",
+                {(("cache", name),): snapshot.get("entries", snapshot.get("files")) for name, snapshot in caches.items()})
+    flights = {"directions": directions_flight.snapshot(), "geocode": geocoder.flight.snapshot() if geocoder else None}
+    yield snapshot_counters("blindview_coalescing_events_total", "Pedidos idênticos agrupados em uma única chamada.", "flight",
+                            flights, exclude=("in_flight",))
+
+    providers = routing_pool.snapshot()["providers"] if routing_pool else {}
+    yield snapshot_counters("blindview_routing_provider_events_total",
+                            "Chamadas aos provedores de rota: failures são os erros do provedor (Google, OSRM, offline).",
+                            "provider", providers, exclude=("times_opened", "budget_seconds", "p50_ms", "p95_ms"))
+    yield gauge("blindview_routing_circuit_open", "1 se o circuit breaker do provedor está aberto.",
+                {(("provider", name),): int(slot["state"] == "open") for name, slot in providers.items()})
+
+    share = share_dispatcher.snapshot()
+    yield snapshot_counters("blindview_share_events_total", "Fila de compartilhamento da localização.", "queue",
+                            {"share": share}, exclude=("pending", "in_flight"))
+    yield gauge("blindview_share_pending", "Compartilhamentos aguardando envio.", {(): share["pending"]})
+    hub = share_hub.snapshot()
+    yield snapshot_counters("blindview_share_link_events_total",
+                            "Acompanhamento ao vivo: posições publicadas, entregues, descartadas (acompanhante lento) e links encerrados.",
+                            "hub", {"live": hub}, exclude=("topics", "watchers"))
+    yield gauge("blindview_share_link_topics", "Links de acompanhamento ativos neste worker.", {(): hub["topics"]})
+    yield gauge("blindview_share_link_watchers", "Acompanhantes conectados neste worker.", {(): hub["watchers"]})
+    if refiner:
+        yield snapshot_counters("blindview_refinement_events_total", "Refinamentos das instruções pelo Gemini.", "model",
+                                {"gemini": refiner.snapshot()}, exclude=("in_progress",))
+    if speech:
+        yield snapshot_counters("blindview_tts_events_total", "Síntese do áudio das instruções.", "engine",
+                                {speech.engine.identity: speech.snapshot()}, exclude=("pending",))
+    yield gauge("blindview_navigation_sessions", "Sessões de navegação em memória.", {(): len(navigation_sessions)})
+    limits = admission.snapshot()
+    yield snapshot_counters("blindview_admission_events_total",
+                            "Chamadas aos provedores de rota admitidas ou recusadas, por motivo.", "limiter",
+                            {"directions": limits}, exclude=("budget_used", "budget_remaining", "tracked_keys"))
+    yield snapshot_counters("blindview_reroute_prefetch_events_total",
+                            "Rotas alternativas pré-calculadas nas próximas manobras e desvios atendidos por elas (hits).",
+                            "prefetcher", {"reroute": reroute_prefetcher.snapshot()}, exclude=("in_flight",))
+    yield gauge("blindview_directions_budget_remaining", "Chamadas restantes na cota diária deste worker.",
+                {(): limits["budget_remaining"]})
+
+
+REGISTRY.add_collector(component_metrics)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Histogramas de latência por etapa e por rota HTTP e contadores do backend, no formato de texto do Prometheus."""
+    initialize_providers()
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# --- Endpoint com o estado da fila de compartilhamento ---
+@app.get("/share_stats/")
+async def get_share_stats():
+    """Envios pendentes, coalescidos, em lote, com retentativa e descartados da fila de compartilhamento."""
+    initialize_providers()
+    return {**share_dispatcher.snapshot(), "live": share_hub.snapshot()}
+
+# --- Endpoint com o estado dos provedores de rota ---
+@app.get("/routing_stats/")
+async def get_routing_stats():
+    """Latências, falhas, hedges e estado do circuit breaker de cada provedor de rota, e os limites de chamadas."""
+    initialize_providers()
+    return {**routing_pool.snapshot(), "admission": admission.snapshot(), "prefetch": reroute_prefetcher.snapshot()}
+
 # --- Funções para Interagir com as APIs do Google Maps (Backend) ---
 
-async def get_google_directions(latitude: float, longitude: float, destination: str) -> Optional[dict]:
+async def get_google_directions(latitude: float, longitude: float, destination: str,
+                                session_id: Optional[str] = None, client: Optional[str] = None,
+                                reroute: bool = False, prefetch: bool = False) -> Optional[Route]:
     """
-    Obtém instruções de navegação usando a API Directions do Google Maps.
-    Requer o cliente Google Maps inicializado.
-    Retorna o objeto de rota completo ou None em caso de erro/sem resultado.
+    Obtém instruções de navegação usando os provedores de rota configurados (ROUTING_PROVIDERS):
+    Google Directions, servidor OSRM e/ou roteador offline, com hedge, circuit breaker e fallback.
+    As chamadas rodam no pool de threads de cada provedor, sem bloquear o loop de eventos.
+    O texto do destino é resolvido (com cache) para um place_id antes da chamada, evitando
+    que a Directions API geocodifique o mesmo texto a cada atualização.
+    O resultado passa pelo cache de rotas: origens na mesma célula com o mesmo destino
+    reaproveitam a rota sem chamar o Google, e pedidos iguais em andamento são agrupados
+    em uma única chamada.
+    A resposta do provedor é convertida uma única vez para `Route` (route_model.py), a forma
+    compacta guardada no cache e nas sessões.
+    Cada chamador que não acerta o cache passa pelo controle de admissão (admission.py) antes de
+    iniciar ou aguardar a chamada aos provedores. Se ele for recusado, a rota do cache é servida
+    mesmo vencida; sem cache, `AdmissionDenied` é levantada para `update_navigation` degradar a
+    resposta. Pré-cálculos (`prefetch`) não recebem rota vencida.
+    Retorna a rota ou None em caso de erro/sem resultado.
     """
-    print(f"Chamado get_google_directions para destino '{destination}' da localização ({latitude}, {longitude}).")
-    if not gmaps:
-        print("Erro: Cliente Google Maps não inicializado. Verifique Maps_API_KEY no .env.")
+    logger.debug("Chamado get_google_directions para destino '%s' da localização (%s, %s).", destination, latitude, longitude)
+    if not routing_pool:
+        logger.error("Nenhum provedor de rotas inicializado. Verifique Maps_API_KEY e ROUTING_PROVIDERS no .env.")
         return None
 
     origin = f"{latitude},{longitude}"
 
+    # Resolver o destino para place_id/coordenadas; em caso de falha, usar o texto original
+    route_destination = destination
+    coordinates = None # Destino em "lat,lng" para os provedores que não aceitam place_id (OSRM, offline)
+    cache_destination = normalize_destination(destination)
     try:
-        # Chame a API Directions do Google Maps
-        # A biblioteca googlemaps-python lida com a requisição HTTP e a chave automaticamente
-        directions_result = gmaps.directions(
-            origin=origin,
-            destination=destination,
-            mode="walking",  # Modo a pé
-            language="pt-BR", # Idioma das instruções
-            units="metric" # Unidades métricas (metros)
-             # Opcional: adicionar waypoints se necessário
-        )
-        print(f"Resposta da Google Directions API recebida. Resultados: {len(directions_result) if directions_result else 0}")
+        with stage("geocode"):
+            place = await geocoder.resolve(destination, latitude, longitude) if geocoder else None
+        if place:
+            route_destination = cache_destination = place.as_directions_destination(
+                prefer_coordinates=not routing_pool.accepts_place_id)
+            coordinates = place.as_directions_destination(prefer_coordinates=True)
+            logger.debug("Destino '%s' resolvido para %s.", destination, route_destination)
+    except Exception as e:
+        logger.warning("Erro ao geocodificar '%s', usando o texto original: %s", destination, e)
 
+    async def fetch_route() -> Optional[Route]:
+        # Pede a rota aos provedores configurados (Google Directions, OSRM, offline), com hedge e fallback
+        directions_result = await routing_pool.directions(origin, route_destination, mode="walking", coordinates=coordinates)
+        logger.debug("Resposta dos provedores de rota recebida. Resultados: %d", len(directions_result) if directions_result else 0)
 
         if directions_result and len(directions_result) > 0:
             # Retorna o primeiro resultado de rota encontrado
-            route = directions_result[0]
-            # print("Primeira rota encontrada:", route) # Pode ser muito verboso, descomente para depuração
-            return route
-        else:
-            print(f"Google Directions API falhou para '{destination}': Nenhum resultado encontrado.")
+            # logger.debug("Primeira rota encontrada: %s", directions_result[0]) # Pode ser muito verboso, descomente para depuração
+            return Route.from_directions(directions_result[0])
+        logger.info("Nenhum provedor de rotas encontrou resultado para '%s'.", destination)
+        return None
+
+    async def admit_and_fetch() -> Optional[Route]:
+        # Cada chamador passa pela admissão antes de iniciar ou aguardar a chamada em andamento:
+        # a decisão sobre a sessão (ou o pré-cálculo) que iniciou a chamada não vale para as outras
+        admission.admit(session_id, client, reroute=reroute, prefetch=prefetch, # Levanta AdmissionDenied se a sessão ou o worker passou do limite
+                        coalesced=directions_flight.running(cache_key))
+        return await directions_flight.do(cache_key, fetch_route)
+
+    async def refresh_route() -> Optional[Route]:
+        # Atualização em segundo plano de uma rota vencida: o chamador já recebeu a rota do cache,
+        # então não gasta as fichas da sessão; valem só o limite global e a cota, fora da reserva
+        try:
+            admission.admit(reroute=True, coalesced=directions_flight.running(cache_key))
+        except AdmissionDenied as denied:
+            logger.debug("Atualização da rota em cache adiada (%s).", denied.reason)
             return None
+        return await directions_flight.do(cache_key, fetch_route)
+
+    try:
+        cache_key = route_cache_key(latitude, longitude, cache_destination, mode="walking")
+        with stage("directions"): # Inclui acertos do cache de rotas (rápidos) e chamadas aos provedores
+            return await route_cache.get_or_fetch(cache_key, admit_and_fetch, refresh=refresh_route)
+    except AdmissionDenied as denied:
+        route = None if prefetch else await route_cache.peek(cache_key)
+        if route is None:
+            raise
+        logger.info("Chamada ao provedor recusada (%s); servindo a rota vencida do cache.", denied.reason)
+        DEGRADED_NAVIGATION.inc(mode="cached", reason=denied.reason)
+        return route
+    except asyncio.TimeoutError:
+        logger.warning("Tempo limite esgotado ao buscar a rota para '%s'.", destination)
+        return None
     except Exception as e:
-        print(f"Erro ao chamar a Google Directions API para '{destination}': {e}")
+        logger.error("Erro ao buscar a rota para '%s': %s", destination, e)
         return None
 
-async def process_google_directions_response(directions_data: dict) -> tuple[str, Optional[dict]]:
+async def process_google_directions_response(route: Optional[Route]) -> tuple[str, Optional[dict]]:
     """
-    Processa a resposta JSON da Google Directions API e extrai instruções e dados da rota.
+    Formata as instruções de uma rota (já convertida de JSON da Directions API para `Route`).
     Retorna uma tupla com o texto das instruções formatado e os dados da rota (overview_polyline).
     """
-    print("Chamado process_google_directions_response.")
-    if not directions_data or not directions_data.get("legs"):
-        print("Dados de direção incompletos ou sem trechos ('legs').")
+    logger.debug("Chamado process_google_directions_response.")
+    if route is None:
+        logger.info("Dados de direção incompletos ou sem trechos ('legs').")
         return "Não foi possível encontrar uma rota ou os dados estão incompletos (Google Maps).", None
 
-    # Geralmente há apenas uma "leg" para navegação direta de A a B
-    leg = directions_data["legs"][0]
-    steps = leg.get("steps")
-
-    if not steps:
-         print("Trecho da rota encontrado, mas sem passos detalhados ('steps').")
+    if not route.step_count:
+         logger.info("Trecho da rota encontrado, mas sem passos detalhados ('steps').")
          return "Rota encontrada, mas sem passos detalhados (Google Maps).", None
 
 
     instructions = []
 
     # Adicionar uma instrução inicial mais amigável
-    # Tenta obter o nome da rua ou localização do início do primeiro passo
-    start_address = leg.get("start_address", "sua localização atual")
-    end_address = leg.get("end_address", "seu destino")
-    instructions.append(f"Início da navegação. Saindo de {start_address} em direção a {end_address}.")
-
+    instructions.append(f"Início da navegação. Saindo de {route.start_address} em direção a {route.end_address}.")
 
-    # Iterar sobre os passos (steps)
-    for i, step in enumerate(steps):
-        # O campo 'html_instructions' contém as instruções formatadas em HTML.
-        # Precisamos limpá-lo para obter texto simples.
-        instruction_text = step.get("html_instructions", "Instrução desconhecida")
-        # Remover tags HTML (mais robusto com regex)
-        clean_instruction_text = re.sub(r'<[^>]+>', '', instruction_text)
-         # Substituir entidades HTML comuns como & (&), < (<), > (>)
-        clean_instruction_text = clean_instruction_text.replace('&', '&').replace('<', '<').replace('>', '>')
-
-
-        distance_meters = step.get("distance", {}).get("value", 0) # Distância em metros
-        duration_seconds = step.get("duration", {}).get("value", 0) # Duração em segundos
-        # location = step.get("end_location") # Coordenadas do fim do passo
 
+    # Iterar sobre os passos (o HTML de cada instrução já foi limpo ao montar a rota)
+    for i, (instruction_text, street_name, distance_meters) in enumerate(
+            zip(route.instructions, route.street_names, route.step_distances.tolist())):
         # Formatar a distância
         distance_str = f"{distance_meters:.0f} metros" if distance_meters > 0 else "uma curta distância"
 
-        # Opcional: adicionar o nome da rua em que o passo ocorre (se disponível)
-        street_name = step.get("street_number", "") + " " + step.get("street_name", "")
-        street_name = street_name.strip()
-
-
-        step_instruction = f"{i + 1}. {clean_instruction_text}" # Index começa do 1 para os passos
-        if street_name:
+        step_instruction = f"{i + 1}. {instruction_text}" # Index começa do 1 para os passos
+        if street_name: # Opcional: nome da rua em que o passo ocorre (se o provedor informar)
              step_instruction += f" na {street_name}"
         step_instruction += f" (andar por {distance_str})" # Inclui a distância no passo
 
@@ -188,8 +506,8 @@ async def process_google_directions_response(directions_data: dict) -> tuple[str
         instructions.append(step_instruction)
 
     # Adicionar resumo final
-    total_distance_meters = leg.get("distance", {}).get("value", 0)
-    total_duration_seconds = leg.get("duration", {}).get("value", 0)
+    total_distance_meters = route.distance
+    total_duration_seconds = route.duration
 
     total_distance_str = f"{total_distance_meters:.0f} metros" if total_distance_meters > 0 else "Distância total desconhecida"
 
@@ -206,139 +524,543 @@ async def process_google_directions_response(directions_data: dict) -> tuple[str
              total_duration_str = f"{seconds:.0f} segundos"
 
 
-    instructions.append(f"{len(steps) + 1}. Você chegou ao seu destino. Distância total: {total_distance_str}. Tempo estimado: {total_duration_str}.")
-
+    instructions.append(f"{route.step_count + 1}. Você chegou ao seu destino. Distância total: {total_distance_str}. Tempo estimado: {total_duration_str}.")
 
-    # Extrair os dados da polyline para desenhar a rota no mapa
-    route_overview_polyline = directions_data.get("overview_polyline")
 
-    return "\n".join(instructions), {"overview_polyline": route_overview_polyline}
+    # Dados da polyline para desenhar a rota no mapa
+    return "\n".join(instructions), route.route_data()
 
 
-# Função para gerar instruções de navegação acessíveis com o Gemini (Opcional)
-# Manter esta função caso queira refinar as instruções brutas do Google Maps.
-async def generate_accessible_instructions_with_gemini(directions_text: str, destination_name: str) -> str:
+# --- Endpoint que entrega as instruções refinadas pelo Gemini (Server-Sent Events) ---
+@app.get("/refinements/{refinement_id}")
+async def stream_refinement(refinement_id: str):
     """
-    Usa o Gemini para refinar ou adicionar contexto às instruções.
-    Recebe as instruções já processadas da API (limpas de HTML, etc.).
+    Envia o texto refinado conforme o Gemini o gera: eventos `chunk` ({"text": trecho}) e, no fim,
+    `done` ({"text": texto completo, "refined": bool}). Se o modelo falhar ou passar do prazo,
+    `done` traz as instruções originais com refined=false. Resultados em cache saem imediatamente.
     """
-    print("Chamado generate_accessible_instructions_with_gemini.")
-    if not USE_GEMINI_FOR_REFINEMENT or not directions_text:
-        print("Gemini não configurado ou instruções vazias, pulando refinamento.")
-        return directions_text # Retorna as instruções originais se o Gemini não estiver configurado ou não houver texto
+    initialize_providers()
+    events = await refiner.events(refinement_id) if refiner else None
+    if events is None:
+        raise HTTPException(status_code=404, detail="Refinamento não encontrado.")
 
-    prompt = f'''
-    Reformule as seguintes instruções de navegação a pé para serem extremamente claras, passo a passo, usando linguagem simples e direta, adequada para uma pessoa com deficiência visual que está andando. Mencione pontos de referência se forem citados nas instruções originais ou puderem ser inferidos. Não pule etapas. Mantenha o formato de lista numerada.
+    async def event_stream():
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    Instruções originais:
-    {directions_text}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-    Formato desejado:
-    Lista de instruções numeradas, claras e concisas para navegação a pé.
-    '''
 
+# --- Endpoint com o áudio sintetizado das instruções ---
+@app.get("/tts/{audio_id}")
+async def get_instruction_audio(audio_id: str, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Áudio de uma frase das instruções (ids em `audioIds` nas respostas de navegação).
+    Normalmente já foi sintetizado quando a rota foi planejada; senão, é sintetizado agora.
+    Aceita Range (206) e é cacheável para sempre: o id é o hash do conteúdo.
+    """
+    initialize_providers()
+    if not speech:
+        raise HTTPException(status_code=404, detail="Síntese de voz no servidor desativada.")
+    etag = f'"{audio_id}"'
+    if etag_matches(if_none_match, audio_id):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
     try:
-        print("Enviando prompt para o Gemini...")
-        response = model.generate_content(prompt)
-        refined_text = response.text
-        print("Resposta do Gemini recebida.")
-        # Opcional: Adicionar uma verificação simples se a resposta parece útil
-        if len(refined_text) > len(directions_text) / 2: # Verifica se a resposta não é muito curta
-             return refined_text
-        else:
-             print("Resposta do Gemini parece muito curta ou irrelevante, usando instruções originais.")
-             return directions_text # Fallback se a resposta do Gemini for insatisfatória
+        path = await speech.audio(audio_id)
     except Exception as e:
-        print(f"Erro ao refinar instruções com o Gemini: {e}")
-        return f"Não foi possível refinar as instruções. Instruções básicas: {directions_text}" # Fallback em caso de erro
+        logger.error("Erro ao sintetizar o áudio %s: %s", audio_id, e)
+        raise HTTPException(status_code=503, detail="Não foi possível sintetizar o áudio agora.")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Áudio não encontrado.")
+    return FileResponse(path, media_type=media_type(path), headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+# Funções de compartilhamento: apenas enfileiram (dispatch.py); o envio real acontece em segundo plano.
+# Localizações repetidas do mesmo usuário são coalescidas, e os envios saem em lote, com limite
+# por destinatário e retentativas. Configure SMTP_HOST e os destinatários no .env (veja o README).
+# Se a sessão tiver um link de acompanhamento ao vivo, ele vai junto no texto.
+async def send_email(location_data: LocationData, user: Optional[str] = None, client: Optional[str] = None,
+                     urgent: bool = False):
+    """Enfileira o envio da localização e do destino por e-mail."""
+    share_dispatcher.enqueue("email", user or share_user_key(location_data, client),
+                             location_data.latitude, location_data.longitude, location_data.destination, urgent=urgent,
+                             link=live_link(location_data.session_id))
+
+async def send_whatsapp_message(location_data: LocationData, user: Optional[str] = None, client: Optional[str] = None,
+                                urgent: bool = False):
+    """Enfileira o envio da localização e do destino por WhatsApp (envio ainda simulado)."""
+    share_dispatcher.enqueue("whatsapp", user or share_user_key(location_data, client),
+                             location_data.latitude, location_data.longitude, location_data.destination, urgent=urgent,
+                             link=live_link(location_data.session_id))
+
+
+def share_user_key(location_data: LocationData, client: Optional[str]) -> str:
+    """
+    Chave de coalescência dos envios: a sessão de navegação. Sem sessão não há como saber se duas
+    localizações são do mesmo usuário (vários usuários vão ao mesmo destino, às vezes pelo mesmo IP),
+    então cada envio recebe uma chave própria, com o endereço do cliente e um id gerado.
+    """
+    if location_data.session_id:
+        return location_data.session_id
+    return f"{client or 'anônimo'}|{secrets.token_hex(8)}"
+
 
+def live_link(session_id: Optional[str]) -> Optional[str]:
+    """Link de acompanhamento ao vivo da sessão, se houver um válido."""
+    session = navigation_sessions.get(session_id)
+    return session.share_url if session and session.share_id else None
 
-# Função para enviar e-mail (simulada - Conecte com serviço real)
-async def send_email(location_data: LocationData):
+
+def create_share_link(session) -> ShareLinkResponse:
     """
-    Esta função simula o envio de um e-mail com a localização e destino.
-    Implementar lógica real de envio de e-mail aqui (smtplib, SendGrid, etc.).
+    Emite um link de acompanhamento para a sessão. Pedidos seguintes reaproveitam o mesmo
+    compartilhamento (e renovam a validade): quem já abriu um link anterior continua vendo.
     """
-    print(f"Simulando o envio de e-mail com a localização: Latitude={location_data.latitude}, Longitude={location_data.longitude}, Destino='{location_data.destination}'")
-    # Exemplo de como gerar um link para o Google Maps com a localização atual:
-    # maps_link = f"https://www.google.com/maps?q={location_data.latitude},{location_data.longitude}"
-    # corpo_email = f"Estou em {maps_link}, navegando para {location_data.destination}."
-    # ... código real para enviar email ...
-    pass # Substituir por código de envio real
-
-# Função para enviar mensagem no WhatsApp (simulada - Gere o link real)
-async def send_whatsapp_message(location_data: LocationData):
+    if not session.share_id:
+        session.share_id = secrets.token_urlsafe(9)
+    token, expires_at = share_signer.issue(session.share_id)
+    share_hub.open(session.share_id, expires_at)
+    session.share_url = f"{SHARE_LINK_BASE_URL}?token={token}"
+    return ShareLinkResponse(token=token, url=session.share_url, eventsUrl=f"/share/{token}/events",
+                             wsUrl=f"/share/{token}/ws", expiresAt=expires_at)
+
+
+def publish_position(session, location_data: LocationData, progress: Optional[RouteProgress]):
+    """Publica a posição atual para os acompanhantes do link da sessão (se houver um)."""
+    if not session or not session.share_id:
+        return
+    payload = {
+        "latitude": location_data.latitude,
+        "longitude": location_data.longitude,
+        "destination": location_data.destination,
+        "timestamp": int(time.time() * 1000),
+    }
+    if progress:
+        payload.update(currentStep=progress.step_index, remainingDistance=round(progress.remaining_distance, 1),
+                       remainingDuration=round(progress.remaining_duration, 1), offRoute=progress.off_route,
+                       arrived=progress.arrived)
+    if not share_hub.publish(session.share_id, payload):
+        session.share_id = session.share_url = None # Link expirado ou removido: a sessão deixa de publicar
+    elif progress and progress.arrived:
+        share_hub.close(session.share_id, "arrived")
+        session.share_id = session.share_url = None
+
+
+def etag_matches(if_none_match: Optional[str], version: str) -> bool:
+    """Verifica se o cabeçalho If-None-Match contém a versão informada (aceita W/ e listas)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/").strip('"') == version for tag in tags)
+
+
+def describe_wait(seconds: float) -> str:
+    """Espera em texto para ser falado ("30 segundos", "5 minutos", "3 horas")."""
+    if seconds < 90:
+        return f"{max(round(seconds), 1)} segundos"
+    if seconds < 90 * 60:
+        return f"{round(seconds / 60)} minutos"
+    return f"{round(seconds / 3600)} horas"
+
+
+def degraded_navigation(location_data: LocationData, session, progress: Optional[RouteProgress],
+                        denied: AdmissionDenied, if_none_match: Optional[str]) -> dict:
     """
-    Esta função simula o envio de uma mensagem no WhatsApp.
-    Implementar lógica real de envio aqui (gerar link wa.me).
+    Resposta quando uma rota nova não pode ser pedida (admission.py) e não há rota no cache.
+    Com sessão, o usuário continua sendo acompanhado na rota atual e ouve que o recálculo está
+    suspenso; sem sessão, recebe só o aviso de quando tentar de novo.
     """
-    print(f"Simulando o envio de mensagem no WhatsApp com a localização: Latitude={location_data.latitude}, Longitude={location_data.longitude}, Destino='{location_data.destination}'")
-    # Exemplo de como gerar um link wa.me:
-    # maps_link = f"https://www.google.com/maps?q={location_data.latitude},{location_data.longitude}"
-    # message_text = f"Minha localização: {maps_link}. Navegando para: {location_data.destination}"
-    # phone_number = "55XXYYYYYYYYY" # Substitua pelo número do familiar (com código do país e DDD)
-    # whatsapp_link = f"https://wa.me/{phone_number}?text={requests.utils.quote(message_text)}"
-    # print(f"Link gerado para WhatsApp (simulação): {whatsapp_link}") # Para simulação, pode imprimir o link
+    retry_after = round(denied.retry_after, 1)
+    NAVIGATION_UPDATES.inc(result="degraded")
+    if session and progress:
+        DEGRADED_NAVIGATION.inc(mode="tracking", reason=denied.reason)
+        logger.info("Recálculo recusado para a sessão %s (%s); mantendo a rota atual.", session.session_id, denied.reason)
+        publish_position(session, location_data, progress)
+        response_data = {
+            "sessionId": session.session_id,
+            "routeVersion": session.route_version,
+            "progress": build_progress(progress),
+            "degraded": "tracking",
+            "status": "Você saiu da rota, mas não é possível calcular uma rota nova agora. "
+                      "Volte para o trajeto anterior; continuo acompanhando seu progresso.",
+            "retryAfter": retry_after,
+        }
+        if etag_matches(if_none_match, session.route_version):
+            response_data["unchanged"] = True
+        else:
+            response_data.update(instructions=session.instructions_text, routeData=session.route_data,
+                                 refinementId=session.refinement_id, audioIds=session.audio_ids)
+        return response_data
+
+    DEGRADED_NAVIGATION.inc(mode="status", reason=denied.reason)
+    logger.info("Rota para '%s' recusada (%s), sem rota em cache.", location_data.destination, denied.reason)
+    if denied.reason == DAILY_BUDGET:
+        message = f"O limite diário de rotas foi atingido. Novas rotas voltam a ser calculadas em {describe_wait(denied.retry_after)}."
+    else:
+        message = (f"O serviço de rotas está sobrecarregado no momento. "
+                   f"Vou tentar de novo em {describe_wait(denied.retry_after)}.")
+    return {"instructions": message, "degraded": "status", "retryAfter": retry_after}
+
 
-    pass # Substituir por código de envio real ou lógica para retornar link para frontend
+def build_progress(progress: RouteProgress) -> NavigationProgress:
+    """Converte o progresso calculado pela sessão no modelo da resposta."""
+    return NavigationProgress(
+        currentStep=progress.step_index,
+        distanceToNextManeuver=round(progress.distance_to_next_maneuver, 1),
+        remainingDistance=round(progress.remaining_distance, 1),
+        remainingDuration=round(progress.remaining_duration, 1),
+        offRoute=progress.off_route,
+        arrived=progress.arrived,
+    )
 
 
-@app.post("/navigate/", response_model=NavigationResponse)
-async def navigate(location_data: LocationData):
+async def update_navigation(location_data: LocationData, if_none_match: Optional[str] = None,
+                            client: Optional[str] = None) -> dict:
     """
-    Endpoint para receber dados de localização, obter instruções de navegação
-    usando a Google Directions API, e enviar de volta instruções e dados da rota.
+    Núcleo da navegação, compartilhado por /navigate/ (HTTP) e /navigate/ws (WebSocket).
+
+    A primeira chamada cria uma sessão de navegação (retornada em `sessionId`). Nas chamadas
+    seguintes com o mesmo `session_id` o progresso é calculado localmente sobre a rota guardada,
+    e a Directions API só é chamada de novo se o usuário sair da rota.
+
+    Toda resposta com rota traz `routeVersion`. Se `if_none_match` contiver a versão atual,
+    a resposta omite instruções e polyline e traz só o progresso.
+
+    `client` (endereço IP) limita as rotas pedidas sem sessão; veja admission.py.
     """
-    print(f"Requisição POST recebida para /navigate/ com: Destino='{location_data.destination}', Localização=({location_data.latitude}, {location_data.longitude})")
+    initialize_providers() # Normalmente já feito no lifespan
+    session = navigation_sessions.get(location_data.session_id)
+    if session and session.destination != location_data.destination:
+        logger.debug("Destino diferente do da sessão. Uma nova rota será calculada.")
+        navigation_sessions.drop(session.session_id)
+        if session.share_id:
+            share_hub.close(session.share_id, "stopped")
+        session = None
+
+    rerouted = False
+    if session:
+        # --- Sessão existente: acompanhar o progresso sem chamar o Google ---
+        with stage("tracking"):
+            progress = session.track(location_data.latitude, location_data.longitude)
+        if progress.arrived:
+            logger.debug("Usuário chegou ao destino (sessão %s).", session.session_id)
+            navigation_sessions.drop(session.session_id)
+            publish_position(session, location_data, progress)
+            NAVIGATION_UPDATES.inc(result="arrived")
+            return {
+                "instructions": f"Você chegou ao seu destino: {location_data.destination}.",
+                "sessionId": session.session_id,
+                "progress": build_progress(progress),
+            }
+        if not progress.off_route:
+            logger.debug("Sessão %s: passo %d, %.0f metros restantes.", session.session_id, progress.step_index + 1,
+                         progress.remaining_distance)
+            reroute_prefetcher.schedule(session) # Rotas alternativas das próximas manobras, em segundo plano
+            with stage("share"):
+                publish_position(session, location_data, progress)
+                await send_email(location_data, user=session.session_id)
+                await send_whatsapp_message(location_data, user=session.session_id)
+            if etag_matches(if_none_match, session.route_version):
+                # O cliente já tem esta rota: envia apenas o progresso
+                NAVIGATION_UPDATES.inc(result="unchanged")
+                return {
+                    "unchanged": True,
+                    "sessionId": session.session_id,
+                    "routeVersion": session.route_version,
+                    "progress": build_progress(progress),
+                }
+            NAVIGATION_UPDATES.inc(result="progress")
+            return {
+                "instructions": session.instructions_text,
+                "routeData": session.route_data,
+                "sessionId": session.session_id,
+                "routeVersion": session.route_version,
+                "progress": build_progress(progress),
+                "refinementId": session.refinement_id,
+                "audioIds": session.audio_ids,
+            }
+        logger.info("Usuário fora da rota (%.0f metros). Recalculando rota.", progress.distance_from_route)
+        REROUTES.inc()
+        rerouted = True
 
     instructions_text = ""
     route_data = None
 
     # --- PASSO 1: Obter instruções de rota e dados da Google Directions API ---
-    print(f"Obtendo rota de ({location_data.latitude}, {location_data.longitude}) para '{location_data.destination}' usando Google Directions API.")
-    directions_data = await get_google_directions(location_data.latitude, location_data.longitude, location_data.destination)
+    logger.debug("Obtendo rota de (%s, %s) para '%s' usando Google Directions API.", location_data.latitude,
+                 location_data.longitude, location_data.destination)
+    # Desvio perto de uma manobra prevista: usa a rota já pronta, sem esperar o provedor
+    route = reroute_prefetcher.match(session, location_data.latitude, location_data.longitude) if rerouted else None
+    try:
+        if route is None:
+            route = await get_google_directions(location_data.latitude, location_data.longitude, location_data.destination,
+                                                session_id=location_data.session_id, client=client, reroute=rerouted)
+    except AdmissionDenied as denied:
+        return degraded_navigation(location_data, session, progress if rerouted else None, denied, if_none_match)
 
-    if directions_data:
+    if route:
         # --- PASSO 2: Processar Resposta do Google Directions e extrair dados ---
-        print("Processando dados de rota do Google Directions.")
-        instructions_text, route_data = await process_google_directions_response(directions_data)
-
-        # --- PASSO 3 (OPCIONAL): Refinar Instruções com Gemini ---
-        if USE_GEMINI_FOR_REFINEMENT and instructions_text: # Verifique se há instruções antes de refinar
-            print("Refinando instruções com Gemini.")
-            instructions_text = await generate_accessible_instructions_with_gemini(instructions_text, location_data.destination)
+        logger.debug("Processando dados de rota do Google Directions.")
+        with stage("format"):
+            instructions_text, route_data = await process_google_directions_response(route)
+
+        # --- PASSO 3 (OPCIONAL): Refinar Instruções com Gemini, em segundo plano ---
+        # A resposta sai já com as instruções processadas; o texto refinado chega depois por /refinements/{id}
+        with stage("refinement"):
+            refinement_id = refiner.submit(instructions_text) if refiner else None
+        # Áudio de cada frase das instruções: os próximos passos começam a ser sintetizados agora,
+        # para a reprodução começar sem esperar a síntese quando o cliente pedir
+        with stage("tts"):
+            audio_ids = speech.prepare(instructions_text) if speech and route_data else None
+
+        # Guardar a rota na sessão para as próximas atualizações de localização
+        progress = None
+        if route_data:
+            if session:
+                session.set_route(route, instructions_text, route_data)
+            else:
+                session = navigation_sessions.create(location_data.destination, route, instructions_text, route_data)
+            session.refinement_id = refinement_id
+            session.audio_ids = audio_ids
+            progress = session.track(location_data.latitude, location_data.longitude)
+            reroute_prefetcher.schedule(session)
 
 
         # --- PASSO 4: ENVIAR EMAIL/WHATSAPP (Simulação/Conexão Real) ---
         # Decida a frequência com que isso ocorre (pode ser a cada atualização de localização, ou em pontos chave da rota)
         # Neste exemplo, é chamado a cada atualização que resulta em instruções válidas.
-        print("Chamando funções de compartilhamento (simulação/real).")
-        await send_email(location_data)
-        await send_whatsapp_message(location_data)
+        # Só enfileira: a fila coalesce as atualizações e envia em segundo plano.
+        logger.debug("Enfileirando compartilhamento da localização.")
+        share_user = session.session_id if session else None
+        with stage("share"):
+            publish_position(session, location_data, progress)
+            await send_email(location_data, user=share_user, client=client)
+            await send_whatsapp_message(location_data, user=share_user, client=client)
+        NAVIGATION_UPDATES.inc(result="route")
 
 
     else:
-        print("Não foi possível obter a rota da Google Directions API.")
+        logger.info("Não foi possível obter a rota da Google Directions API.")
+        NAVIGATION_UPDATES.inc(result="failed")
         instructions_text = f"Não foi possível obter as instruções de navegação para '{location_data.destination}' a partir da sua localização atual via Google Maps. Verifique o destino e sua conexão."
         route_data = None # Garante que routeData é None se a rota não for encontrada
+        progress = None
 
 
     # Inclua os dados da rota (polyline) na resposta para o frontend
-    response_data = {"instructions": instructions_text}
+    response_data = {"instructions": instructions_text, "rerouted": rerouted}
     if route_data:
         response_data["routeData"] = route_data
+        response_data["refinementId"] = refinement_id
+        response_data["audioIds"] = audio_ids
+    if session and progress:
+        response_data["sessionId"] = session.session_id
+        response_data["routeVersion"] = session.route_version
+        response_data["progress"] = build_progress(progress)
+
+    return response_data
+
+
+@app.post("/navigate/", response_model=NavigationResponse, response_model_exclude_defaults=True)
+async def navigate(location_data: LocationData, request: Request, response: Response,
+                   if_none_match: Optional[str] = Header(default=None)):
+    """
+    Endpoint para receber dados de localização, obter instruções de navegação
+    usando a Google Directions API, e enviar de volta instruções e dados da rota.
+    A versão da rota é enviada no cabeçalho ETag; veja `update_navigation`.
+    """
+    logger.debug("Requisição POST recebida para /navigate/ com: Destino='%s', Localização=(%s, %s), Sessão=%s",
+                 location_data.destination, location_data.latitude, location_data.longitude, location_data.session_id)
+    response_data = await update_navigation(location_data, if_none_match, client=request.client.host if request.client else None)
+    if response_data.get("routeVersion"):
+        response.headers["ETag"] = f'"{response_data["routeVersion"]}"'
+    if response_data.get("retryAfter"):
+        response.headers["Retry-After"] = str(math.ceil(response_data["retryAfter"]))
+    logger.debug("Resposta para o frontend preparada.")
+    return response_data
+
 
-    print("Resposta para o frontend preparada.")
+def build_position(position: FilteredPosition) -> SmoothedPosition:
+    return SmoothedPosition(
+        latitude=position.latitude,
+        longitude=position.longitude,
+        accuracy=round(position.accuracy, 1),
+        speed=round(position.speed, 2),
+        heading=round(position.heading, 1) if position.heading is not None else None,
+        accepted=position.accepted,
+        rejected=position.rejected,
+    )
+
+
+@app.post("/navigate/fixes", response_model=NavigationResponse, response_model_exclude_defaults=True)
+async def navigate_fixes(batch: FixBatch, request: Request, response: Response,
+                         if_none_match: Optional[str] = Header(default=None)):
+    """
+    Como /navigate/, mas com todas as localizações do GPS acumuladas desde o último envio.
+    O filtro da sessão (gps_filter.py) descarta saltos e estima posição, velocidade e direção;
+    a navegação segue com a posição suavizada, que volta em `position`.
+    """
+    session = navigation_sessions.get(batch.session_id)
+    position_filter = session.position_filter if session and session.position_filter else PositionFilter()
+    fixes = batch.fixes
+    with stage("smoothing"):
+        position = position_filter.update([fix.latitude for fix in fixes], [fix.longitude for fix in fixes],
+                                          [fix.accuracy for fix in fixes], [fix.timestamp for fix in fixes])
+    accepted = position.accepted if position else 0
+    GPS_FIXES.inc(accepted, result="accepted")
+    GPS_FIXES.inc(len(fixes) - accepted, result="rejected")
+    if position is None:
+        raise HTTPException(status_code=422, detail="Nenhuma localização válida no lote.")
+    logger.debug("Lote de %d localizações (sessão %s): %d usadas, precisão estimada %.1f m.", len(fixes),
+                 batch.session_id, accepted, position.accuracy)
+
+    location_data = LocationData(latitude=position.latitude, longitude=position.longitude,
+                                 destination=batch.destination, session_id=batch.session_id)
+    response_data = await update_navigation(location_data, if_none_match, client=request.client.host if request.client else None)
+    # A sessão pode ter sido criada (ou recriada) agora: o filtro passa a ser dela
+    session = navigation_sessions.get(response_data.get("sessionId"))
+    if session:
+        session.position_filter = position_filter
+    response_data["position"] = build_position(position)
+    if response_data.get("routeVersion"):
+        response.headers["ETag"] = f'"{response_data["routeVersion"]}"'
+    if response_data.get("retryAfter"):
+        response.headers["Retry-After"] = str(math.ceil(response_data["retryAfter"]))
     return response_data
 
 
-# --- Opcional: Endpoint para compartilhamento explícito ---
-# Se o botão "Compartilhar Localização" no frontend chamar um endpoint separado, você pode implementá-lo aqui.
+async def live_navigation_update(latitude: float, longitude: float, destination: str,
+                                 session_id: Optional[str], route_version: Optional[str], client: Optional[str] = None) -> dict:
+    """Adapta `update_navigation` para a conexão WebSocket (resposta já serializável em JSON)."""
+    location_data = LocationData(latitude=latitude, longitude=longitude, destination=destination, session_id=session_id)
+    data = await update_navigation(location_data, f'"{route_version}"' if route_version else None, client=client)
+    return NavigationResponse(**data).model_dump(mode="json", exclude_defaults=True)
+
+
+@app.websocket("/navigate/ws")
+async def navigate_live(websocket: WebSocket):
+    """
+    Navegação ao vivo: o cliente envia as localizações do GPS pela conexão e o servidor envia
+    progresso, avisos de manobra e rotas novas assim que acontecem. Protocolo em `live.py`.
+    """
+    client = websocket.client.host if websocket.client else None
+    await LiveNavigationConnection(websocket, functools.partial(live_navigation_update, client=client)).run()
+
+
+# --- Endpoint para obter a rota completa de uma sessão (GET condicional) ---
+@app.get("/navigate/{session_id}/route", response_model=NavigationResponse, response_model_exclude_defaults=True)
+async def get_session_route(session_id: str, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Retorna instruções e polyline da rota atual da sessão.
+    Responde 304 (sem corpo) se o cliente já tiver a versão atual (If-None-Match).
+    """
+    session = navigation_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de navegação não encontrada ou expirada.")
+    etag = f'"{session.route_version}"'
+    if etag_matches(if_none_match, session.route_version):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=NavigationResponse(
+            instructions=session.instructions_text,
+            routeData=session.route_data,
+            sessionId=session.session_id,
+            routeVersion=session.route_version,
+            refinementId=session.refinement_id,
+            audioIds=session.audio_ids,
+        ).model_dump_json(exclude_defaults=True),
+        media_type="application/json",
+        headers={"ETag": etag},
+    )
+
+
+# --- Endpoint para compartilhamento explícito ---
+# Chamado pelo botão "Compartilhar Localização" do frontend. Com uma sessão de navegação ativa,
+# a mensagem leva também o link de acompanhamento ao vivo.
 @app.post("/share_location/")
-async def share_location_endpoint(location_data: LocationData):
-    print(f"Requisição POST recebida para /share_location/ com: ({location_data.latitude}, {location_data.longitude}), Destino='{location_data.destination}'")
-    # Implemente a lógica real de envio de email e whatsapp aqui, usando os dados recebidos
-    await send_email(location_data) # Chame suas funções de envio reais
-    await send_whatsapp_message(location_data)
-    print("Processamento de compartilhamento concluído (simulação/em progresso).")
-    return {"message": "Localização compartilhada (simulação/em progresso)."}
\ No newline at end of file
+async def share_location_endpoint(location_data: LocationData, request: Request):
+    logger.debug("Requisição POST recebida para /share_location/ com: (%s, %s), Destino='%s'", location_data.latitude,
+                 location_data.longitude, location_data.destination)
+    initialize_providers()
+    session = navigation_sessions.get(location_data.session_id)
+    link = None
+    if session:
+        link = create_share_link(session)
+        publish_position(session, location_data, None)
+    # Compartilhamento pedido pelo usuário: sai imediatamente, sem esperar a janela de coalescência
+    client = request.client.host if request.client else None
+    await send_email(location_data, client=client, urgent=True)
+    await send_whatsapp_message(location_data, client=client, urgent=True)
+    logger.debug("Compartilhamento enfileirado.")
+    response_data = {"message": "Localização compartilhada (envio em andamento)."}
+    if link:
+        response_data["shareLink"] = link
+    return response_data
+
+
+# --- Acompanhamento ao vivo (share_links.py) ---
+@app.post("/navigate/{session_id}/share", response_model=ShareLinkResponse)
+async def create_session_share_link(session_id: str):
+    """Cria (ou renova) o link de acompanhamento ao vivo da sessão de navegação."""
+    session = navigation_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de navegação não encontrada ou expirada.")
+    return create_share_link(session)
+
+
+def watch_topic(token: str):
+    """Valida o token e registra um acompanhante no compartilhamento (404, 410 ou 429 se não for possível)."""
+    verified = share_signer.verify(token)
+    if verified is None:
+        raise HTTPException(status_code=404, detail="Link de acompanhamento inválido.")
+    share_id, expires_at = verified
+    topic = share_hub.get(share_id) if expires_at > time.time() else None
+    if topic is None or topic.closed_reason:
+        raise HTTPException(status_code=410, detail="Este link de acompanhamento expirou ou foi encerrado.")
+    try:
+        share_hub.attach(topic)
+    except WatcherLimitReached:
+        raise HTTPException(status_code=429, detail="Muitas pessoas acompanhando este link agora.")
+    return topic
+
+
+@app.get("/share/{token}/events")
+async def watch_shared_location(token: str):
+    """
+    Posições do usuário por Server-Sent Events: `position` (a mais recente ao conectar e cada
+    nova depois), comentários periódicos para manter a conexão e `end` ({"reason": ...}) quando
+    o usuário chega, o link expira ou o compartilhamento é encerrado.
+    """
+    topic = watch_topic(token)
+
+    async def event_stream():
+        try:
+            async for position in share_hub.updates(topic):
+                yield position.sse() if position else b": ping\n\n"
+            yield f"event: end\ndata: {json.dumps({'reason': topic.closed_reason})}\n\n".encode("utf-8")
+        finally:
+            share_hub.detach(topic)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/share/{token}/ws")
+async def watch_shared_location_live(websocket: WebSocket, token: str):
+    """As mesmas mensagens de /share/{token}/events em JSON: `position`, `ping` e `end`."""
+    try:
+        topic = watch_topic(token)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    try:
+        await websocket.accept()
+        async for position in share_hub.updates(topic):
+            message = position.json() if position else '{"type": "ping"}'
+            await asyncio.wait_for(websocket.send_text(message), timeout=LIVE_SEND_TIMEOUT_SECONDS)
+        await websocket.send_text(json.dumps({"type": "end", "reason": topic.closed_reason}))
+        await websocket.close(code=1000)
+    except (asyncio.TimeoutError, WebSocketDisconnect, RuntimeError):
+        pass # Acompanhante desconectado ou lento demais: o espaço dele é liberado
+    finally:
+        share_hub.detach(topic)
\ No newline at end of file
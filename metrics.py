@@ -0,0 +1,241 @@
+"""
+Métricas do backend no formato de texto do Prometheus (GET /metrics) e cabeçalho Server-Timing.
+
+- `stage("directions")` mede uma etapa do processamento (geocodificação, busca da rota,
+  formatação, refinamento, compartilhamento...): grava no histograma `blindview_stage_seconds`
+  e na lista de etapas da requisição atual, que vira o cabeçalho Server-Timing da resposta.
+- `ServerTimingMiddleware` (ASGI puro, sem copiar o corpo) mede a requisição inteira, grava
+  `blindview_request_seconds` por rota/método/status e adiciona o Server-Timing.
+- Os contadores que os componentes já mantêm (caches, pool de provedores, fila de
+  compartilhamento, TTS) não são duplicados: `Registry.add_collector` os lê do `snapshot()` de
+  cada um só quando /metrics é consultado.
+
+Registrar uma observação custa uma busca no dicionário de rótulos e uma soma; nada é
+formatado no caminho da requisição.
+"""
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true" # Expõe a duração das etapas ao cliente
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Segundos
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (nome da métrica, tipo, ajuda, [(rótulos, valor)]) — o formato produzido pelos coletores
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_request_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico com rótulos."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {} if self.labelnames else {(): 0} # Sem rótulos: aparece zerado desde o início
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def collect(self) -> Iterable[MetricFamily]:
+        with self._lock:
+            values = list(self._values.items())
+        yield self.name, "counter", self.help, [(dict(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Histogram:
+    """Histograma com baldes fixos (contagens por balde, soma e total) e rótulos."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {} # rótulos -> [contagem por balde (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return sum(series[0]) if series else 0
+
+    def collect(self) -> Iterable[MetricFamily]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        samples = []
+        for key, counts, total in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(({**labels, "le": _format_value(float(bound))}, cumulative, "_bucket"))
+            samples.append((labels, total, "_sum"))
+            samples.append((labels, cumulative, "_count"))
+        yield self.name, "histogram", self.help, samples
+
+
+class Registry:
+    """Métricas próprias + coletores chamados na hora da consulta."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Todas as métricas no formato de exposição em texto do Prometheus (0.0.4)."""
+        lines = []
+        families = [family for metric in self.metrics for family in metric.collect()]
+        for collector in self.collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                lines.append(f"# coletor {getattr(collector, '__name__', collector)} falhou: {_escape(e)}")
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {_escape(help_text)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def snapshot_counters(name: str, help_text: str, label: str, snapshots: Dict[str, Optional[dict]],
+                      exclude: Sequence[str] = ()) -> MetricFamily:
+    """Converte os contadores de vários `snapshot()` em uma família: um rótulo para a origem e `event` para a chave."""
+    samples = []
+    for source, snapshot in snapshots.items():
+        for event, value in (snapshot or {}).items():
+            if event not in exclude and isinstance(value, (int, float)) and not isinstance(value, bool):
+                samples.append(({label: source, "event": event}, value))
+    return name, "counter", help_text, samples
+
+
+def gauge(name: str, help_text: str, values: Dict[Tuple[Tuple[str, str], ...], float]) -> MetricFamily:
+    """Família de medidores a partir de {((rótulo, valor), ...): número}."""
+    return name, "gauge", help_text, [(dict(labels), value) for labels, value in values.items() if value is not None]
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("blindview_stage_seconds", "Duração de cada etapa do processamento da navegação.", ("stage",))
+REQUEST_SECONDS = REGISTRY.histogram("blindview_request_seconds", "Duração das requisições HTTP, do início ao envio dos cabeçalhos.",
+                                     ("path", "method", "status"))
+NAVIGATION_UPDATES = REGISTRY.counter("blindview_navigation_updates_total",
+                                      "Atualizações de localização por resultado (route, progress, unchanged, arrived, degraded, failed).",
+                                      ("result",))
+REROUTES = REGISTRY.counter("blindview_reroutes_total", "Rotas recalculadas porque o usuário saiu da rota.")
+DEGRADED_NAVIGATION = REGISTRY.counter("blindview_degraded_navigation_total",
+                                       "Respostas degradadas por falta de cota (cached, tracking, status), por motivo da recusa.",
+                                       ("mode", "reason"))
+GPS_FIXES = REGISTRY.counter("blindview_gps_fixes_total",
+                             "Localizações recebidas em lote (/navigate/fixes) usadas ou descartadas pelo filtro.", ("result",))
+
+
+@contextmanager
+def stage(name: str):
+    """Mede uma etapa: histograma por etapa + Server-Timing da requisição em andamento (se houver)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """`geocode;dur=1.2, directions;dur=153.0, total;dur=160.4` (milissegundos)."""
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in (*timings, ("total", total)))
+
+
+class ServerTimingMiddleware:
+    """Mede cada requisição HTTP e adiciona Server-Timing com as etapas registradas por `stage()`."""
+
+    def __init__(self, app, enabled: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        sent_at = None
+
+        async def send_with_timing(message):
+            nonlocal status, sent_at
+            if message["type"] == "http.response.start":
+                sent_at = time.perf_counter()
+                status = message["status"]
+                if self.enabled:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(timings, sent_at - started).encode("latin-1")))
+                    headers.append((b"timing-allow-origin", b"*"))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            # O modelo da rota ("/tts/{audio_id}"), não o caminho: ids não viram séries novas
+            REQUEST_SECONDS.observe((sent_at or time.perf_counter()) - started, path=getattr(route, "path", "desconhecida"),
+                                    method=scope["method"], status=str(status))
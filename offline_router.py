@@ -0,0 +1,295 @@
+"""
+Roteamento a pé offline a partir de um extrato local do OpenStreetMap (.osm).
+
+O grafo de pedestres é carregado em arrays compactos no formato CSR (indptr / indices /
+pesos), restrito ao maior componente conexo. Para acelerar as consultas são pré-calculadas
+distâncias a alguns "landmarks" (técnica ALT: A* + landmarks + desigualdade triangular),
+o que permite responder rotas a pé em milissegundos, sem rede.
+
+A resposta de `directions()` segue o formato da Google Directions API (legs/steps com
+html_instructions, distance, duration, polyline...), então o restante do backend
+(process_google_directions_response, sessões, cache) funciona sem alterações.
+"""
+import heapq
+import math
+import os
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from directions_format import STRAIGHT_DEGREES, bearing_change, make_route, make_step, step_instruction
+from geometry import METERS_PER_DEGREE
+
+OFFLINE_OSM_PATH = os.getenv("OFFLINE_OSM_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.osm"))
+OFFLINE_LANDMARKS = int(os.getenv("OFFLINE_LANDMARKS", "8")) # Número de landmarks do ALT
+WALKING_SPEED_MPS = float(os.getenv("WALKING_SPEED_MPS", "1.3")) # Velocidade usada para estimar a duração
+OFFLINE_MAX_SNAP_METERS = float(os.getenv("OFFLINE_MAX_SNAP_METERS", "250")) # Pontos mais longe que isso do grafo estão fora da cobertura
+
+# Tipos de via que podem ser percorridos a pé (vias expressas ficam de fora)
+PEDESTRIAN_HIGHWAYS = {
+    "footway", "pedestrian", "path", "steps", "living_street", "residential", "service", "unclassified",
+    "tertiary", "tertiary_link", "secondary", "secondary_link", "primary", "primary_link", "track",
+    "corridor", "crossing", "cycleway", "road",
+}
+_NO_FOOT_ACCESS = {"no", "private"}
+UNNAMED_WAY = "caminho sem nome"
+
+
+class PedestrianGraph:
+    """Grafo não direcionado de pedestres em formato CSR."""
+
+    def __init__(self, coords: np.ndarray, sources: np.ndarray, targets: np.ndarray, names: np.ndarray,
+                 name_table: List[str]):
+        coords, sources, targets, names = self._largest_component(coords, sources, targets, names)
+        self.coords = coords.astype(np.float64) # (n, 2) latitude, longitude
+        self.name_table = name_table
+
+        # Cada via vira duas arestas (ida e volta); ordenadas pela origem para montar o CSR
+        all_sources = np.concatenate((sources, targets))
+        all_targets = np.concatenate((targets, sources))
+        all_names = np.concatenate((names, names))
+        order = np.lexsort((all_targets, all_sources))
+        self.edge_sources = all_sources[order].astype(np.int32)
+        self.indices = all_targets[order].astype(np.int32)
+        self.edge_names = all_names[order].astype(np.int32)
+        self.indptr = np.searchsorted(self.edge_sources, np.arange(len(coords) + 1)).astype(np.int64)
+        lat = np.radians(self.coords[:, 0])
+        a, b = self.edge_sources, self.indices
+        dlat = lat[b] - lat[a]
+        dlng = np.radians(self.coords[b, 1] - self.coords[a, 1])
+        h = np.sin(dlat / 2) ** 2 + np.cos(lat[a]) * np.cos(lat[b]) * np.sin(dlng / 2) ** 2
+        self.weights = (2 * 6371008.8 * np.arcsin(np.minimum(1.0, np.sqrt(h)))).astype(np.float32)
+
+        # Cópias em listas Python: o laço do A*/Dijkstra é muito mais rápido indexando listas
+        self._indptr_list = self.indptr.tolist()
+        self._indices_list = self.indices.tolist()
+        self._weights_list = self.weights.astype(np.float64).tolist()
+        self._scale_x = METERS_PER_DEGREE * math.cos(math.radians(float(self.coords[:, 0].mean())))
+
+    @property
+    def node_count(self) -> int:
+        return len(self.coords)
+
+    @staticmethod
+    def _largest_component(coords, sources, targets, names):
+        """Mantém apenas o maior componente conexo (evita rotas impossíveis entre ilhas)."""
+        parent = list(range(len(coords)))
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for a, b in zip(sources.tolist(), targets.tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_a] = root_b
+        roots = np.array([find(node) for node in range(len(coords))])
+        largest = np.bincount(roots).argmax()
+        keep = roots == largest
+        remap = np.full(len(coords), -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+        edge_keep = keep[sources]
+        return coords[keep], remap[sources[edge_keep]], remap[targets[edge_keep]], names[edge_keep]
+
+    def nearest_node(self, latitude: float, longitude: float) -> Tuple[int, float]:
+        """Nó do grafo mais próximo de uma coordenada e a distância até ele (metros)."""
+        dx = (self.coords[:, 1] - longitude) * self._scale_x
+        dy = (self.coords[:, 0] - latitude) * METERS_PER_DEGREE
+        squared = dx * dx + dy * dy
+        node = int(np.argmin(squared))
+        return node, math.sqrt(float(squared[node]))
+
+    def shortest_path(self, source: int, target: int, heuristic: Optional[List[float]] = None) -> Tuple[float, List[int]]:
+        """
+        Menor caminho de `source` a `target`. Sem heurística é o Dijkstra clássico; com a
+        heurística dos landmarks (consistente) é o A* do ALT.
+        Retorna (distância em metros, lista de arestas do caminho).
+        """
+        indptr, indices, weights = self._indptr_list, self._indices_list, self._weights_list
+        best = {source: 0.0}
+        via_edge = {}
+        heap = [(heuristic[source] if heuristic else 0.0, 0.0, source)]
+        while heap:
+            _, distance, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if distance > best[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[edge]
+                candidate = distance + weights[edge]
+                if candidate < best.get(neighbor, math.inf):
+                    best[neighbor] = candidate
+                    via_edge[neighbor] = edge
+                    heapq.heappush(heap, (candidate + heuristic[neighbor] if heuristic else candidate, candidate, neighbor))
+        if target not in best:
+            return math.inf, []
+
+        edge_sources = self.edge_sources
+        edges = []
+        node = target
+        while node != source:
+            edge = via_edge[node]
+            edges.append(edge)
+            node = int(edge_sources[edge])
+        edges.reverse()
+        return best[target], edges
+
+    def distances_from(self, source: int) -> np.ndarray:
+        """Dijkstra completo a partir de `source` (usado no pré-cálculo dos landmarks)."""
+        indptr, indices, weights = self._indptr_list, self._indices_list, self._weights_list
+        best = [math.inf] * self.node_count
+        best[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if distance > best[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[edge]
+                candidate = distance + weights[edge]
+                if candidate < best[neighbor]:
+                    best[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+        return np.array(best, dtype=np.float64)
+
+    def bearing(self, edge: int) -> float:
+        """Direção (graus a partir do norte, sentido horário) de uma aresta."""
+        a, b = self.coords[self.edge_sources[edge]], self.coords[self.indices[edge]]
+        return math.degrees(math.atan2((b[1] - a[1]) * self._scale_x, (b[0] - a[0]) * METERS_PER_DEGREE)) % 360
+
+
+def parse_osm(path: str) -> PedestrianGraph:
+    """Lê um extrato .osm (XML) e monta o grafo de pedestres."""
+    node_coords = {}
+    ways = []
+    for _, element in ET.iterparse(path, events=("end",)):
+        if element.tag == "node":
+            node_coords[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+            element.clear()
+        elif element.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            if (tags.get("highway") in PEDESTRIAN_HIGHWAYS and tags.get("foot") not in _NO_FOOT_ACCESS
+                    and tags.get("access") not in _NO_FOOT_ACCESS):
+                ways.append(([int(nd.get("ref")) for nd in element.iter("nd")], tags.get("name")))
+            element.clear()
+
+    index_of = {}
+    coords = []
+    name_index = {}
+    name_table = []
+    sources, targets, names = [], [], []
+    for refs, name in ways:
+        refs = [ref for ref in refs if ref in node_coords]
+        if name not in name_index:
+            name_index[name] = len(name_table)
+            name_table.append(name or UNNAMED_WAY)
+        for a, b in zip(refs, refs[1:]):
+            for ref in (a, b):
+                if ref not in index_of:
+                    index_of[ref] = len(coords)
+                    coords.append(node_coords[ref])
+            sources.append(index_of[a])
+            targets.append(index_of[b])
+            names.append(name_index[name])
+    if not coords:
+        raise ValueError(f"Nenhuma via de pedestres encontrada em {path}.")
+    return PedestrianGraph(np.array(coords), np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64),
+                           np.array(names, dtype=np.int64), name_table)
+
+
+class OfflineRouter:
+    """Roteador a pé offline: grafo CSR + landmarks do ALT + formatação no padrão Directions."""
+
+    def __init__(self, graph: PedestrianGraph, landmark_count: int = OFFLINE_LANDMARKS):
+        self.graph = graph
+        self.landmarks, self.landmark_distances = self._select_landmarks(landmark_count)
+
+    @classmethod
+    def from_osm(cls, path: str = OFFLINE_OSM_PATH, landmark_count: int = OFFLINE_LANDMARKS) -> "OfflineRouter":
+        return cls(parse_osm(path), landmark_count)
+
+    def _select_landmarks(self, count: int) -> Tuple[List[int], np.ndarray]:
+        """Escolhe landmarks pelo critério "mais distante dos já escolhidos" e guarda suas distâncias."""
+        count = max(0, min(count, self.graph.node_count))
+        if count == 0:
+            return [], np.zeros((0, self.graph.node_count), dtype=np.float32)
+        landmarks = []
+        rows = []
+        closest = self.graph.distances_from(0)
+        for _ in range(count):
+            landmark = int(np.argmax(closest))
+            distances = self.graph.distances_from(landmark)
+            landmarks.append(landmark)
+            rows.append(distances)
+            closest = np.minimum(closest, distances) if len(rows) > 1 else distances
+        return landmarks, np.array(rows, dtype=np.float32)
+
+    def heuristic(self, target: int) -> List[float]:
+        """Limite inferior da distância até `target` para cada nó: max_k |d(L_k, t) - d(L_k, v)|."""
+        if not len(self.landmarks):
+            return [0.0] * self.graph.node_count
+        bound = np.abs(self.landmark_distances[:, target][:, None] - self.landmark_distances).max(axis=0)
+        return (bound * 0.999).tolist() # Margem para erros de arredondamento do float32
+
+    def route(self, origin: Tuple[float, float], destination: Tuple[float, float],
+              use_landmarks: bool = True) -> Tuple[float, List[int]]:
+        """Menor caminho entre duas coordenadas (arestas do grafo); infinito se fora da área do extrato."""
+        source, source_gap = self.graph.nearest_node(*origin)
+        target, target_gap = self.graph.nearest_node(*destination)
+        if max(source_gap, target_gap) > OFFLINE_MAX_SNAP_METERS:
+            return math.inf, []
+        return self.graph.shortest_path(source, target, self.heuristic(target) if use_landmarks else None)
+
+    def directions(self, origin: str, destination: str, mode: str = "walking", **kwargs) -> list:
+        """
+        Mesma interface de googlemaps.Client.directions (origem/destino "lat,lng").
+        Retorna uma lista com uma rota no formato da Directions API, ou lista vazia.
+        """
+        try:
+            origin_point = tuple(float(value) for value in origin.split(","))
+            destination_point = tuple(float(value) for value in destination.split(","))
+        except ValueError:
+            return [] # Sem geocodificação offline: apenas coordenadas são aceitas
+        if mode != "walking" or len(origin_point) != 2 or len(destination_point) != 2:
+            return []
+        distance, edges = self.route(origin_point, destination_point)
+        if math.isinf(distance):
+            return []
+        return [self._to_directions_route(edges, origin_point, destination_point)]
+
+    def _to_directions_route(self, edges: List[int], origin: Tuple[float, float], destination: Tuple[float, float]) -> dict:
+        graph = self.graph
+        if not edges: # Origem e destino no mesmo nó
+            node, _ = graph.nearest_node(*destination)
+            edge_groups = []
+            path = [tuple(graph.coords[node])]
+        else:
+            # Agrupa arestas consecutivas da mesma via em um passo; uma conversão (inclusive entre
+            # caminhos sem nome, que compartilham o mesmo nome) sempre começa um passo novo
+            edge_groups = [[edges[0]]]
+            for edge in edges[1:]:
+                previous = edge_groups[-1][-1]
+                if (graph.edge_names[edge] == graph.edge_names[previous]
+                        and abs(bearing_change(graph.bearing(edge), graph.bearing(previous))) < STRAIGHT_DEGREES):
+                    edge_groups[-1].append(edge)
+                else:
+                    edge_groups.append([edge])
+            path = [tuple(graph.coords[graph.edge_sources[edges[0]]])] + [tuple(graph.coords[graph.indices[e]]) for e in edges]
+
+        steps = []
+        for number, group in enumerate(edge_groups):
+            points = [tuple(graph.coords[graph.edge_sources[group[0]]])] + [tuple(graph.coords[graph.indices[e]]) for e in group]
+            distance = float(sum(graph.weights[e] for e in group))
+            name = graph.name_table[graph.edge_names[group[0]]]
+            previous_bearing = graph.bearing(edge_groups[number - 1][-1]) if number else None
+            text, maneuver = step_instruction(number, graph.bearing(group[0]), previous_bearing,
+                                              name if name != UNNAMED_WAY else None)
+            steps.append(make_step(text, maneuver, distance, distance / WALKING_SPEED_MPS, points))
+
+        start_name = graph.name_table[graph.edge_names[edges[0]]] if edges else UNNAMED_WAY
+        end_name = graph.name_table[graph.edge_names[edges[-1]]] if edges else UNNAMED_WAY
+        return make_route(steps, path, start_name, end_name, "Rota calculada offline a partir do OpenStreetMap.")
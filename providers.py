@@ -0,0 +1,197 @@
+"""
+Camada de provedores de rota (backend).
+
+O cliente `googlemaps` é síncrono: chamá-lo diretamente dentro de uma função `async`
+bloqueia o loop de eventos do uvicorn durante toda a ida e volta ao Google.
+Aqui as chamadas são executadas em um pool de threads limitado, com limite de
+concorrência e timeout por chamada, sobre uma sessão HTTP com keep-alive compartilhada.
+O roteador offline (offline_router.py) e os servidores OSRM usam o mesmo mecanismo: todos
+os provedores expõem `directions(origin, destination, mode)` e devolvem rotas no formato da
+Directions API, para que routing.py possa combiná-los (hedge, circuit breaker, fallback).
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from directions_format import make_route, make_step, step_instruction
+from geometry import decode_polyline
+
+# Configuração (pode ser ajustada via .env)
+DIRECTIONS_MAX_WORKERS = int(os.getenv("DIRECTIONS_MAX_WORKERS", "16")) # Threads dedicadas às chamadas bloqueantes
+DIRECTIONS_MAX_CONCURRENCY = int(os.getenv("DIRECTIONS_MAX_CONCURRENCY", "32")) # Chamadas simultâneas (incluindo as que aguardam thread)
+DIRECTIONS_TIMEOUT_SECONDS = float(os.getenv("DIRECTIONS_TIMEOUT_SECONDS", "8")) # Timeout por chamada
+OSRM_URL = os.getenv("OSRM_URL", "") # Servidor compatível com OSRM (ex.: http://localhost:5000); vazio desativa
+OSRM_PROFILE = os.getenv("OSRM_PROFILE", "foot") # Perfil de roteamento do servidor OSRM
+
+
+def build_pooled_session(pool_size: int = DIRECTIONS_MAX_WORKERS) -> requests.Session:
+    """
+    Cria uma sessão `requests` com pool de conexões keep-alive do tamanho do pool de threads,
+    para que cada thread reutilize uma conexão TLS já aberta com o Google.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ThreadedProvider:
+    """
+    Executa chamadas síncronas fora do loop de eventos.
+
+    - Um `ThreadPoolExecutor` dedicado (não o pool padrão do asyncio) isola as chamadas bloqueantes.
+    - Um semáforo limita quantas chamadas podem estar em andamento ao mesmo tempo. A vaga só é
+      liberada quando a thread termina: uma chamada que passou do timeout continua ocupando a vaga.
+    - `asyncio.wait_for` garante que nenhuma requisição espere mais que `timeout` segundos.
+    """
+
+    thread_name_prefix = "provider"
+
+    def __init__(self, max_workers: int = DIRECTIONS_MAX_WORKERS,
+                 max_concurrency: int = DIRECTIONS_MAX_CONCURRENCY,
+                 timeout: float = DIRECTIONS_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.thread_name_prefix)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        """Executa `func` no pool de threads respeitando o limite de concorrência e o timeout."""
+        await self._semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._semaphore.release()
+            raise
+        # Em caso de timeout a thread termina a chamada em segundo plano e a requisição é liberada, mas a
+        # vaga fica ocupada até o fim da chamada: novas chamadas não se acumulam atrás dela no pool.
+        future.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        """Devolve a vaga no loop de eventos (chamado pela thread que terminou a chamada)."""
+        try:
+            loop.call_soon_threadsafe(self._semaphore.release)
+        except RuntimeError: # Loop já encerrado: não há mais quem aguarde a vaga
+            pass
+
+    def shutdown(self):
+        """Libera as threads do pool (chamado no encerramento do app, no lifespan de main.py)."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GoogleDirectionsProvider(ThreadedProvider):
+    """Directions e Geocoding do Google Maps, com o cliente síncrono executado no pool de threads."""
+
+    thread_name_prefix = "directions"
+    accepts_place_id = True # O Directions aceita destinos no formato "place_id:..."
+
+    def __init__(self, client, max_workers: int = DIRECTIONS_MAX_WORKERS,
+                 max_concurrency: int = DIRECTIONS_MAX_CONCURRENCY,
+                 timeout: float = DIRECTIONS_TIMEOUT_SECONDS):
+        super().__init__(max_workers, max_concurrency, timeout)
+        self.client = client
+
+    async def directions(self, origin: str, destination: str, mode: str = "walking") -> Optional[list]:
+        """Equivalente assíncrono de `gmaps.directions(...)` com os parâmetros usados pelo app."""
+        return await self._run(
+            self.client.directions,
+            origin=origin,
+            destination=destination,
+            mode=mode,
+            language="pt-BR",
+            units="metric",
+        )
+
+    async def geocode(self, address: str, bounds: Optional[dict] = None) -> Optional[list]:
+        """Equivalente assíncrono de `gmaps.geocode(...)`, usado para resolver o texto do destino."""
+        return await self._run(self.client.geocode, address, bounds=bounds, language="pt-BR")
+
+
+class OfflineDirectionsProvider(ThreadedProvider):
+    """Rotas a pé calculadas localmente pelo `OfflineRouter`, sem rede e sem cota."""
+
+    thread_name_prefix = "offline-router"
+    accepts_place_id = False # Só entende coordenadas "lat,lng"
+
+    def __init__(self, router, max_workers: int = 4, max_concurrency: int = DIRECTIONS_MAX_CONCURRENCY,
+                 timeout: float = DIRECTIONS_TIMEOUT_SECONDS):
+        super().__init__(max_workers, max_concurrency, timeout)
+        self.router = router
+
+    async def directions(self, origin: str, destination: str, mode: str = "walking") -> Optional[list]:
+        return await self._run(self.router.directions, origin, destination, mode=mode)
+
+
+def _parse_coordinates(text: str) -> Optional[tuple]:
+    """"lat,lng" -> (lat, lng), ou None se o texto não for uma coordenada."""
+    try:
+        latitude, longitude = (float(value) for value in text.split(","))
+    except ValueError:
+        return None
+    return latitude, longitude
+
+
+def osrm_to_directions(route: dict) -> dict:
+    """Converte uma rota do OSRM (steps=true, geometries=polyline) para o formato da Directions API."""
+    steps = []
+    path = []
+    for step in route["legs"][0]["steps"]:
+        maneuver = step["maneuver"]
+        points = [tuple(point) for point in decode_polyline(step["geometry"]).tolist()]
+        if maneuver["type"] == "arrive" or len(points) < 2:
+            continue
+        # A conversão de cada passo vem da própria manobra: direção antes e depois do ponto de manobra
+        text, code = step_instruction(len(steps), maneuver["bearing_after"], maneuver.get("bearing_before"),
+                                      step.get("name") or None)
+        steps.append(make_step(text, code, step["distance"], step["duration"], points))
+        path.extend(points if not path else points[1:])
+    if not steps:
+        return {}
+    names = [step.get("name") for step in route["legs"][0]["steps"] if step.get("name")]
+    return make_route(steps, path, names[0] if names else "", names[-1] if names else "",
+                      "Rota calculada por um servidor OSRM.")
+
+
+class OSRMDirectionsProvider(ThreadedProvider):
+    """Rotas de um servidor HTTP compatível com OSRM (/route/v1/{perfil}/{lng,lat;lng,lat})."""
+
+    thread_name_prefix = "osrm"
+    accepts_place_id = False # Só entende coordenadas "lat,lng"
+
+    def __init__(self, base_url: str = OSRM_URL, profile: str = OSRM_PROFILE,
+                 max_workers: int = DIRECTIONS_MAX_WORKERS, max_concurrency: int = DIRECTIONS_MAX_CONCURRENCY,
+                 timeout: float = DIRECTIONS_TIMEOUT_SECONDS):
+        super().__init__(max_workers, max_concurrency, timeout)
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.session = build_pooled_session(max_workers)
+
+    def _fetch(self, origin: str, destination: str) -> list:
+        points = [_parse_coordinates(origin), _parse_coordinates(destination)]
+        if None in points:
+            return []
+        coordinates = ";".join(f"{longitude},{latitude}" for latitude, longitude in points)
+        response = self.session.get(f"{self.base_url}/route/v1/{self.profile}/{coordinates}",
+                                    params={"steps": "true", "geometries": "polyline", "overview": "false"},
+                                    timeout=self.timeout)
+        try:
+            data = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+        if data.get("code") in ("NoRoute", "NoSegment"):
+            return []
+        if data.get("code") != "Ok":
+            raise RuntimeError(f"OSRM respondeu {response.status_code}: {data.get('code')} {data.get('message', '')}")
+        routes = [osrm_to_directions(route) for route in data.get("routes", [])[:1]]
+        return [route for route in routes if route]
+
+    async def directions(self, origin: str, destination: str, mode: str = "walking") -> Optional[list]:
+        return await self._run(self._fetch, origin, destination)
@@ -0,0 +1,377 @@
+"""
+Refinamento das instruções com o Gemini, fora do caminho crítico de /navigate/.
+
+Antes, `model.generate_content` era chamado (de forma bloqueante) antes de responder, e o
+refinamento acabou desativado por deixar a navegação lenta. Agora:
+
+- /navigate/ responde na hora com as instruções processadas e um `refinementId`;
+- o modelo roda em segundo plano, em modo streaming, e o texto refinado é entregue por
+  Server-Sent Events em GET /refinements/{refinementId} conforme é gerado;
+- o resultado fica em cache pelo hash do conteúdo das instruções (memória + SQLite, lido e
+  gravado numa thread própria), então rotas idênticas nunca chamam o modelo duas vezes, e pedidos
+  simultâneos compartilham a mesma geração;
+- se o modelo falhar ou passar do prazo, o texto original é entregue como resultado final. A
+  falha fica registrada: a mesma rota só volta ao modelo depois de REFINEMENT_RETRY_SECONDS, e
+  erros ou prazos esgotados seguidos pausam o modelo para todas as rotas (o tempo dobra a cada
+  falha, até REFINEMENT_BACKOFF_MAX_SECONDS) em vez de chamá-lo a cada rota nova.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+REFINEMENT_DEADLINE_SECONDS = float(os.getenv("REFINEMENT_DEADLINE_SECONDS", "20")) # Prazo do modelo antes de usar o texto original
+REFINEMENT_CACHE_SIZE = int(os.getenv("REFINEMENT_CACHE_SIZE", "2000")) # Instruções refinadas mantidas em memória
+REFINEMENT_CACHE_PATH = os.getenv("REFINEMENT_CACHE_PATH", "refinement_cache.sqlite3") # Vazio desativa o cache em disco
+REFINEMENT_RETRY_SECONDS = float(os.getenv("REFINEMENT_RETRY_SECONDS", "60")) # Após uma falha: espera antes de chamar o modelo de novo
+REFINEMENT_BACKOFF_MAX_SECONDS = float(os.getenv("REFINEMENT_BACKOFF_MAX_SECONDS", "600")) # Pausa máxima do modelo após falhas seguidas
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-04-17") # Modelo usado no refinamento
+_RECENT_JOBS = 256 # Gerações concluídas mantidas para quem ainda for buscar o resultado (inclui as que falharam)
+
+# Alterar o prompt muda a chave do cache, para não servir textos gerados com o prompt antigo
+PROMPT_TEMPLATE = '''
+    Reformule as seguintes instruções de navegação a pé para serem extremamente claras, passo a passo, usando linguagem simples e direta, adequada para uma pessoa com deficiência visual que está andando. Mencione pontos de referência se forem citados nas instruções originais ou puderem ser inferidos. Não pule etapas. Mantenha o formato de lista numerada.
+
+    Instruções originais:
+    {directions_text}
+
+    Formato desejado:
+    Lista de instruções numeradas, claras e concisas para navegação a pé.
+    '''
+
+
+def build_prompt(directions_text: str) -> str:
+    return PROMPT_TEMPLATE.format(directions_text=directions_text)
+
+
+def refinement_key(directions_text: str) -> str:
+    """Hash do conteúdo (prompt + lista de passos): a mesma rota gera sempre a mesma chave."""
+    return hashlib.sha256(build_prompt(directions_text).encode("utf-8")).hexdigest()[:24]
+
+
+def is_useful(refined_text: str, directions_text: str) -> bool:
+    """Descarta respostas muito curtas ou vazias (mesmo critério usado antes do streaming)."""
+    return len(refined_text.strip()) > len(directions_text) / 2
+
+
+def load_gemini_model(api_key: str, model_name: str = GEMINI_MODEL):
+    """Importa e configura o SDK do Gemini (a importação sozinha leva quase um segundo) e cria o modelo."""
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+class GeminiStreamingModel:
+    """
+    Adapta `GenerativeModel.generate_content(stream=True)` (iterador bloqueante) para um gerador assíncrono.
+    Com `loader`, o modelo só é criado no primeiro refinamento, na thread do executor (fora do loop de eventos).
+    """
+
+    def __init__(self, model=None, max_workers: int = 4, loader: Optional[Callable[[], object]] = None):
+        self.model = model
+        self._loader = loader
+        self._load_lock = threading.Lock()
+        self.state = "loaded" if model is not None else "pending" # pending -> loaded, ou failed (tenta de novo no próximo uso)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+
+    def _loaded_model(self):
+        with self._load_lock:
+            if self.model is None:
+                try:
+                    self.model = self._loader()
+                    self.state = "loaded"
+                except Exception:
+                    self.state = "failed"
+                    raise
+        return self.model
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = False
+
+        def produce():
+            try:
+                for chunk in self._loaded_model().generate_content(prompt, stream=True):
+                    if stop:
+                        return # Quem pediu desistiu (prazo esgotado): para de consumir o stream
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        self._executor.submit(produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop = True
+
+
+class RefinementCache:
+    """Cache LRU em memória das instruções refinadas, com um segundo nível opcional em SQLite."""
+
+    def __init__(self, max_entries: int = REFINEMENT_CACHE_SIZE, path: Optional[str] = REFINEMENT_CACHE_PATH):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "write_errors": 0}
+        self.path = path
+        self._writer = None # Leituras e gravações no SQLite numa thread própria, fora do loop de eventos
+        self._writer_db = None # Conexão usada só por essa thread
+        if path:
+            db = sqlite3.connect(path)
+            try:
+                db.execute("CREATE TABLE IF NOT EXISTS refinement (key TEXT PRIMARY KEY, text TEXT, created_at REAL)")
+                db.commit()
+            finally:
+                db.close()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refinement-cache")
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """Texto refinado se estiver em memória (sem consultar o disco; usado no caminho de /navigate/)."""
+        text = self._entries.get(key)
+        if text is not None:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return text
+
+    async def get(self, key: str) -> Optional[str]:
+        """Texto refinado em cache; numa falta da memória, o SQLite é lido na thread do cache."""
+        text = self.get_memory(key)
+        if text is not None:
+            return text
+        if self._writer is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._writer, self._read, key)
+            if row:
+                self._remember(key, row[0])
+                self.stats["disk_hits"] += 1
+                return row[0]
+        self.stats["misses"] += 1
+        return None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._writer_db is None:
+            self._writer_db = sqlite3.connect(self.path)
+        return self._writer_db
+
+    def _read(self, key: str) -> Optional[tuple]:
+        try:
+            return self._connection().execute("SELECT text FROM refinement WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e: # Tratado como falta: as instruções são refinadas de novo
+            logger.warning("Erro ao ler instruções refinadas do cache em disco: %s", e)
+            return None
+
+    def put(self, key: str, text: str):
+        self._remember(key, text)
+        if self._writer is not None:
+            self._writer.submit(self._write, key, text, time.time())
+
+    def _write(self, key: str, text: str, created_at: float):
+        try:
+            with self._connection() as db:
+                db.execute("INSERT OR REPLACE INTO refinement (key, text, created_at) VALUES (?, ?, ?)",
+                           (key, text, created_at))
+        except sqlite3.Error as e: # O texto continua no cache em memória
+            self.stats["write_errors"] += 1
+            logger.warning("Erro ao gravar instruções refinadas no cache em disco: %s", e)
+
+    async def close(self):
+        """Espera as gravações pendentes e fecha o arquivo (chamado no encerramento do app)."""
+        if self._writer is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._close_writer)
+        self._writer.shutdown(wait=False)
+        self._writer = None
+
+    def _close_writer(self):
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+    def _remember(self, key: str, text: str):
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self._entries)}
+
+
+class RefinementJob:
+    """Uma geração em andamento: guarda os trechos já recebidos para quem se inscrever depois."""
+
+    def __init__(self, key: str, directions_text: str):
+        self.key = key
+        self.directions_text = directions_text
+        self.chunks = []
+        self.done = False
+        self.text: Optional[str] = None # Texto final (refinado ou, em caso de falha, o original)
+        self.refined = False
+        self.retry_at = 0.0 # Se falhou: quando a mesma rota pode voltar ao modelo
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def add_chunk(self, text: str):
+        self.chunks.append(text)
+        self._notify()
+
+    def finish(self, text: str, refined: bool):
+        self.text = text
+        self.refined = refined
+        self.done = True
+        self._notify()
+
+    async def events(self) -> AsyncIterator[Tuple[str, dict]]:
+        """("chunk", {"text": ...}) para cada trecho e, no fim, ("done", {"text": ..., "refined": ...})."""
+        sent = 0
+        while True:
+            updated = self._updated
+            while sent < len(self.chunks):
+                yield "chunk", {"text": self.chunks[sent]}
+                sent += 1
+            if self.done:
+                yield "done", {"text": self.text, "refined": self.refined}
+                return
+            await updated.wait()
+
+
+class InstructionRefiner:
+    """Agenda refinamentos em segundo plano e entrega os resultados (cache, streaming ou texto original)."""
+
+    def __init__(self, model, cache: RefinementCache, deadline: float = REFINEMENT_DEADLINE_SECONDS,
+                 retry_seconds: float = REFINEMENT_RETRY_SECONDS, max_backoff: float = REFINEMENT_BACKOFF_MAX_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        self.cache = cache
+        self.deadline = deadline
+        self.retry_seconds = retry_seconds
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.jobs: "OrderedDict[str, RefinementJob]" = OrderedDict()
+        self._tasks = set()
+        self._failures = 0 # Erros ou prazos esgotados seguidos do modelo
+        self._paused_until = 0.0
+        self.stats = {"submitted": 0, "cache_hits": 0, "coalesced": 0, "model_calls": 0, "refined": 0, "fallbacks": 0,
+                      "recent_failures": 0, "paused": 0}
+
+    def submit(self, directions_text: str) -> Optional[str]:
+        """Retorna o `refinementId` das instruções, iniciando a geração se ainda não houver resultado."""
+        if not directions_text:
+            return None
+        self.stats["submitted"] += 1
+        key = refinement_key(directions_text)
+        job = self.jobs.get(key)
+        if job and (not job.done or not job.refined):
+            if not job.done:
+                self.stats["coalesced"] += 1
+                return key
+            if self.clock() < job.retry_at:
+                self.stats["recent_failures"] += 1 # Falhou há pouco: entrega de novo o texto original
+                return key
+            del self.jobs[key] # Falhou da última vez: tenta de novo
+        if self.cache.get_memory(key) is not None:
+            self.stats["cache_hits"] += 1
+            return key
+        job = RefinementJob(key, directions_text)
+        self.jobs[key] = job
+        while len(self.jobs) > _RECENT_JOBS:
+            oldest = next(iter(self.jobs))
+            if not self.jobs[oldest].done:
+                break
+            del self.jobs[oldest]
+        task = asyncio.ensure_future(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return key
+
+    async def _run(self, job: RefinementJob):
+        text = await self.cache.get(job.key) # Só o disco: a memória já foi consultada em `submit`
+        if text is not None:
+            self.stats["cache_hits"] += 1
+            job.finish(text, refined=True)
+            return
+        if self.clock() < self._paused_until:
+            self.stats["paused"] += 1 # Modelo falhando: não é chamado até o fim da pausa
+            self._fallback(job)
+            return
+        self.stats["model_calls"] += 1
+        started = time.perf_counter()
+        try:
+            await self._refine(job)
+        finally:
+            # Termina depois da resposta de /navigate/: entra só no histograma, não no Server-Timing
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="gemini")
+
+    async def _refine(self, job: RefinementJob):
+        try:
+            await asyncio.wait_for(self._generate(job), timeout=self.deadline)
+            refined_text = "".join(job.chunks)
+            self._failures = 0
+            if is_useful(refined_text, job.directions_text):
+                self.cache.put(job.key, refined_text)
+                self.stats["refined"] += 1
+                job.finish(refined_text, refined=True)
+                return
+            logger.info("Resposta do Gemini parece muito curta ou irrelevante, usando instruções originais.")
+        except asyncio.TimeoutError:
+            logger.warning("Gemini não terminou em %.0fs; usando as instruções originais.", self.deadline)
+            self._pause()
+        except Exception as e:
+            logger.error("Erro ao refinar instruções com o Gemini: %s", e)
+            self._pause()
+        self._fallback(job)
+
+    def _fallback(self, job: RefinementJob):
+        """Entrega as instruções originais e registra a falha da rota por `retry_seconds`."""
+        self.stats["fallbacks"] += 1
+        job.retry_at = self.clock() + self.retry_seconds
+        job.finish(job.directions_text, refined=False)
+
+    def _pause(self):
+        """Pausa o modelo após um erro: retry_seconds, dobrando a cada falha seguida, até max_backoff."""
+        self._failures += 1
+        pause = min(self.retry_seconds * 2 ** (self._failures - 1), self.max_backoff)
+        self._paused_until = self.clock() + pause
+        logger.warning("Gemini em pausa por %.0fs após %d falha(s) seguida(s).", pause, self._failures)
+
+    async def _generate(self, job: RefinementJob):
+        async for text in self.model.stream(build_prompt(job.directions_text)):
+            if text:
+                job.add_chunk(text)
+
+    async def events(self, key: str) -> Optional[AsyncIterator[Tuple[str, dict]]]:
+        """Eventos de um refinamento; None se a chave for desconhecida."""
+        job = self.jobs.get(key)
+        if job:
+            return job.events()
+        text = await self.cache.get(key)
+        if text is None:
+            return None
+
+        async def cached():
+            yield "done", {"text": text, "refined": True}
+
+        return cached()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_progress": sum(not job.done for job in self.jobs.values()), "cache": self.cache.snapshot()}
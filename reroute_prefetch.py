@@ -0,0 +1,220 @@
+"""
+Pré-cálculo de rotas alternativas nos próximos pontos de manobra.
+
+Quando o usuário erra uma conversão, a navegação só percebe o desvio na atualização seguinte
+e então espera uma rota nova do provedor: segundos de silêncio justamente quando a pessoa
+está mais desorientada. Para evitar isso, enquanto o usuário segue a rota, o
+`ReroutePrefetcher` olha os próximos REROUTE_PREFETCH_MANEUVERS pontos de manobra (fim de
+cada passo da rota) e, em segundo plano, pede rotas a partir das posições de erro mais
+prováveis em cada um:
+
+- seguir reto em vez de virar (passar da conversão);
+- virar para o lado contrário;
+- em manobras quase retas ("continue"), entrar à esquerda ou à direita.
+
+Cada posição fica REROUTE_PREFETCH_DISTANCE_METERS depois do ponto de manobra, na direção
+do erro, e só é usada se estiver fora da rota (a mesma regra de `OFF_ROUTE_THRESHOLD_METERS`).
+As rotas ficam na sessão; quando o usuário sai da rota perto de uma dessas posições, o
+recálculo usa a rota pronta, sem chamar o provedor.
+
+As posições mais prováveis vêm primeiro: a primeira de cada manobra, começando pelas conversões
+(passar reto numa conversão é o erro mais comum) e pela manobra mais próxima. Cada rota da
+sessão pode gastar até REROUTE_PREFETCH_BUDGET chamadas, cada uma a mais na cota diária da
+Directions API: o padrão é baixo e cobre só as conversões mais próximas. As chamadas passam
+pelo cache de rotas e pelo controle de admissão (admission.py) como pré-cálculo: não gastam
+as fichas da sessão e só são feitas com folga no limite global e fora da reserva da cota diária.
+A admissão é decidida antes de entrar no agrupamento de pedidos idênticos: um pré-cálculo recusado
+não recusa o recálculo de um usuário que peça a mesma rota ao mesmo tempo.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from admission import AdmissionDenied
+from directions_format import STRAIGHT_DEGREES
+from geometry import METERS_PER_DEGREE, RouteIndex, haversine
+from route_model import Route
+from sessions import OFF_ROUTE_THRESHOLD_METERS
+
+logger = logging.getLogger(__name__)
+
+REROUTE_PREFETCH_MANEUVERS = int(os.getenv("REROUTE_PREFETCH_MANEUVERS", "2")) # Próximos pontos de manobra cobertos
+REROUTE_PREFETCH_PER_MANEUVER = int(os.getenv("REROUTE_PREFETCH_PER_MANEUVER", "1")) # Posições de erro por manobra
+REROUTE_PREFETCH_BUDGET = int(os.getenv("REROUTE_PREFETCH_BUDGET", "2")) # Chamadas por rota da sessão; 0 desativa
+REROUTE_PREFETCH_DISTANCE_METERS = float(os.getenv("REROUTE_PREFETCH_DISTANCE_METERS", "50")) # Distância do erro após a manobra
+REROUTE_PREFETCH_MATCH_METERS = float(os.getenv("REROUTE_PREFETCH_MATCH_METERS", "35")) # Raio para usar uma rota pronta
+REROUTE_PREFETCH_MAX_AGE_SECONDS = float(os.getenv("REROUTE_PREFETCH_MAX_AGE_SECONDS", "900")) # Rotas prontas mais velhas são ignoradas
+REROUTE_PREFETCH_CONCURRENCY = int(os.getenv("REROUTE_PREFETCH_CONCURRENCY", "4")) # Sessões pré-calculando ao mesmo tempo (deixa o pool dos provedores livre)
+
+HEADING_METERS = 20 # Trecho antes/depois da manobra usado para medir a direção
+
+# Busca a rota de (latitude, longitude) até o destino; None se o provedor não encontrar
+RouteFetcher = Callable[[float, float, str], Awaitable[Optional[Route]]]
+
+
+class PrefetchedRoute:
+    """Rota pronta a partir de uma posição de erro provável."""
+    __slots__ = ("latitude", "longitude", "step", "kind", "route", "index", "created_at")
+
+    def __init__(self, latitude: float, longitude: float, step: int, kind: str, route: Route, created_at: float):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.step = step # Passo em cujo fim fica a manobra
+        self.kind = kind # "straight", "opposite", "left" ou "right"
+        self.route = route
+        self.index = RouteIndex(route.coordinates(), route.step_ends if route.step_count else np.array([0]))
+        self.created_at = created_at
+
+
+def wrong_turn_points(index: RouteIndex, step: int, count: int = REROUTE_PREFETCH_PER_MANEUVER,
+                      distance: float = REROUTE_PREFETCH_DISTANCE_METERS) -> List[Tuple[str, float, float]]:
+    """
+    Posições (tipo, latitude, longitude) de erro mais prováveis na manobra do fim de `step`,
+    da mais para a menos provável. Ignora as que ainda estariam sobre a rota.
+    """
+    along = float(index.cumulative[index.step_end_indexes[step]])
+    corner = _point_at(index, along)
+    incoming = corner - _point_at(index, along - HEADING_METERS)
+    outgoing = _point_at(index, along + HEADING_METERS) - corner
+    if not np.any(incoming) or not np.any(outgoing):
+        return []
+    incoming /= np.linalg.norm(incoming)
+    outgoing /= np.linalg.norm(outgoing)
+    left = np.array([-incoming[1], incoming[0]])
+    turn = math.degrees(math.acos(float(np.clip(incoming @ outgoing, -1.0, 1.0))))
+    if turn < STRAIGHT_DEGREES:
+        directions = [("left", left), ("right", -left)]
+    else:
+        # Lado contrário: a saída refletida em relação à direção de chegada
+        directions = [("straight", incoming), ("opposite", 2 * (outgoing @ incoming) * incoming - outgoing)]
+
+    points = []
+    for kind, direction in directions:
+        x, y = corner + distance * direction / np.linalg.norm(direction)
+        latitude = float(index.origin_lat + y / METERS_PER_DEGREE)
+        longitude = float(index.origin_lng + x / index.scale_x)
+        if index.locate(latitude, longitude)[2] > OFF_ROUTE_THRESHOLD_METERS:
+            points.append((kind, latitude, longitude))
+    return points[:count]
+
+
+def _point_at(index: RouteIndex, along: float) -> np.ndarray:
+    """Ponto (x, y) em metros no plano da rota a `along` metros do início."""
+    along = min(max(along, 0.0), index.total_length)
+    segment = min(int(np.searchsorted(index.cumulative, along, side="right")) - 1, len(index.seg_start) - 1)
+    length = index.cumulative[segment + 1] - index.cumulative[segment]
+    t = (along - index.cumulative[segment]) / length if length > 0 else 0.0
+    return index.seg_start[segment] + t * index.seg_vector[segment]
+
+
+class ReroutePrefetcher:
+    """Agenda os pré-cálculos de cada sessão e encontra a rota pronta quando o usuário sai da rota."""
+
+    def __init__(self, fetch: RouteFetcher, maneuvers: int = REROUTE_PREFETCH_MANEUVERS,
+                 per_maneuver: int = REROUTE_PREFETCH_PER_MANEUVER, budget: int = REROUTE_PREFETCH_BUDGET,
+                 distance: float = REROUTE_PREFETCH_DISTANCE_METERS, match_meters: float = REROUTE_PREFETCH_MATCH_METERS,
+                 max_age: float = REROUTE_PREFETCH_MAX_AGE_SECONDS, concurrency: int = REROUTE_PREFETCH_CONCURRENCY,
+                 clock: Callable[[], float] = time.monotonic):
+        self.fetch = fetch
+        self.maneuvers = maneuvers
+        self.per_maneuver = per_maneuver
+        self.budget = budget
+        self.distance = distance
+        self.match_meters = match_meters
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.clock = clock
+        self._tasks = set()
+        self.stats = {"scheduled": 0, "fetched": 0, "failed": 0, "denied": 0, "busy": 0, "hits": 0, "misses": 0}
+
+    def schedule(self, session):
+        """
+        Pré-calcula, em segundo plano, as rotas das manobras à frente do passo atual que ainda
+        não foram cobertas. Chamado a cada atualização em que o usuário está na rota; não faz nada
+        se elas já estiverem cobertas ou se o orçamento da rota tiver acabado.
+        """
+        if self.budget <= 0 or session.prefetch_spent >= self.budget:
+            return
+        last_maneuver = session.route.step_count - 2 # O fim do último passo é o destino
+        steps = [step for step in range(session.current_step, min(session.current_step + self.maneuvers, last_maneuver + 1))
+                 if step not in session.prefetch_steps]
+        if not steps:
+            return
+        if len(self._tasks) >= self.concurrency:
+            self.stats["busy"] += 1 # Tenta de novo na próxima atualização
+            return
+        ready = {(prefetched.step, prefetched.kind) for prefetched in session.prefetched}
+        ranked = []
+        for step in steps:
+            session.prefetch_steps.add(step)
+            for rank, (kind, latitude, longitude) in enumerate(
+                    wrong_turn_points(session.route_index, step, self.per_maneuver, self.distance)):
+                if (step, kind) not in ready:
+                    ranked.append(((rank, kind in ("left", "right"), step), (step, kind, latitude, longitude)))
+        ranked.sort(key=lambda item: item[0])
+        candidates = [candidate for _, candidate in ranked[:self.budget - session.prefetch_spent]]
+        if not candidates:
+            return
+        session.prefetch_spent += len(candidates)
+        self.stats["scheduled"] += len(candidates)
+        task = asyncio.ensure_future(self._run(session, session.route_version, candidates))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, session, route_version: str, candidates: list):
+        # Em sequência, da manobra mais próxima para a mais distante: não gera rajadas de chamadas
+        for position, (step, kind, latitude, longitude) in enumerate(candidates):
+            try:
+                route = await self.fetch(latitude, longitude, session.destination)
+            except AdmissionDenied as denied:
+                self.stats["denied"] += 1
+                logger.debug("Pré-cálculo de rota adiado (%s).", denied.reason)
+                if session.route_version == route_version:
+                    # Sem folga agora: devolve o orçamento para tentar de novo numa próxima atualização
+                    pending = candidates[position:]
+                    session.prefetch_spent -= len(pending)
+                    session.prefetch_steps.difference_update(step for step, *_ in pending)
+                return
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning("Erro ao pré-calcular rota alternativa: %s", e)
+                continue
+            if route is None or not route.step_count:
+                self.stats["failed"] += 1
+                continue
+            if session.route_version != route_version:
+                return # A rota da sessão mudou enquanto isso: as manobras são outras
+            session.prefetched.append(PrefetchedRoute(latitude, longitude, step, kind, route, self.clock()))
+            self.stats["fetched"] += 1
+            logger.debug("Rota alternativa pronta para a sessão %s (passo %d, %s).", session.session_id, step + 1, kind)
+
+    def match(self, session, latitude: float, longitude: float) -> Optional[Route]:
+        """Rota pronta para quem saiu da rota em (latitude, longitude), ou None."""
+        now = self.clock()
+        best, best_distance = None, self.match_meters
+        for prefetched in session.prefetched:
+            if now - prefetched.created_at > self.max_age:
+                continue
+            distance = haversine((latitude, longitude), (prefetched.latitude, prefetched.longitude))
+            if distance <= best_distance and prefetched.index.locate(latitude, longitude)[2] <= OFF_ROUTE_THRESHOLD_METERS:
+                best, best_distance = prefetched, distance
+        if best is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        logger.debug("Sessão %s: desvio no passo %d (%s) atendido pela rota pronta.", session.session_id, best.step + 1, best.kind)
+        return best.route
+
+    async def stop(self):
+        """Cancela os pré-cálculos em andamento (encerramento do app, antes de desligar os provedores)."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._tasks)}
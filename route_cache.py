@@ -0,0 +1,276 @@
+"""
+Cache de rotas compartilhado.
+
+Muitos usuários fazem os mesmos trajetos curtos (terminal -> clínica, estação -> escola).
+As rotas são guardadas por (modo, célula geohash da origem, destino resolvido): qualquer
+origem dentro da mesma célula reaproveita a rota. O cache tem limite de tamanho, TTL e um
+modo "stale-while-revalidate": depois do TTL, durante a janela de tolerância, a rota antiga
+é devolvida na hora e uma atualização é feita em segundo plano.
+
+Há dois backends: em memória (por processo) e SQLite (arquivo compartilhado entre os workers
+do uvicorn, acessado numa thread própria, fora do loop de eventos). As rotas ficam na forma
+compacta de route_model.py: objetos `Route` em memória e a serialização binária de
+`Route.to_bytes` no SQLite.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+
+from route_model import Route
+
+logger = logging.getLogger(__name__)
+
+ROUTE_CACHE_BACKEND = os.getenv("ROUTE_CACHE_BACKEND", "memory") # "memory" ou "sqlite"
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", "route_cache.sqlite3")
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "2000"))
+ROUTE_CACHE_TTL_SECONDS = float(os.getenv("ROUTE_CACHE_TTL_SECONDS", str(6 * 3600))) # Rota "fresca" por 6 h
+ROUTE_CACHE_STALE_SECONDS = float(os.getenv("ROUTE_CACHE_STALE_SECONDS", str(24 * 3600))) # Depois, servida e atualizada por mais 24 h
+ROUTE_CACHE_GEOHASH_PRECISION = int(os.getenv("ROUTE_CACHE_GEOHASH_PRECISION", "8")) # 8 = célula de ~38 m x 19 m
+ROUTE_CACHE_FLUSH_SECONDS = float(os.getenv("ROUTE_CACHE_FLUSH_SECONDS", "1")) # Intervalo das gravações em lote no SQLite
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float, longitude: float, precision: int = ROUTE_CACHE_GEOHASH_PRECISION) -> str:
+    """Codifica uma coordenada em geohash (células menores quanto maior a precisão)."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = value = 0
+    even = True # Bits alternados: longitude, latitude, longitude...
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(chars)
+
+
+def route_cache_key(latitude: float, longitude: float, destination: str, mode: str = "walking") -> str:
+    """Chave do cache: modo, célula da origem e destino já resolvido (place_id ou coordenadas)."""
+    return f"{mode}|{geohash(latitude, longitude)}|{destination}"
+
+
+class InMemoryRouteCacheBackend:
+    """Backend por processo: dicionário LRU limitado ao número de entradas."""
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, Route]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, value: Route, stored_at: float):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def close(self):
+        """Nada a gravar: as rotas só existem neste processo."""
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteRouteCacheBackend:
+    """
+    Backend em arquivo SQLite, compartilhado entre processos (modo WAL).
+
+    O arquivo só é acessado numa thread dedicada: a espera pelo lock de escrita de outro worker
+    (até `timeout`) não trava o loop de eventos. As gravações ficam num buffer em memória, já
+    visível para `get`, e vão para o arquivo em lote, numa única transação, a cada `flush_seconds`.
+    A remoção das entradas mais antigas é feita a cada `max_entries // 10` gravações.
+    """
+
+    def __init__(self, path: str = ROUTE_CACHE_PATH, max_entries: int = ROUTE_CACHE_SIZE,
+                 flush_seconds: float = ROUTE_CACHE_FLUSH_SECONDS):
+        self.max_entries = max_entries
+        self.flush_seconds = flush_seconds
+        self._writes = 0
+        self._pending: Dict[str, tuple] = {} # Gravações ainda não levadas ao arquivo
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-cache")
+        self._db = sqlite3.connect(path, timeout=1.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, value BLOB, stored_at REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS routes_stored_at ON routes (stored_at)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+
+    async def get(self, key: str) -> Optional[tuple]:
+        entry = self._pending.get(key)
+        if entry is not None:
+            return entry
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key)
+
+    def _read(self, key: str) -> Optional[tuple]:
+        try:
+            row = self._db.execute("SELECT stored_at, value FROM routes WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e: # Arquivo travado por outro worker além do timeout: trata como ausente
+            logger.warning("Erro ao ler o cache de rotas: %s", e)
+            return None
+        if row is None:
+            return None
+        try:
+            return row[0], Route.from_bytes(row[1])
+        except Exception: # Entrada gravada em outro formato (ex.: JSON de versões anteriores): trata como ausente
+            return None
+
+    def set(self, key: str, value: Route, stored_at: float):
+        self._pending[key] = (stored_at, value)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_seconds, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Grava no arquivo as entradas do buffer, numa única transação."""
+        if not self._pending:
+            return
+        batch = dict(self._pending)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+        for key, entry in batch.items():
+            if self._pending.get(key) is entry: # Regravadas enquanto isso continuam no buffer
+                del self._pending[key]
+
+    def _write(self, batch: Dict[str, tuple]):
+        rows = [(key, value.to_bytes(), stored_at) for key, (stored_at, value) in batch.items()]
+        try:
+            with self._db: # Uma transação (e um commit) por lote
+                self._db.executemany("INSERT OR REPLACE INTO routes (key, value, stored_at) VALUES (?, ?, ?)", rows)
+                self._writes += len(rows)
+                if self._writes >= max(1, self.max_entries // 10):
+                    self._writes = 0
+                    self._db.execute("DELETE FROM routes WHERE key NOT IN "
+                                     "(SELECT key FROM routes ORDER BY stored_at DESC LIMIT ?)", (self.max_entries,))
+            self._count = self._db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+        except sqlite3.Error as e: # É só um cache: o lote é descartado
+            logger.warning("Erro ao gravar %d rotas no cache: %s", len(rows), e)
+
+    async def close(self):
+        """Grava o que estiver no buffer e fecha o arquivo (chamado no encerramento do app)."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._db.close)
+        self._executor.shutdown(wait=False)
+
+    def __len__(self):
+        # Contagem da última gravação mais o buffer (aproximada: não consulta o arquivo no loop de eventos)
+        return self._count + len(self._pending)
+
+
+def create_route_cache_backend(kind: str = ROUTE_CACHE_BACKEND):
+    """Cria o backend configurado em ROUTE_CACHE_BACKEND."""
+    if kind == "sqlite":
+        return SQLiteRouteCacheBackend()
+    if kind != "memory":
+        logger.warning("ROUTE_CACHE_BACKEND '%s' desconhecido. Usando cache em memória.", kind)
+    return InMemoryRouteCacheBackend()
+
+
+class RouteCache:
+    """Cache de rotas com TTL e stale-while-revalidate sobre um backend plugável."""
+
+    def __init__(self, backend, ttl_seconds: float = ROUTE_CACHE_TTL_SECONDS,
+                 stale_seconds: float = ROUTE_CACHE_STALE_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0, "expired_hits": 0}
+        self._refreshing = set() # Chaves com atualização em segundo plano em andamento
+        self._tasks = set() # Referências às tarefas de atualização (evita coleta pelo GC)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Optional[Route]]],
+                           refresh: Optional[Callable[[], Awaitable[Optional[Route]]]] = None) -> Optional[Route]:
+        """
+        Retorna a rota em cache ou chama `fetch()` e guarda o resultado.
+        Rotas vencidas dentro da janela de tolerância são devolvidas imediatamente e atualizadas em
+        segundo plano com `refresh()` (por padrão, `fetch()`); se ela devolver None, a rota antiga fica.
+        """
+        entry = await self.backend.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age < self.ttl_seconds:
+                self.stats["hits"] += 1
+                return value
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stats["stale_hits"] += 1
+                self._refresh_in_background(key, refresh or fetch)
+                return value
+
+        self.stats["misses"] += 1
+        value = await fetch()
+        if value:
+            self.backend.set(key, value, time.time())
+        return value
+
+    async def peek(self, key: str) -> Optional[Route]:
+        """
+        Rota guardada para a chave, qualquer que seja a idade. Usada quando o provedor não pode
+        ser chamado (controle de admissão): uma rota antiga é melhor que nenhuma.
+        """
+        entry = await self.backend.get(key)
+        if entry is None:
+            return None
+        self.stats["expired_hits"] += 1
+        return entry[1]
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], Awaitable[Optional[Route]]]):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                value = await fetch()
+                if value:
+                    self.backend.set(key, value, time.time())
+                    self.stats["refreshes"] += 1
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning("Erro ao atualizar rota em cache '%s': %s", key, e)
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """
+        Interrompe as atualizações em segundo plano e grava as rotas pendentes do backend
+        (chamado no encerramento do app, antes de desligar os provedores).
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backend.close()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self.backend)}
@@ -0,0 +1,205 @@
+"""
+Representação interna compacta de uma rota a pé.
+
+A resposta da Directions API (ou dos provedores no mesmo formato: OSRM e roteador offline) é
+lida uma única vez, em `Route.from_directions`, logo que chega dos provedores. Dali em diante
+cache de rotas, sessões e formatação das instruções usam `Route`, em vez de percorrer o dict
+aninhado com cadeias de `.get(...)` e limpar o HTML de cada passo a cada uso:
+
+- os passos ficam em colunas NumPy (distância, duração, código da manobra, índice do último ponto);
+- o caminho completo (polylines dos passos já unidas) fica em um único array int32 em 1e-5 graus,
+  a mesma precisão da polyline do Google;
+- textos das instruções e nomes de rua passam por uma tabela de strings internadas: os mesmos
+  textos ("Vire à direita na R. Augusta") repetidos em milhares de rotas ocupam memória uma vez só;
+- `to_bytes`/`from_bytes` geram uma serialização binária (zlib) para o cache em SQLite.
+"""
+import html
+import os
+import re
+import struct
+import zlib
+from typing import Optional, Sequence
+
+import numpy as np
+
+from geometry import decode_polyline
+
+ROUTE_STRING_TABLE_SIZE = int(os.getenv("ROUTE_STRING_TABLE_SIZE", "100000")) # Textos distintos internados por processo
+
+# Códigos das manobras (índice nesta tupla); manobras desconhecidas viram 0 ("")
+MANEUVERS = ("", "turn-left", "turn-right", "turn-slight-left", "turn-slight-right", "turn-sharp-left",
+             "turn-sharp-right", "keep-left", "keep-right", "uturn-left", "uturn-right", "straight",
+             "ramp-left", "ramp-right", "merge", "fork-left", "fork-right", "roundabout-left",
+             "roundabout-right", "ferry", "ferry-train")
+_MANEUVER_CODES = {name: code for code, name in enumerate(MANEUVERS)}
+
+_HTML_TAG = re.compile(r"<[^>]+>")
+_MAGIC = b"RTE1"
+_HEADER = struct.Struct("<4sIIIdd") # magic, passos, pontos, textos, distância total, duração total
+_COORDINATE_SCALE = 1e5
+
+
+class StringTable:
+    """Devolve sempre a mesma instância para textos iguais (até `max_entries` textos distintos)."""
+
+    def __init__(self, max_entries: int = ROUTE_STRING_TABLE_SIZE):
+        self.max_entries = max_entries
+        self._strings: "dict[str, str]" = {}
+
+    def intern(self, text: str) -> str:
+        interned = self._strings.get(text)
+        if interned is not None:
+            return interned
+        if len(self._strings) < self.max_entries:
+            self._strings[text] = text
+        return text
+
+    def __len__(self):
+        return len(self._strings)
+
+
+STRINGS = StringTable()
+
+
+def clean_instruction(html_text: str) -> str:
+    """Remove as tags e decodifica as entidades HTML de `html_instructions`."""
+    return html.unescape(_HTML_TAG.sub("", html_text))
+
+
+class Route:
+    """Rota planejada: textos por passo, colunas numéricas por passo e o caminho completo."""
+
+    __slots__ = ("start_address", "end_address", "distance", "duration", "overview_polyline",
+                 "instructions", "street_names", "maneuvers", "step_distances", "step_durations",
+                 "step_ends", "path")
+
+    def __init__(self, start_address: str, end_address: str, distance: float, duration: float,
+                 overview_polyline: Optional[str], instructions: Sequence[str], street_names: Sequence[str],
+                 maneuvers: np.ndarray, step_distances: np.ndarray, step_durations: np.ndarray,
+                 step_ends: np.ndarray, path: np.ndarray):
+        self.start_address = start_address
+        self.end_address = end_address
+        self.distance = distance # Metros
+        self.duration = duration # Segundos
+        self.overview_polyline = overview_polyline # Polyline simplificada, enviada ao frontend para o mapa
+        self.instructions = tuple(instructions) # Texto limpo de cada passo
+        self.street_names = tuple(street_names) # "" quando o provedor não informa a rua do passo
+        self.maneuvers = maneuvers # uint8, índices de MANEUVERS
+        self.step_distances = step_distances # float32, metros
+        self.step_durations = step_durations # float32, segundos
+        self.step_ends = step_ends # uint32, índice em `path` do último ponto de cada passo
+        self.path = path # int32 (N, 2), (latitude, longitude) em 1e-5 graus
+
+    @classmethod
+    def from_directions(cls, directions: dict, strings: StringTable = STRINGS) -> Optional["Route"]:
+        """Converte uma rota no formato da Directions API; None se ela não tiver trechos ("legs")."""
+        if not directions or not directions.get("legs"):
+            return None
+        leg = directions["legs"][0]
+        steps = leg.get("steps") or []
+        instructions, street_names = [], []
+        maneuvers = np.zeros(len(steps), dtype=np.uint8)
+        distances = np.zeros(len(steps), dtype=np.float32)
+        durations = np.zeros(len(steps), dtype=np.float32)
+
+        # Junta as polylines de cada passo em um único caminho e registra onde cada passo termina
+        pieces = []
+        step_ends = []
+        point_count = 0
+        for i, step in enumerate(steps):
+            instructions.append(strings.intern(clean_instruction(step.get("html_instructions", "Instrução desconhecida"))))
+            street_names.append(strings.intern(f"{step.get('street_number', '')} {step.get('street_name', '')}".strip()))
+            maneuvers[i] = _MANEUVER_CODES.get(step.get("maneuver", ""), 0)
+            distances[i] = step.get("distance", {}).get("value", 0)
+            durations[i] = step.get("duration", {}).get("value", 0)
+
+            points = decode_polyline(step.get("polyline", {}).get("points", ""))
+            if not len(points):
+                start, end = step.get("start_location"), step.get("end_location")
+                points = np.array([(p["lat"], p["lng"]) for p in (start, end) if p], dtype=np.float64).reshape(-1, 2)
+            points = np.round(points * _COORDINATE_SCALE).astype(np.int32)
+            if pieces and len(points) and np.array_equal(points[0], pieces[-1][-1]):
+                points = points[1:] # Evita duplicar o ponto de junção entre passos
+            if len(points):
+                pieces.append(points)
+                point_count += len(points)
+            step_ends.append(max(point_count - 1, 0))
+        if not pieces:
+            end = leg.get("end_location", {"lat": 0.0, "lng": 0.0})
+            pieces = [np.round(np.array([[end["lat"], end["lng"]]]) * _COORDINATE_SCALE).astype(np.int32)]
+
+        return cls(
+            start_address=strings.intern(leg.get("start_address", "sua localização atual")),
+            end_address=strings.intern(leg.get("end_address", "seu destino")),
+            distance=float(leg.get("distance", {}).get("value", 0)),
+            duration=float(leg.get("duration", {}).get("value", 0)),
+            overview_polyline=(directions.get("overview_polyline") or {}).get("points"),
+            instructions=instructions,
+            street_names=street_names,
+            maneuvers=maneuvers,
+            step_distances=distances,
+            step_durations=durations,
+            step_ends=np.array(step_ends, dtype=np.uint32),
+            path=np.concatenate(pieces),
+        )
+
+    @property
+    def step_count(self) -> int:
+        return len(self.instructions)
+
+    def coordinates(self) -> np.ndarray:
+        """Caminho em graus, array (N, 2) float64 de (latitude, longitude)."""
+        return self.path / _COORDINATE_SCALE
+
+    def maneuver(self, index: int) -> str:
+        return MANEUVERS[self.maneuvers[index]]
+
+    def route_data(self) -> dict:
+        """Dados da rota enviados ao frontend (`routeData`)."""
+        return {"overview_polyline": {"points": self.overview_polyline} if self.overview_polyline is not None else None}
+
+    def to_bytes(self) -> bytes:
+        """Serialização binária: cabeçalho + colunas + textos (sem repetição), comprimidos com zlib."""
+        table: "dict[str, int]" = {}
+        refs = [table.setdefault(text, len(table)) for text in
+                (self.start_address, self.end_address, self.overview_polyline or "", *self.instructions, *self.street_names)]
+        header = _HEADER.pack(_MAGIC, self.step_count, len(self.path), len(table), self.distance, self.duration)
+        # Caminho em diferenças entre pontos consecutivos: valores pequenos, que o zlib comprime bem
+        deltas = np.diff(self.path, axis=0, prepend=np.zeros((1, 2), dtype=np.int32))
+        body = b"".join((
+            np.array(refs, dtype=np.uint32).tobytes(),
+            self.maneuvers.tobytes(),
+            self.step_distances.tobytes(),
+            self.step_durations.tobytes(),
+            self.step_ends.tobytes(),
+            deltas.astype(np.int32).tobytes(),
+            "\0".join(table).encode("utf-8"),
+        ))
+        return header + zlib.compress(body, 6)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, strings: StringTable = STRINGS) -> "Route":
+        magic, steps, points, string_count, distance, duration = _HEADER.unpack_from(blob)
+        if magic != _MAGIC:
+            raise ValueError("Formato de rota desconhecido")
+        body = zlib.decompress(blob[_HEADER.size:])
+        offset = 0
+
+        def column(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(body, dtype=dtype, count=count, offset=offset).copy()
+            offset += values.nbytes
+            return values
+
+        refs = column(np.uint32, 3 + 2 * steps).tolist()
+        maneuvers = column(np.uint8, steps)
+        distances = column(np.float32, steps)
+        durations = column(np.float32, steps)
+        step_ends = column(np.uint32, steps)
+        path = np.cumsum(column(np.int32, points * 2).reshape(-1, 2), axis=0, dtype=np.int32)
+        table = [strings.intern(text) for text in body[offset:].decode("utf-8").split("\0")]
+        if len(table) != string_count:
+            raise ValueError("Rota serializada corrompida")
+        texts = [table[ref] for ref in refs]
+        return cls(texts[0], texts[1], distance, duration, texts[2] or None, texts[3:3 + steps], texts[3 + steps:],
+                   maneuvers, distances, durations, step_ends, path)
@@ -0,0 +1,254 @@
+"""
+Combinação de vários motores de rota (Google, OSRM, roteador offline).
+
+Para quem anda guiado apenas pela voz, "Não foi possível obter as instruções" é o pior
+resultado possível. Por isso a rota é pedida a uma lista ordenada de provedores:
+
+- Orçamento por provedor: cada chamada tem um tempo máximo próprio (ROUTING_BUDGETS).
+- Hedge: se o provedor atual não respondeu até o seu p95 de latência, o próximo da lista
+  é acionado em paralelo; vale a primeira rota que chegar.
+- Fallback: erro ou rota vazia aciona imediatamente o próximo provedor.
+- Circuit breaker: depois de CIRCUIT_FAILURE_THRESHOLD falhas seguidas o provedor deixa
+  de ser chamado por CIRCUIT_RESET_SECONDS; depois disso uma única chamada de teste decide
+  se ele volta.
+- Prazo total: nenhuma busca de rota passa de ROUTING_DEADLINE_SECONDS, independentemente
+  do pior caso de cada provedor.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROUTING_PROVIDERS = [name.strip() for name in os.getenv("ROUTING_PROVIDERS", "google").split(",") if name.strip()] # Ordem de preferência
+ROUTING_DEADLINE_SECONDS = float(os.getenv("ROUTING_DEADLINE_SECONDS", "6")) # Prazo total de uma busca de rota
+ROUTING_DEFAULT_BUDGET_SECONDS = float(os.getenv("ROUTING_DEFAULT_BUDGET_SECONDS", "4")) # Tempo máximo de cada provedor
+ROUTING_BUDGETS = os.getenv("ROUTING_BUDGETS", "") # Orçamentos por provedor, ex.: "google=4,osrm=2,offline=1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95")) # Quantil de latência após o qual o próximo provedor é acionado
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.25")) # Evita hedge agressivo com latências muito baixas
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "1.5")) # Usado até haver amostras suficientes
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")) # Falhas seguidas que abrem o circuito
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30")) # Tempo com o circuito aberto antes de testar de novo
+
+
+class ProvidersUnavailable(Exception):
+    """Nenhum provedor pôde ser chamado (todos com o circuito aberto ou nenhum configurado)."""
+
+
+def parse_budgets(text: str) -> Dict[str, float]:
+    """"google=4,osrm=2" -> {"google": 4.0, "osrm": 2.0}."""
+    budgets = {}
+    for item in text.split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+class CircuitBreaker:
+    """Circuit breaker clássico: fechado -> aberto (após N falhas) -> meio aberto (uma chamada de teste)."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Indica se uma chamada pode ser feita agora (no estado meio aberto, só uma por vez)."""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+        self._probing = False
+
+    def release(self):
+        """Chamada cancelada (outro provedor respondeu antes): não conta como sucesso nem falha."""
+        self._probing = False
+
+
+class LatencyTracker:
+    """Janela deslizante das últimas latências de sucesso de um provedor."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ProviderSlot:
+    """Um provedor de rotas com seu orçamento, circuit breaker, latências e contadores."""
+
+    def __init__(self, name: str, provider, budget: float = ROUTING_DEFAULT_BUDGET_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.provider = provider
+        self.budget = budget
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "failures": 0, "empty": 0, "cancelled": 0, "hedged": 0, "wins": 0, "skipped_open": 0}
+
+    def hedge_delay(self) -> float:
+        """Tempo de espera por este provedor antes de acionar o próximo em paralelo."""
+        observed = self.latency.quantile(HEDGE_QUANTILE)
+        delay = observed if observed is not None else HEDGE_DEFAULT_DELAY_SECONDS
+        return min(max(delay, HEDGE_MIN_DELAY_SECONDS), self.budget)
+
+    async def call(self, origin: str, destination: str, mode: str) -> list:
+        self.stats["calls"] += 1
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self.provider.directions(origin, destination, mode=mode), timeout=self.budget)
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            self.breaker.release()
+            raise
+        except Exception:
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.latency.add(time.monotonic() - start)
+        if not result:
+            self.stats["empty"] += 1
+        return result or []
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.latency.quantile(0.5), self.latency.quantile(0.95)
+        return {
+            **self.stats,
+            "state": self.breaker.state,
+            "times_opened": self.breaker.times_opened,
+            "budget_seconds": self.budget,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class RoutingPool:
+    """Pede a rota aos provedores em ordem de preferência, com hedge, fallback e prazo total."""
+
+    def __init__(self, slots: List[ProviderSlot], deadline: float = ROUTING_DEADLINE_SECONDS):
+        self.slots = slots
+        self.deadline = deadline
+
+    @classmethod
+    def from_providers(cls, providers: Dict[str, object], order: List[str] = None, budgets: str = ROUTING_BUDGETS,
+                       deadline: float = ROUTING_DEADLINE_SECONDS) -> "RoutingPool":
+        """Monta o pool a partir dos provedores disponíveis, na ordem de ROUTING_PROVIDERS."""
+        order = order or ROUTING_PROVIDERS
+        parsed = parse_budgets(budgets)
+        slots = [ProviderSlot(name, providers[name], parsed.get(name, ROUTING_DEFAULT_BUDGET_SECONDS))
+                 for name in order if providers.get(name)]
+        return cls(slots, deadline)
+
+    def __bool__(self) -> bool:
+        return bool(self.slots)
+
+    @property
+    def accepts_place_id(self) -> bool:
+        return any(slot.provider.accepts_place_id for slot in self.slots)
+
+    async def directions(self, origin: str, destination: str, mode: str = "walking",
+                         coordinates: Optional[str] = None) -> list:
+        """
+        Retorna a primeira rota não vazia entre os provedores (lista vazia se todos responderem
+        sem rota). `coordinates` ("lat,lng" do destino) é usado pelos provedores que não aceitam
+        place_id. Lança asyncio.TimeoutError se o prazo total esgotar.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        queue = list(self.slots)
+        pending: Dict[asyncio.Future, ProviderSlot] = {}
+        answered_empty = False
+        last_error: Optional[BaseException] = None
+        hedge_at = None
+
+        def launch(hedged: bool) -> bool:
+            nonlocal hedge_at
+            while queue:
+                slot = queue.pop(0)
+                if not slot.breaker.allow():
+                    slot.stats["skipped_open"] += 1
+                    continue
+                target = coordinates if coordinates and not slot.provider.accepts_place_id else destination
+                pending[asyncio.ensure_future(slot.call(origin, target, mode))] = slot
+                if hedged:
+                    slot.stats["hedged"] += 1
+                hedge_at = loop.time() + slot.hedge_delay()
+                return True
+            return False
+
+        if not launch(hedged=False):
+            raise ProvidersUnavailable("Nenhum provedor de rotas disponível.")
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    raise asyncio.TimeoutError()
+                wait = deadline - now
+                if queue:
+                    wait = min(wait, max(0.0, hedge_at - now))
+                done, _ = await asyncio.wait(list(pending), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # O provedor mais recente passou do seu p95: aciona o próximo em paralelo
+                    if queue and loop.time() >= hedge_at:
+                        launch(hedged=True)
+                    continue
+                for task in done:
+                    slot = pending.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning("Provedor de rotas '%s' falhou: %r", slot.name, last_error)
+                    elif task.result():
+                        slot.stats["wins"] += 1
+                        return task.result()
+                    else:
+                        answered_empty = True
+                if queue:
+                    launch(hedged=False) # Fallback imediato após erro ou rota vazia
+        finally:
+            for task in pending:
+                task.cancel()
+        if answered_empty or last_error is None:
+            return []
+        raise last_error
+
+    def snapshot(self) -> dict:
+        return {"deadline_seconds": self.deadline, "providers": {slot.name: slot.snapshot() for slot in self.slots}}
@@ -15,6 +15,17 @@ let currentLocation = null;
 let watchId = null; // Variável para armazenar o ID do watcher de geolocalização
 let destination = null; // Armazenar o destino atual da navegação
 let lastSpokenInstruction = ""; // Adiciona uma variável para controlar a última instrução falada
+let lastSpokenStatus = ""; // Último aviso de navegação degradada falado (sem cota para recalcular a rota)
+let navigationSessionId = null; // Sessão de navegação criada pelo backend (evita recalcular a rota a cada atualização)
+let lastAnnouncedStep = null; // Último passo anunciado por voz
+let routeVersion = null; // Versão da rota recebida (enviada em If-None-Match para receber só o progresso)
+let currentInstructions = ""; // Instruções da rota atual (respostas "unchanged" não as repetem)
+let refinementId = null; // Refinamento do Gemini já solicitado para a rota atual
+let refinementSource = null; // EventSource que recebe o texto refinado
+const REFINEMENT_URL = 'http://127.0.0.1:8000/refinements/';
+let audioIds = null; // Áudio sintetizado no servidor para cada linha das instruções (null: usa a fala do aparelho)
+let currentAudio = null; // Frase do servidor tocando agora
+const TTS_URL = 'http://127.0.0.1:8000/tts/';
 
 // Variáveis do Google Maps
 let map; // Objeto Google Map
@@ -692,6 +703,67 @@ function getCurrentLocationSingle() {
 }
 let lastBackendUpdateTime = 0; // Variável para controlar o tempo da última atualização enviada ao backend
 const BACKEND_UPDATE_INTERVAL = 10000;
+const LIVE_NAVIGATION_URL = 'ws://127.0.0.1:8000/navigate/ws'; // Navegação ao vivo (WebSocket)
+let liveSocket = null; // Conexão WebSocket; se não estiver aberta, usa o POST periódico em /navigate/fixes
+const FIXES_URL = 'http://127.0.0.1:8000/navigate/fixes'; // Envio em lote das localizações acumuladas
+const SHARE_LOCATION_URL = 'http://127.0.0.1:8000/share_location/'; // Compartilhamento (com link de acompanhamento ao vivo)
+const MAX_PENDING_FIXES = 600; // Localizações guardadas entre envios (as mais antigas são descartadas)
+let pendingFixes = []; // Localizações do GPS desde o último envio ao backend
+
+// Abre a conexão de navegação ao vivo: as localizações são enviadas assim que chegam
+// e o backend responde imediatamente com progresso, avisos de manobra e rotas novas.
+function openLiveNavigation() {
+    if (!('WebSocket' in window)) {
+        console.warn("WebSocket não suportado. Usando atualizações periódicas.");
+        return;
+    }
+    console.log("Abrindo conexão de navegação ao vivo:", LIVE_NAVIGATION_URL);
+    const socket = new WebSocket(LIVE_NAVIGATION_URL);
+    socket.onopen = () => {
+        console.log("Navegação ao vivo conectada.");
+        socket.send(JSON.stringify({ type: 'start', destination: destination, session_id: navigationSessionId, route_version: routeVersion }));
+        liveSocket = socket;
+    };
+    socket.onmessage = (event) => handleLiveMessage(socket, JSON.parse(event.data));
+    socket.onclose = () => {
+        console.log("Navegação ao vivo desconectada. Voltando às atualizações periódicas.");
+        if (liveSocket === socket) {
+            liveSocket = null;
+        }
+    };
+    socket.onerror = (error) => console.error("Erro na conexão de navegação ao vivo:", error);
+}
+
+// Trata as mensagens enviadas pelo backend na navegação ao vivo
+function handleLiveMessage(socket, message) {
+    switch (message.type) {
+        case 'route':
+        case 'progress':
+            processNavigationResponse(message);
+            break;
+        case 'approaching': {
+            // Aviso de manobra próxima: fala o próximo passo
+            const lines = currentInstructions ? currentInstructions.split("\n") : [];
+            const nextStepText = lines[message.currentStep + 2] || "";
+            if (audioIds && audioIds[message.currentStep + 2]) {
+                // Áudio do servidor já pronto para o próximo passo (sem o prefixo de distância, que varia)
+                stopSpeech();
+                playLines(lines, [message.currentStep + 2]);
+            } else if (nextStepText) {
+                speakText(`Em ${Math.round(message.distance)} metros: ${nextStepText}`);
+            }
+            break;
+        }
+        case 'ping':
+            socket.send(JSON.stringify({ type: 'pong' }));
+            break;
+        case 'error':
+            console.error("Erro informado pela navegação ao vivo:", message.detail);
+            break;
+        default:
+            console.log("Mensagem de navegação ao vivo desconhecida:", message);
+    }
+}
 
 // Função para iniciar o monitoramento contínuo da localização
 function startLocationTracking() {
@@ -725,14 +797,34 @@ function startLocationTracking() {
                 }
 
 
+                // Com a navegação ao vivo conectada, cada localização vai direto para o backend
+                if (liveSocket && liveSocket.readyState === WebSocket.OPEN) {
+                    liveSocket.send(JSON.stringify({ type: 'fix', latitude: currentLocation.latitude, longitude: currentLocation.longitude }));
+                    return;
+                }
+
+                // Sem a conexão ao vivo, as localizações são acumuladas e enviadas juntas a cada intervalo:
+                // o backend filtra o lote inteiro (descarta saltos do GPS) em vez de usar só a última
+                pendingFixes.push({
+                    latitude: position.coords.latitude,
+                    longitude: position.coords.longitude,
+                    accuracy: position.coords.accuracy,
+                    timestamp: position.timestamp
+                });
+                if (pendingFixes.length > MAX_PENDING_FIXES) {
+                    pendingFixes.splice(0, pendingFixes.length - MAX_PENDING_FIXES);
+                }
+
                 const currentTime = Date.now();
                 if (currentTime - lastBackendUpdateTime > BACKEND_UPDATE_INTERVAL) {
-                     console.log(`Intervalo de ${BACKEND_UPDATE_INTERVAL / 1000} segundos atingido. Enviando localização atualizada para o backend.`);
+                     console.log(`Intervalo de ${BACKEND_UPDATE_INTERVAL / 1000} segundos atingido. Enviando ${pendingFixes.length} localizações para o backend.`);
                      lastBackendUpdateTime = currentTime;
+                    const fixes = pendingFixes;
+                    pendingFixes = [];
 
                     try {
-                         console.log("Enviando localização atualizada para o backend...");
-                        const updatedResponse = await sendLocationToBackend(currentLocation.latitude, currentLocation.longitude, destination);
+                         console.log("Enviando lote de localizações para o backend...");
+                        const updatedResponse = await sendFixesToBackend(fixes, destination);
                          console.log("Resposta atualizada do backend recebida:", updatedResponse);
                         processNavigationResponse(updatedResponse);
                     } catch (error) {
@@ -758,6 +850,7 @@ function startLocationTracking() {
         );
         currentDetailedInstruction.innerText = "Monitorando sua localização em tempo real...";
          console.log("watchPosition iniciado. watchId:", watchId);
+         openLiveNavigation();
          lastBackendUpdateTime = Date.now(); // Define o tempo inicial da última atualização ao iniciar
     } else {
         console.error("Geolocalização não suportada para monitoramento em startLocationTracking.");
@@ -777,12 +870,28 @@ function stopNavigation() {
     } else {
          console.log("watchId é null, nenhum monitoramento ativo para parar.");
     }
+    if (liveSocket) {
+        liveSocket.close();
+        liveSocket = null;
+    }
     currentLocation = null;
     destination = null;
+    navigationSessionId = null;
+    pendingFixes = [];
+    lastAnnouncedStep = null;
+    routeVersion = null;
+    currentInstructions = "";
+    audioIds = null;
+    refinementId = null;
+    if (refinementSource) {
+        refinementSource.close();
+        refinementSource = null;
+    }
     currentDetailedInstruction.innerText = "Navegação parada.";
     nextStepsList.innerHTML = '';
     lastSpokenInstruction = "";
-    window.speechSynthesis.cancel();
+    lastSpokenStatus = "";
+    stopSpeech();
      console.log("Variaveis de navegação resetadas e fala cancelada.");
 
     // Remover a rota do mapa
@@ -819,13 +928,18 @@ async function sendLocationToBackend(latitude, longitude, destination) {
     console.log("Enviando POST para:", backendUrl); // Log da URL
 
     try {
+        const headers = { 'Content-Type': 'application/json' };
+        if (navigationSessionId && routeVersion) {
+            headers['If-None-Match'] = `"${routeVersion}"`; // Já temos a rota: o backend envia só o progresso
+        }
         const response = await fetch(backendUrl, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: headers,
             body: JSON.stringify({
                 destination: destination,
                 latitude: latitude,
-                longitude: longitude
+                longitude: longitude,
+                session_id: navigationSessionId // null na primeira chamada; o backend cria a sessão
             })
         });
         console.log("Resposta do backend recebida. Status:", response.status); // Log do status
@@ -847,6 +961,85 @@ async function sendLocationToBackend(latitude, longitude, destination) {
     }
 }
 
+// Envia as localizações acumuladas desde o último envio; o backend responde como /navigate/,
+// com a posição suavizada em `position`
+async function sendFixesToBackend(fixes, destination) {
+    const headers = { 'Content-Type': 'application/json' };
+    if (navigationSessionId && routeVersion) {
+        headers['If-None-Match'] = `"${routeVersion}"`; // Já temos a rota: o backend envia só o progresso
+    }
+    const response = await fetch(FIXES_URL, {
+        method: 'POST',
+        headers: headers,
+        body: JSON.stringify({
+            destination: destination,
+            session_id: navigationSessionId,
+            fixes: fixes
+        })
+    });
+    if (!response.ok) {
+        const errorText = await response.text();
+        console.error("Erro HTTP no envio do lote de localizações:", response.status, errorText);
+        throw new Error(`Erro HTTP! status: ${response.status}, detalhe: ${errorText.substring(0, 200)}...`);
+    }
+    const data = await response.json();
+    if (data.position) {
+        console.log(`Posição suavizada: ${data.position.accepted} localizações usadas, ${data.position.rejected} descartadas, precisão ${data.position.accuracy} m.`);
+    }
+    return data;
+}
+
+// Formata a lista numerada de instruções para exibição
+function formatInstructions(text) {
+    return text
+        .replace(/\*\*(.*?)\*\*/g, '<b>$1</b>')
+        .replace(/(\d+\.)/g, '<br><b>$1</b>');
+}
+
+// Recebe as instruções refinadas pelo Gemini em segundo plano (Server-Sent Events).
+// As instruções processadas já foram exibidas e faladas; o texto refinado substitui a lista
+// na tela conforme é gerado e, se as instruções ainda estiverem sendo lidas, passa a ser o texto falado.
+function listenForRefinement(id) {
+    if (id === refinementId || !('EventSource' in window)) {
+        return;
+    }
+    if (refinementSource) {
+        refinementSource.close();
+    }
+    refinementId = id;
+    let refinedText = "";
+    const source = new EventSource(REFINEMENT_URL + id);
+    refinementSource = source;
+    source.addEventListener('chunk', (event) => {
+        refinedText += JSON.parse(event.data).text;
+        nextStepsList.innerHTML = formatInstructions(refinedText);
+    });
+    source.addEventListener('done', (event) => {
+        const result = JSON.parse(event.data);
+        source.close();
+        if (refinementSource === source) {
+            refinementSource = null;
+        }
+        nextStepsList.innerHTML = formatInstructions(result.text);
+        if (!result.refined) {
+            console.log("Refinamento indisponível; mantendo as instruções originais.");
+            return;
+        }
+        if (window.speechSynthesis.speaking) {
+            window.speechSynthesis.cancel();
+            speakText(result.text);
+            lastSpokenInstruction = result.text;
+        }
+    });
+    source.onerror = () => {
+        console.warn("Falha ao receber as instruções refinadas; mantendo as originais.");
+        source.close();
+        if (refinementSource === source) {
+            refinementSource = null;
+        }
+    };
+}
+
 // Função para exibir a rota no mapa (adaptada para a resposta do backend)
 function displayRouteOnMap(routeData) {
     console.log("displayRouteOnMap chamado com dados:", routeData); // Log no início da função
@@ -908,13 +1101,43 @@ function displayRouteOnMap(routeData) {
 function processNavigationResponse(data) {
     console.log("processNavigationResponse chamado com dados:", data); // Log no início da função
 
+    // Guarda a sessão de navegação para as próximas atualizações de localização
+    if (data && data.sessionId) {
+        navigationSessionId = data.sessionId;
+    }
+    if (data && data.rerouted) {
+        lastAnnouncedStep = null; // Rota nova: o primeiro passo deve ser anunciado novamente
+    }
+    if (data && data.routeVersion) {
+        routeVersion = data.routeVersion;
+    }
+
+    // Navegação degradada: o backend não pôde recalcular a rota e segue acompanhando a atual.
+    // O aviso é falado uma vez, não a cada atualização
+    if (data && data.status && data.status !== lastSpokenStatus) {
+        console.warn("Navegação degradada:", data.degraded, data.status);
+        lastSpokenStatus = data.status;
+        currentDetailedInstruction.innerText = data.status;
+        stopSpeech();
+        speakText(data.status);
+    } else if (data && !data.degraded) {
+        lastSpokenStatus = "";
+    }
+
+    // Rota inalterada: o backend enviou apenas o progresso; instruções e mapa continuam os mesmos
+    if (data && data.unchanged) {
+        console.log("Rota inalterada (versão " + data.routeVersion + "). Atualizando apenas o progresso.");
+        if (data.progress) {
+            announceProgress(data.progress, currentInstructions);
+        }
+        return;
+    }
+    currentInstructions = (data && data.instructions) || "";
+    audioIds = (data && data.audioIds) || null;
+
     if (data && data.instructions) { // Verifica se 'data' e 'data.instructions' existem
         console.log("Instruções encontradas na resposta do backend."); // Log se instruções encontradas
-        const formattedInstructions = data.instructions
-            .replace(/\*\*(.*?)\*\*/g, '<b>$1</b>')
-            .replace(/(\d+\.)/g, '<br><b>$1</b>');
-
-        nextStepsList.innerHTML = formattedInstructions;
+        nextStepsList.innerHTML = formatInstructions(data.instructions);
         currentDetailedInstruction.innerText = "Instruções de Navegação:";
         console.log("Instruções exibidas na UI."); // Log após exibir
 
@@ -922,11 +1145,12 @@ function processNavigationResponse(data) {
         if (data.instructions !== lastSpokenInstruction) {
              console.log("Nova instrução, falando:", data.instructions); // Log antes de falar
              // Cancela a fala anterior antes de iniciar a nova
-            if (window.speechSynthesis.speaking) {
+            if (isSpeaking()) {
                 console.log("Cancelando fala anterior."); // Log antes de cancelar
-                window.speechSynthesis.cancel();
+                stopSpeech();
             }
-            speakText(data.instructions);
+            const lines = data.instructions.split("\n");
+            playLines(lines, lines.map((_, index) => index));
             lastSpokenInstruction = data.instructions;
             console.log("speakText chamado."); // Log após chamar speakText
         } else {
@@ -939,7 +1163,7 @@ function processNavigationResponse(data) {
         currentDetailedInstruction.innerText = "Instruções de navegação não disponíveis."; // Feedback visual
         nextStepsList.innerHTML = '';
         lastSpokenInstruction = "";
-        window.speechSynthesis.cancel(); // Cancela fala se não houver instruções
+        stopSpeech(); // Cancela fala se não houver instruções
     }
 
     // Chame a função para exibir a rota se os dados estiverem presentes na resposta
@@ -954,40 +1178,96 @@ function processNavigationResponse(data) {
              routePolyline.setMap(null);
              routePolyline = null;
          }
+    }
+    // Anuncia o passo atual quando ele muda (o progresso é calculado pelo backend)
+    if (data && data.progress) {
+        announceProgress(data.progress, data.instructions);
+    }
+    // Instruções refinadas pelo Gemini chegam depois, sem atrasar a resposta
+    if (data && data.refinementId) {
+        listenForRefinement(data.refinementId);
     }
      console.log("processNavigationResponse concluído."); // Log final da função
 }
 
+// Função para exibir e falar o passo atual a partir do progresso enviado pelo backend
+function announceProgress(progress, instructions) {
+    console.log("announceProgress chamado com:", progress);
+    const remainingMeters = Math.round(progress.remainingDistance);
+    const nextManeuverMeters = Math.round(progress.distanceToNextManeuver);
+
+    if (progress.arrived) {
+        currentDetailedInstruction.innerText = "Você chegou ao seu destino.";
+        navigationSessionId = null;
+        return;
+    }
+
+    // A linha 0 das instruções é a introdução; o passo N está na linha N + 1
+    const lines = instructions ? instructions.split("\n") : [];
+    const stepText = lines[progress.currentStep + 1] || "";
+    currentDetailedInstruction.innerText = `${stepText} Próxima manobra em ${nextManeuverMeters} metros. Faltam ${remainingMeters} metros.`;
+
+    if (progress.currentStep !== lastAnnouncedStep && lastAnnouncedStep !== null && stepText) {
+        // Fala apenas o novo passo, sem repetir todas as instruções
+        if (isSpeaking()) {
+            stopSpeech();
+        }
+        playLines(lines, [progress.currentStep + 1]);
+    }
+    lastAnnouncedStep = progress.currentStep;
+}
+
 
 // --- Funções de Acessibilidade e Compartilhamento ---
-// Estas funções são placeholders e precisam de implementação real para enviar emails/mensagens.
+// O backend envia a localização por e-mail/WhatsApp (dispatch.py) e, com a navegação em andamento,
+// cria um link de acompanhamento ao vivo (watch.html) que a família pode abrir.
 
-function shareLocation() {
+async function shareLocation() {
     console.log("shareLocation chamado."); // Log na função
     if (currentLocation && destination) { // Garante que há localização e destino
-        // Corrigindo o link do Google Maps para usar coordenadas (formato correto é lat,lng)
         const mapsLink = `https://www.google.com/maps/search/?api=1&query=${currentLocation.latitude},${currentLocation.longitude}`;
-        const message = `Estou em ${mapsLink}, navegando para ${destination}.`;
-        console.log("Dados para compartilhamento:", { location: currentLocation, destination: destination, mapsLink: mapsLink }); // Log dados
-
-        alert(`Compartilhando sua localização: ${mapsLink}\nNavegando para: ${destination} (Simulação)`);
-        console.log("Simulando o compartilhamento de localização.");
-
-        // Aqui você faria a chamada ao seu backend para o endpoint de compartilhamento real,
-        // passando currentLocation e destination. O backend lidaria com o envio de email/whatsapp.
-        // fetch('http://127.0.0.1:8000/share_location/', { // Exemplo de chamada, endpoint precisa existir no main.py
-        //     method: 'POST',
-        //     headers: { 'Content-Type': 'application/json' },
-        //     body: JSON.stringify({
-        //         latitude: currentLocation.latitude,
-        //         longitude: currentLocation.longitude,
-        //         destination: destination // Incluir o destino para o email/whatsapp
-        //     })
-        // }).then(response => response.json())
-        // .then(data => console.log("Resposta do compartilhamento:", data))
-        // .catch(error => console.error("Erro ao compartilhar localização:", error));
-
+        let link = mapsLink;
+        try {
+            const response = await fetch(SHARE_LOCATION_URL, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    latitude: currentLocation.latitude,
+                    longitude: currentLocation.longitude,
+                    destination: destination, // Incluir o destino para o email/whatsapp
+                    session_id: navigationSessionId // Com sessão, o backend cria o link ao vivo
+                })
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const data = await response.json();
+            console.log("Resposta do compartilhamento:", data);
+            if (data.shareLink) {
+                link = data.shareLink.url;
+            }
+        } catch (error) {
+            console.error("Erro ao compartilhar localização:", error); // Sem backend, compartilha só o link do mapa
+        }
 
+        const message = link === mapsLink
+            ? `Estou em ${mapsLink}, navegando para ${destination}.`
+            : `Acompanhe minha caminhada até ${destination} ao vivo: ${link}`;
+        if (navigator.share) {
+            try {
+                await navigator.share({ title: 'SmartPath', text: message, url: link });
+                speakText("Localização compartilhada.");
+            } catch (error) {
+                console.log("Compartilhamento cancelado:", error);
+            }
+        } else if (navigator.clipboard) {
+            await navigator.clipboard.writeText(message).catch(error => console.error("Erro ao copiar o link:", error));
+            speakText("Localização compartilhada. O link foi copiado.");
+            alert(message);
+        } else {
+            speakText("Localização compartilhada.");
+            alert(message);
+        }
     } else {
         console.log("Localização ou destino não disponível para compartilhar.");
         alert('Localização ou destino não disponível para compartilhar.');
@@ -1021,6 +1301,53 @@ function applyContrast(theme) {
 }
 
 // --- Text-to-Speech ---
+// Toca o áudio sintetizado no servidor (GET /tts/{id}, em cache no navegador) para as linhas
+// indicadas, em sequência. Se uma linha não tiver áudio ou ele falhar, o restante é falado
+// pela Web Speech API do navegador.
+function playLines(lines, indexes) {
+    indexes = indexes.filter(index => lines[index]);
+    if (!indexes.length) {
+        return;
+    }
+    const id = audioIds && audioIds[indexes[0]];
+    const fallback = () => speakText(indexes.map(index => lines[index]).join("\n"));
+    if (!id) {
+        fallback();
+        return;
+    }
+    const audio = new Audio(TTS_URL + id);
+    currentAudio = audio;
+    if (indexes.length > 1 && audioIds[indexes[1]]) {
+        new Audio(TTS_URL + audioIds[indexes[1]]).preload = 'auto'; // Baixa a próxima frase enquanto esta toca
+    }
+    audio.onended = () => {
+        if (currentAudio === audio) {
+            currentAudio = null;
+            playLines(lines, indexes.slice(1));
+        }
+    };
+    audio.onerror = () => {
+        if (currentAudio === audio) {
+            console.warn("Falha ao tocar o áudio do servidor; usando a fala do aparelho.");
+            currentAudio = null;
+            fallback();
+        }
+    };
+    audio.play().catch(() => audio.onerror());
+}
+
+function isSpeaking() {
+    return (currentAudio !== null && !currentAudio.paused) || window.speechSynthesis.speaking;
+}
+
+function stopSpeech() {
+    if (currentAudio) {
+        currentAudio.pause();
+        currentAudio = null;
+    }
+    window.speechSynthesis.cancel();
+}
+
 // Usa a Web Speech API do navegador
 
 function speakText(text) {
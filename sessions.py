@@ -0,0 +1,152 @@
+"""
+Sessões de navegação do lado do servidor.
+
+Em vez de pedir uma rota nova ao Google a cada atualização de GPS, a rota planejada
+(passos, distâncias, durações e polyline decodificada) é guardada uma única vez por sessão.
+A cada nova localização o progresso (passo atual, distância até a próxima manobra e tempo
+restante) é calculado localmente. Uma nova rota só é pedida quando o usuário sai da rota.
+"""
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from geometry import RouteIndex, haversine
+from route_model import Route
+
+NAVIGATION_SESSION_TTL_SECONDS = float(os.getenv("NAVIGATION_SESSION_TTL_SECONDS", "1800")) # Sessão expira após 30 min sem atualizações
+NAVIGATION_MAX_SESSIONS = int(os.getenv("NAVIGATION_MAX_SESSIONS", "10000"))
+OFF_ROUTE_THRESHOLD_METERS = float(os.getenv("OFF_ROUTE_THRESHOLD_METERS", "40")) # Distância da rota para considerar desvio
+ARRIVAL_THRESHOLD_METERS = float(os.getenv("ARRIVAL_THRESHOLD_METERS", "20")) # Distância do destino para considerar chegada
+
+
+class RouteProgress:
+    """Resultado do acompanhamento de uma localização em relação à rota da sessão."""
+    __slots__ = ("step_index", "distance_to_next_maneuver", "remaining_distance",
+                 "remaining_duration", "distance_from_route", "off_route", "arrived")
+
+    def __init__(self, step_index: int, distance_to_next_maneuver: float, remaining_distance: float,
+                 remaining_duration: float, distance_from_route: float, off_route: bool, arrived: bool):
+        self.step_index = step_index
+        self.distance_to_next_maneuver = distance_to_next_maneuver
+        self.remaining_distance = remaining_distance
+        self.remaining_duration = remaining_duration
+        self.distance_from_route = distance_from_route
+        self.off_route = off_route
+        self.arrived = arrived
+
+
+class NavigationSession:
+    """Rota planejada de um usuário e o estado de acompanhamento associado."""
+
+    def __init__(self, session_id: str, destination: str, route: Route,
+                 instructions_text: str, route_data: Optional[dict]):
+        self.session_id = session_id
+        self.destination = destination
+        self.last_seen = time.monotonic()
+        self.current_step = 0
+        self.position_filter = None # Filtro das localizações em lote (gps_filter.py), mantido entre rotas
+        self.share_id = None # Link de acompanhamento ao vivo (share_links.py), criado por main.py
+        self.share_url = None
+        self.set_route(route, instructions_text, route_data)
+
+    def set_route(self, route: Route, instructions_text: str, route_data: Optional[dict]):
+        """Guarda (ou substitui, após um desvio) a rota da sessão e pré-calcula sua geometria."""
+        self.route = route
+        self.instructions_text = instructions_text
+        self.route_data = route_data
+        self.current_step = 0
+        self.refinement_id = None # Refinamento do Gemini das instruções desta rota (definido por main.py)
+        self.audio_ids = None # Áudio de cada linha das instruções, em /tts/{id} (definido por main.py)
+        self.prefetched = [] # Rotas prontas a partir de prováveis erros nas próximas manobras (reroute_prefetch.py)
+        self.prefetch_steps = set() # Passos cujas manobras já foram pré-calculadas
+        self.prefetch_spent = 0 # Chamadas de pré-cálculo gastas com esta rota
+        # Versão da rota (usada como ETag): muda apenas quando instruções ou polyline mudam
+        digest = hashlib.sha1(f"{instructions_text}\n{route.overview_polyline or ''}".encode("utf-8"))
+        self.route_version = digest.hexdigest()[:16]
+
+        # O caminho e o fim de cada passo já vêm prontos da rota (route_model.py)
+        self.step_durations = route.step_durations
+        self.route_index = RouteIndex(route.coordinates(), route.step_ends if route.step_count else np.array([0]))
+        self.destination_point = tuple(self.route_index.path[-1])
+        self.total_distance = self.route_index.total_length
+        self.step_end_along = self.route_index.cumulative[self.route_index.step_end_indexes].tolist()
+
+    def track(self, latitude: float, longitude: float) -> RouteProgress:
+        """Calcula o progresso do usuário na rota a partir de uma localização."""
+        self.last_seen = time.monotonic()
+        point = (latitude, longitude)
+        _, step_index, cross_track, along_track = self.route_index.locate(latitude, longitude)
+        self.current_step = step_index
+
+        remaining_distance = max(self.total_distance - along_track, 0.0)
+        distance_to_next_maneuver = max(self.step_end_along[step_index] - along_track, 0.0)
+
+        # Tempo restante: fração restante do passo atual + duração dos passos seguintes
+        remaining_duration = float(self.step_durations[step_index + 1:].sum())
+        if len(self.step_durations):
+            step_start = self.step_end_along[step_index - 1] if step_index > 0 else 0.0
+            step_length = self.step_end_along[step_index] - step_start
+            fraction_left = distance_to_next_maneuver / step_length if step_length > 0 else 0.0
+            remaining_duration += float(self.step_durations[step_index]) * fraction_left
+
+        # A distância ao longo da rota só vale para a chegada se o usuário estiver sobre a rota:
+        # ao lado do fim dela (do outro lado da quadra, por exemplo) ele ainda não chegou
+        arrived = ((remaining_distance <= ARRIVAL_THRESHOLD_METERS and cross_track <= OFF_ROUTE_THRESHOLD_METERS)
+                   or haversine(point, self.destination_point) <= ARRIVAL_THRESHOLD_METERS)
+        off_route = not arrived and cross_track > OFF_ROUTE_THRESHOLD_METERS
+
+        return RouteProgress(step_index, distance_to_next_maneuver, remaining_distance,
+                             remaining_duration, cross_track, off_route, arrived)
+
+
+class SessionStore:
+    """Armazena as sessões em memória, com expiração por inatividade e limite de tamanho (LRU)."""
+
+    def __init__(self, ttl_seconds: float = NAVIGATION_SESSION_TTL_SECONDS,
+                 max_sessions: int = NAVIGATION_MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, NavigationSession]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: Optional[str]) -> Optional[NavigationSession]:
+        """Retorna a sessão se ela existir e não estiver expirada."""
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_seen > self.ttl_seconds:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def create(self, destination: str, route: Route, instructions_text: str,
+               route_data: Optional[dict]) -> NavigationSession:
+        """Cria uma nova sessão para a rota recebida, descartando sessões expiradas ou excedentes."""
+        self._purge_expired()
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+        session = NavigationSession(uuid.uuid4().hex, destination, route, instructions_text, route_data)
+        self._sessions[session.session_id] = session
+        return session
+
+    def drop(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        # As sessões estão em ordem de uso: basta olhar o início do dicionário
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
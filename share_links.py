@@ -0,0 +1,228 @@
+"""
+Links de acompanhamento ao vivo: a família abre um link e vê onde o usuário está agora.
+
+- `ShareLinkSigner` emite tokens curtos assinados (HMAC-SHA256) com o identificador do
+  compartilhamento e a validade. O token não contém a sessão de navegação: quem tem o link só
+  consegue acompanhar, não navegar em nome do usuário.
+- `PositionHub` é um pub/sub em memória por worker. Cada compartilhamento é um tópico com a
+  última posição publicada; a navegação publica a cada atualização (POST /navigate/,
+  /navigate/fixes e /navigate/ws) e todos os acompanhantes (SSE ou WebSocket) são acordados
+  por um único evento.
+- A mensagem é serializada uma única vez (JSON e quadro SSE já em bytes) e compartilhada por
+  todos os acompanhantes.
+- Não há fila por acompanhante: cada um guarda só o número da última posição enviada. Quem
+  está lento (rede ruim, aba em segundo plano) recebe a posição mais recente quando voltar a
+  ler e as intermediárias são descartadas. A memória é a de um tópico por compartilhamento
+  (SHARE_HUB_MAX_TOPICS) com até SHARE_LINK_MAX_WATCHERS acompanhantes cada, independente da
+  velocidade deles.
+
+O hub fica em memória: com vários workers, o acompanhamento precisa chegar ao mesmo worker
+que recebe as atualizações da sessão (o mesmo vale para as sessões de navegação).
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SHARE_LINK_SECRET = os.getenv("SHARE_LINK_SECRET", "") # Vazio: chave aleatória por processo (links não sobrevivem a reinícios)
+SHARE_LINK_TTL_SECONDS = float(os.getenv("SHARE_LINK_TTL_SECONDS", "14400")) # Validade de um link (4 h)
+SHARE_LINK_BASE_URL = os.getenv("SHARE_LINK_BASE_URL", "http://127.0.0.1:8080/watch.html") # Página de acompanhamento do frontend
+SHARE_LINK_MAX_WATCHERS = int(os.getenv("SHARE_LINK_MAX_WATCHERS", "100")) # Acompanhantes simultâneos por link
+SHARE_HUB_MAX_TOPICS = int(os.getenv("SHARE_HUB_MAX_TOPICS", "20000")) # Compartilhamentos ativos por worker
+SHARE_LINK_HEARTBEAT_SECONDS = float(os.getenv("SHARE_LINK_HEARTBEAT_SECONDS", "15")) # Mantém a conexão aberta sem posições novas
+
+
+class ShareLinkSigner:
+    """Emite e verifica tokens `<compartilhamento>.<expiração>.<assinatura>`."""
+
+    def __init__(self, secret: str = SHARE_LINK_SECRET, ttl_seconds: float = SHARE_LINK_TTL_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        if not secret:
+            logger.info("SHARE_LINK_SECRET não configurada: os links de acompanhamento valem só até o reinício deste worker.")
+        self.key = secret.encode("utf-8") if secret else secrets.token_bytes(32)
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+
+    def _signature(self, body: str) -> str:
+        digest = hmac.new(self.key, body.encode("ascii"), hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+    def issue(self, share_id: str) -> Tuple[str, int]:
+        """Token para o compartilhamento e o horário (epoch, s) em que ele expira."""
+        expires_at = int(self.clock() + self.ttl_seconds)
+        body = f"{share_id}.{expires_at}"
+        return f"{body}.{self._signature(body)}", expires_at
+
+    def verify(self, token: str) -> Optional[Tuple[str, int]]:
+        """(compartilhamento, expiração) se a assinatura confere; None se o token foi adulterado ou é inválido."""
+        parts = token.split(".")
+        if len(parts) != 3 or not parts[1].isdigit():
+            return None
+        body = f"{parts[0]}.{parts[1]}"
+        if not hmac.compare_digest(parts[2], self._signature(body)):
+            return None
+        return parts[0], int(parts[1])
+
+
+class SharedPosition:
+    """Uma posição publicada; serializada uma vez, na primeira entrega, para todos os acompanhantes."""
+    __slots__ = ("seq", "payload", "_json", "_sse")
+
+    def __init__(self, seq: int, payload: dict):
+        self.seq = seq
+        self.payload = payload
+        self._json = None
+        self._sse = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps({"type": "position", **self.payload}, ensure_ascii=False)
+        return self._json
+
+    def sse(self) -> bytes:
+        if self._sse is None:
+            self._sse = f"event: position\ndata: {self.json()}\n\n".encode("utf-8")
+        return self._sse
+
+
+class ShareTopic:
+    """Estado de um compartilhamento: última posição, acompanhantes conectados e validade."""
+
+    def __init__(self, share_id: str, expires_at: float):
+        self.share_id = share_id
+        self.expires_at = expires_at
+        self.latest: Optional[SharedPosition] = None
+        self.watchers = 0
+        self.closed_reason: Optional[str] = None # "arrived", "expired", "evicted" ou "stopped"
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        # Um evento novo a cada publicação: todos os acompanhantes que esperam o anterior acordam juntos
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+
+class WatcherLimitReached(Exception):
+    """O link já tem SHARE_LINK_MAX_WATCHERS acompanhantes conectados."""
+
+
+class PositionHub:
+    """Pub/sub das posições compartilhadas (um tópico por compartilhamento, em ordem de expiração)."""
+
+    def __init__(self, max_topics: int = SHARE_HUB_MAX_TOPICS, max_watchers: int = SHARE_LINK_MAX_WATCHERS,
+                 heartbeat_seconds: float = SHARE_LINK_HEARTBEAT_SECONDS, clock: Callable[[], float] = time.time):
+        self.max_topics = max_topics
+        self.max_watchers = max_watchers
+        self.heartbeat_seconds = heartbeat_seconds
+        self.clock = clock
+        self._topics: "OrderedDict[str, ShareTopic]" = OrderedDict()
+        self.stats = {"published": 0, "delivered": 0, "skipped_stale": 0, "watchers_rejected": 0, "expired": 0, "evicted": 0}
+
+    def open(self, share_id: str, expires_at: float) -> ShareTopic:
+        """Cria o tópico (ou renova a validade de um existente, ao emitir um link novo)."""
+        self._purge_expired()
+        topic = self._topics.get(share_id)
+        if topic is None:
+            while len(self._topics) >= self.max_topics:
+                _, oldest = self._topics.popitem(last=False)
+                self._close(oldest, "evicted")
+                self.stats["evicted"] += 1
+            topic = self._topics[share_id] = ShareTopic(share_id, expires_at)
+        else:
+            # Com a mesma validade para todos os links, o fim do dicionário é sempre o que expira por último
+            topic.expires_at = max(topic.expires_at, expires_at)
+            self._topics.move_to_end(share_id)
+        return topic
+
+    def get(self, share_id: str) -> Optional[ShareTopic]:
+        topic = self._topics.get(share_id)
+        if topic is not None and topic.expires_at <= self.clock():
+            self._expire(topic)
+            return None
+        return topic
+
+    def publish(self, share_id: str, payload: dict) -> bool:
+        """Publica a posição para os acompanhantes do compartilhamento. O(1), sem serializar."""
+        topic = self._topics.get(share_id)
+        if topic is None or topic.closed_reason:
+            return False
+        seq = topic.latest.seq + 1 if topic.latest else 1
+        topic.latest = SharedPosition(seq, payload)
+        topic._notify()
+        self.stats["published"] += 1
+        return True
+
+    def close(self, share_id: str, reason: str = "stopped"):
+        """Encerra o compartilhamento: os acompanhantes recebem a última posição e o fim."""
+        topic = self._topics.pop(share_id, None)
+        if topic is not None:
+            self._close(topic, reason)
+
+    def attach(self, topic: ShareTopic):
+        if topic.watchers >= self.max_watchers:
+            self.stats["watchers_rejected"] += 1
+            raise WatcherLimitReached()
+        topic.watchers += 1
+
+    def detach(self, topic: ShareTopic):
+        topic.watchers -= 1
+
+    async def updates(self, topic: ShareTopic) -> AsyncIterator[Optional[SharedPosition]]:
+        """
+        Posições para um acompanhante já registrado (`attach`): a mais recente ao conectar e cada
+        nova depois disso. Se o acompanhante demorar a consumir, recebe só a mais recente quando
+        voltar. Produz None a cada SHARE_LINK_HEARTBEAT_SECONDS sem novidades e termina quando o
+        compartilhamento acaba (veja `topic.closed_reason`).
+        """
+        sent = 0
+        while True:
+            updated = topic._updated
+            latest = topic.latest
+            if latest is not None and latest.seq > sent:
+                if sent:
+                    self.stats["skipped_stale"] += latest.seq - sent - 1
+                sent = latest.seq
+                self.stats["delivered"] += 1
+                yield latest
+                continue
+            if topic.closed_reason:
+                return
+            remaining = topic.expires_at - self.clock()
+            if remaining <= 0:
+                self._expire(topic)
+                return
+            try:
+                await asyncio.wait_for(updated.wait(), timeout=min(self.heartbeat_seconds, remaining))
+            except asyncio.TimeoutError:
+                yield None
+
+    def _close(self, topic: ShareTopic, reason: str):
+        topic.closed_reason = reason
+        topic._notify()
+
+    def _expire(self, topic: ShareTopic):
+        if self._topics.get(topic.share_id) is topic:
+            del self._topics[topic.share_id]
+            self.stats["expired"] += 1
+        if not topic.closed_reason:
+            self._close(topic, "expired")
+
+    def _purge_expired(self):
+        now = self.clock()
+        while self._topics:
+            oldest = next(iter(self._topics.values()))
+            if oldest.expires_at > now:
+                break
+            self._expire(oldest)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "topics": len(self._topics), "watchers": sum(topic.watchers for topic in self._topics.values())}
@@ -0,0 +1,48 @@
+"""
+Agrupamento de requisições idênticas em andamento ("single-flight").
+
+Quando várias requisições pedem a mesma coisa ao mesmo tempo (um destino popular, ou um
+cliente repetindo a chamada porque a anterior demorou), apenas uma chamada vai ao provedor;
+as demais aguardam o mesmo resultado. Erros também são entregues a todos que aguardavam.
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Executa no máximo uma chamada por chave ao mesmo tempo e compartilha o resultado."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0}
+        self._in_flight: "dict[Hashable, asyncio.Task]" = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """
+        Retorna o resultado de `fn()`, reaproveitando a chamada em andamento para a mesma chave.
+        A chamada roda em uma tarefa própria: se quem a iniciou for cancelado (cliente
+        desconectou), os demais continuam aguardando o mesmo resultado.
+        """
+        self.stats["calls"] += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats["upstream_calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def running(self, key: Hashable) -> bool:
+        """Se há uma chamada em andamento para a chave (quem chamar `do` agora vai aguardá-la)."""
+        return key in self._in_flight
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # Marca a exceção como lida mesmo se todos os interessados tiverem desistido
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._in_flight)}
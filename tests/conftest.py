@@ -0,0 +1,21 @@
+"""
+Configuração comum dos testes.
+
+Coloca a raiz do projeto e benchmarks/ (stubs e fixtures de rotas) no caminho de importação e
+desliga os arquivos em disco (caches SQLite, spool, TTS) antes de qualquer import de `main`.
+
+Uso:
+    python -m pytest -q
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+sys.path.insert(0, ROOT_DIR)
+
+for name, value in {"GEOCODE_CACHE_PATH": "", "REFINEMENT_CACHE_PATH": "", "ROUTE_CACHE_BACKEND": "memory",
+                    "SHARE_SPOOL_PATH": "", "TTS_ENGINE": "", "USE_GEMINI_FOR_REFINEMENT": "false",
+                    "LOG_LEVEL": "WARNING"}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,59 @@
+"""Cache e normalização dos destinos (geocoding.py)."""
+import asyncio
+
+import pytest
+
+from geocoding import GeocodeCache, ResolvedPlace, normalize_destination
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "geocode.sqlite3")
+
+    async def run():
+        first = GeocodeCache(path=path)
+        first.put("0:0|av paulista", ResolvedPlace("place-1", -23.56, -46.65, "Av. Paulista"))
+        await first.close()
+
+        second = GeocodeCache(path=path)
+        try:
+            place = await second.get("0:0|av paulista")
+            assert await second.get("0:0|outro destino") is None
+        finally:
+            await second.close()
+        return place, second.stats
+
+    place, stats = asyncio.run(run())
+    assert place.place_id == "place-1"
+    assert stats["disk_hits"] == 1 and stats["misses"] == 1
+
+
+def test_memory_hit_does_not_touch_disk(tmp_path):
+    async def run():
+        cache = GeocodeCache(path=str(tmp_path / "geocode.sqlite3"))
+        cache.put("0:0|praca", ResolvedPlace(None, -23.55, -46.63))
+        try:
+            return await cache.get("0:0|praca"), cache.stats
+        finally:
+            await cache.close()
+
+    place, stats = asyncio.run(run())
+    assert place.latitude == -23.55
+    assert stats["hits"] == 1 and stats["disk_hits"] == 0
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Iniciar navegação para Avenida Paulista, nº 1000", "av paulista 1000"),
+    ("Me leve até a Praça da Sé", "pca da se"),
+    ("quero ir ao Hospital das Clínicas", "hosp das clinicas"),
+    ("Pará de Minas", "para de minas"),
+    ("navegar para Pará de Minas", "para de minas"),
+    ("O Boticário", "o boticario"),
+    ("Rua N, 5", "r n 5"),
+])
+def test_normalize_destination(text, expected):
+    assert normalize_destination(text) == expected
+
+
+def test_destination_words_are_not_dropped():
+    assert normalize_destination("Pará de Minas") != normalize_destination("de Minas")
+    assert normalize_destination("Estação No") != normalize_destination("Estação")
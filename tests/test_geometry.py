@@ -0,0 +1,24 @@
+"""Codificação das polylines do Google (geometry.py)."""
+import numpy as np
+import pytest
+
+from geometry import decode_polyline, encode_polyline
+
+# Exemplo da documentação do Encoded Polyline Algorithm Format
+EXAMPLE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+EXAMPLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def test_decodes_documented_example():
+    assert np.allclose(decode_polyline(EXAMPLE), EXAMPLE_POINTS)
+
+
+def test_round_trip():
+    assert encode_polyline(decode_polyline(EXAMPLE)) == EXAMPLE
+    assert decode_polyline("").shape == (0, 2)
+
+
+@pytest.mark.parametrize("encoded", ["_", "abc", "_p~iF", EXAMPLE[:-1], "_p~iF ~ps|U", "_p~iF~ps|Ué"])
+def test_malformed_polyline_raises_value_error(encoded):
+    with pytest.raises(ValueError, match="Polyline inválida"):
+        decode_polyline(encoded)
@@ -0,0 +1,75 @@
+"""Protocolo da navegação ao vivo por WebSocket (live.py)."""
+import json
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import WebSocketRoute
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketState
+
+from live import LiveNavigationConnection
+
+INVALID_MESSAGES = [
+    "{",
+    "[]",
+    '"x"',
+    json.dumps({"type": "voar"}),
+    json.dumps({"type": "start"}),
+    json.dumps({"type": "start", "destination": "Destino", "session_id": 7}),
+    json.dumps({"type": "fix", "latitude": "abc", "longitude": -46.63}),
+    json.dumps({"type": "fix", "latitude": -23.55}),
+    json.dumps({"type": "fix", "latitude": True, "longitude": -46.63}),
+    json.dumps({"type": "fix", "latitude": 123.0, "longitude": -46.63}),
+    '{"type": "fix", "latitude": NaN, "longitude": -46.63}',
+]
+
+
+async def fake_update(latitude, longitude, destination, session_id, route_version):
+    """Resposta de navegação mínima: rota nova na primeira localização."""
+    return {"sessionId": "sessao", "routeVersion": "v1", "progress": {"currentStep": 0, "distanceToNextManeuver": 80}}
+
+
+@pytest.fixture
+def client():
+    async def endpoint(websocket):
+        await LiveNavigationConnection(websocket, fake_update).run()
+        if websocket.application_state == WebSocketState.CONNECTED:
+            await websocket.close() # Como o uvicorn faz quando o endpoint retorna: o teste falha em vez de esperar
+
+    with TestClient(Starlette(routes=[WebSocketRoute("/navigate/ws", endpoint)])) as client:
+        yield client
+
+
+def start_navigation(ws):
+    ws.send_text(json.dumps({"type": "start", "destination": "Destino"}))
+    ws.send_text(json.dumps({"type": "fix", "latitude": -23.55, "longitude": -46.63}))
+    return ws.receive_json()
+
+
+def test_fix_returns_route(client):
+    with client.websocket_connect("/navigate/ws") as ws:
+        message = start_navigation(ws)
+    assert message["type"] == "route"
+    assert message["sessionId"] == "sessao"
+
+
+@pytest.mark.parametrize("raw", INVALID_MESSAGES)
+def test_invalid_message_is_answered_and_connection_continues(client, raw):
+    with client.websocket_connect("/navigate/ws") as ws:
+        ws.send_text(raw)
+        assert ws.receive_json()["type"] == "error"
+        assert start_navigation(ws)["type"] == "route"
+
+
+def test_binary_frame_is_answered_and_connection_continues(client):
+    with client.websocket_connect("/navigate/ws") as ws:
+        ws.send_bytes(b"\x00\x01")
+        assert ws.receive_json()["type"] == "error"
+        assert start_navigation(ws)["type"] == "route"
+
+
+def test_fix_before_start_is_answered(client):
+    with client.websocket_connect("/navigate/ws") as ws:
+        ws.send_text(json.dumps({"type": "fix", "latitude": -23.55, "longitude": -46.63}))
+        assert ws.receive_json()["type"] == "error"
+        assert start_navigation(ws)["type"] == "route"
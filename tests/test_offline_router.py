@@ -0,0 +1,56 @@
+"""Passos e manobras das rotas do roteador offline (offline_router.py)."""
+import math
+
+import numpy as np
+
+from geometry import METERS_PER_DEGREE
+from offline_router import UNNAMED_WAY, OfflineRouter, PedestrianGraph
+
+ORIGIN = (-23.5505, -46.6333)
+
+
+def offset(east: float, north: float) -> tuple:
+    """Ponto deslocado da origem em metros."""
+    return (ORIGIN[0] + north / METERS_PER_DEGREE,
+            ORIGIN[1] + east / (METERS_PER_DEGREE * math.cos(math.radians(ORIGIN[0]))))
+
+
+def router_for(points: list, names: list, name_table: list) -> OfflineRouter:
+    """Roteador sobre um caminho único que liga `points` em ordem (a aresta i tem o nome names[i])."""
+    graph = PedestrianGraph(np.array(points), np.arange(len(points) - 1), np.arange(1, len(points)),
+                            np.array(names), name_table)
+    return OfflineRouter(graph, landmark_count=0)
+
+
+def steps_between(router: OfflineRouter, origin: tuple, destination: tuple) -> list:
+    routes = router.directions(f"{origin[0]},{origin[1]}", f"{destination[0]},{destination[1]}")
+    return routes[0]["legs"][0]["steps"]
+
+
+def test_zigzag_on_unnamed_ways_has_one_step_per_turn():
+    points = [offset(0, 0), offset(0, 100), offset(100, 100), offset(100, 200)] # Norte, leste, norte
+    router = router_for(points, [0, 0, 0], [UNNAMED_WAY])
+    steps = steps_between(router, points[0], points[-1])
+    assert [step.get("maneuver") for step in steps] == [None, "turn-right", "turn-left"]
+    assert [step["distance"]["value"] for step in steps] == [100, 100, 100]
+
+
+def test_turn_on_the_same_street_starts_a_step():
+    points = [offset(0, 0), offset(0, 100), offset(100, 100)]
+    router = router_for(points, [0, 0], ["R. Teste"])
+    steps = steps_between(router, points[0], points[-1])
+    assert [step.get("maneuver") for step in steps] == [None, "turn-right"]
+    assert "R. Teste" in steps[1]["html_instructions"]
+
+
+def test_gentle_bend_on_the_same_street_stays_one_step():
+    points = [offset(0, 0), offset(0, 100), offset(20, 200)] # Cerca de 11 graus para a direita
+    router = router_for(points, [0, 0], ["R. Teste"])
+    assert len(steps_between(router, points[0], points[-1])) == 1
+
+
+def test_street_change_without_turn_starts_a_step():
+    points = [offset(0, 0), offset(0, 100), offset(0, 200)]
+    router = router_for(points, [0, 1], ["R. Um", "R. Dois"])
+    steps = steps_between(router, points[0], points[-1])
+    assert [step.get("maneuver") for step in steps] == [None, "straight"]
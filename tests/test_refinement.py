@@ -0,0 +1,75 @@
+"""Refinamento das instruções em segundo plano (refinement.py), com o Gemini falso de benchmarks/stubs.py."""
+import asyncio
+
+from refinement import InstructionRefiner, RefinementCache
+from stubs import FakeRefinementModel
+
+INSTRUCTIONS = "1. Siga para o leste na R. Stub por 200 m.\n2. Vire à esquerda na Av. Benchmark."
+
+
+async def final_text(refiner: InstructionRefiner, key: str) -> tuple:
+    async for event, data in await refiner.events(key):
+        if event == "done":
+            return data["text"], data["refined"]
+
+
+def test_refined_text_is_read_from_disk_after_restart(tmp_path):
+    path = str(tmp_path / "refinement.sqlite3")
+
+    async def run():
+        first = InstructionRefiner(FakeRefinementModel(0, 0), RefinementCache(path=path))
+        text, refined = await final_text(first, first.submit(INSTRUCTIONS))
+        assert refined
+        await first.cache.close()
+
+        model = FakeRefinementModel(0, 0)
+        second = InstructionRefiner(model, RefinementCache(path=path))
+        try:
+            assert await final_text(second, second.submit(INSTRUCTIONS)) == (text, True)
+        finally:
+            await second.cache.close()
+        return model.calls, second.cache.stats
+
+    calls, stats = asyncio.run(run())
+    assert calls == 0
+    assert stats["disk_hits"] == 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_failing_model_is_not_called_for_every_route():
+    clock = FakeClock()
+    model = FakeRefinementModel(0, 0, fail=True)
+    refiner = InstructionRefiner(model, RefinementCache(path=None), retry_seconds=60, max_backoff=600, clock=clock)
+    other = INSTRUCTIONS.replace("200 m", "300 m")
+
+    async def run():
+        assert await final_text(refiner, refiner.submit(INSTRUCTIONS)) == (INSTRUCTIONS, False)
+        assert model.calls == 1
+        # Mesma rota logo depois: a falha fica registrada
+        assert await final_text(refiner, refiner.submit(INSTRUCTIONS)) == (INSTRUCTIONS, False)
+        # Rota nova com o modelo em pausa: texto original, sem chamar o modelo
+        assert await final_text(refiner, refiner.submit(other)) == (other, False)
+        assert model.calls == 1
+
+        clock.now += 61 # Fim da primeira pausa (60 s): tenta de novo e falha, pausa dobra
+        await final_text(refiner, refiner.submit(other))
+        assert model.calls == 2
+        clock.now += 61
+        await final_text(refiner, refiner.submit(INSTRUCTIONS))
+        assert model.calls == 2 # Ainda dentro da segunda pausa (120 s)
+
+        model.fail = False
+        clock.now += 60
+        assert await final_text(refiner, refiner.submit(INSTRUCTIONS)) != (INSTRUCTIONS, False)
+        assert model.calls == 3
+
+    asyncio.run(run())
+    assert refiner.stats["recent_failures"] == 1
+    assert refiner.stats["paused"] == 2
@@ -0,0 +1,39 @@
+"""Acompanhamento da rota nas sessões de navegação (sessions.py)."""
+import math
+
+import numpy as np
+import pytest
+
+from load_test import Walk, load_fixtures
+from route_model import Route
+from sessions import NavigationSession
+
+FIXTURES = load_fixtures()
+
+
+@pytest.fixture(params=sorted(FIXTURES), ids=str)
+def fixture(request):
+    return FIXTURES[request.param]
+
+
+def test_arrives_at_route_end(fixture):
+    route = Route.from_directions(fixture["route"])
+    session = NavigationSession("teste", fixture["destination"], route, "", None)
+    latitude, longitude = (float(value) for value in route.coordinates()[-1])
+    assert session.track(latitude, longitude).arrived
+
+
+def test_beside_route_end_is_not_arrival(fixture):
+    """300 m ao lado do fim da rota (do outro lado do quarteirão) não é chegada: está fora da rota."""
+    route = Route.from_directions(fixture["route"])
+    session = NavigationSession("teste", fixture["destination"], route, "", None)
+    latitude, longitude = (float(value) for value in route.coordinates()[-1])
+    walk = Walk(fixture)
+    # Direção dos últimos 30 m da rota, sem ruído
+    before = [float(np.interp(walk.length - 30, walk.cumulative, walk.path[:, axis])) for axis in (0, 1)]
+    east, north = (longitude - before[1]) * walk.scale[1], (latitude - before[0]) * walk.scale[0]
+    norm = math.hypot(east, north)
+    side = (latitude + 300 * east / norm / walk.scale[0], longitude - 300 * north / norm / walk.scale[1])
+    progress = session.track(*side)
+    assert not progress.arrived
+    assert progress.off_route
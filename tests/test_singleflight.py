@@ -0,0 +1,115 @@
+"""Agrupamento de requisições idênticas (singleflight.py) e seu uso em get_google_directions."""
+import asyncio
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+REQUESTS = 1000
+
+
+class CountingFetch:
+    """Chamada "upstream" falsa que conta quantas vezes foi executada."""
+
+    def __init__(self, latency: float = 0.05, error: Exception = None):
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error:
+            raise self.error
+        return {"call": self.calls}
+
+
+def test_concurrent_identical_calls_make_one_upstream_call():
+    flight, fetch = SingleFlight("teste"), CountingFetch()
+
+    async def run():
+        return await asyncio.gather(*(flight.do("rota", fetch) for _ in range(REQUESTS)))
+
+    results = asyncio.run(run())
+    assert fetch.calls == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats == {"calls": REQUESTS, "upstream_calls": 1, "coalesced": REQUESTS - 1}
+    assert not flight.running("rota")
+
+
+def test_error_reaches_every_waiter():
+    error = RuntimeError("falha simulada do provedor")
+    flight, fetch = SingleFlight("teste"), CountingFetch(error=error)
+
+    async def run():
+        return await asyncio.gather(*(flight.do("rota", fetch) for _ in range(REQUESTS)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert fetch.calls == 1
+    assert all(result is error for result in results)
+
+
+def test_key_is_freed_after_failure():
+    flight, failing = SingleFlight("teste"), CountingFetch(error=RuntimeError("falha"))
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await flight.do("rota", failing)
+        assert not flight.running("rota")
+        succeeding = CountingFetch()
+        assert await flight.do("rota", succeeding) == {"call": 1} # Nova chamada, não o erro anterior
+        assert succeeding.calls == 1
+
+    asyncio.run(run())
+    assert flight.snapshot()["in_flight"] == 0
+
+
+class CountingMapsClient:
+    """Cliente Google Maps falso (síncrono, como o googlemaps) que conta as chamadas."""
+
+    def __init__(self, route: dict, latency: float = 0.05):
+        self.route = route
+        self.latency = latency
+        self.directions_calls = 0
+        self.geocode_calls = 0
+
+    def directions(self, **kwargs):
+        self.directions_calls += 1
+        time.sleep(self.latency)
+        return [self.route]
+
+    def geocode(self, address, **kwargs):
+        self.geocode_calls += 1
+        time.sleep(self.latency)
+        return [{"place_id": "stub-place", "geometry": {"location": {"lat": -23.55, "lng": -46.63}}}]
+
+
+def test_concurrent_directions_requests_reach_google_once():
+    import main
+    from geocoding import GeocodeCache, Geocoder
+    from providers import GoogleDirectionsProvider
+    from route_cache import InMemoryRouteCacheBackend, RouteCache
+    from routing import RoutingPool
+    from stubs import synthetic_route
+
+    client = CountingMapsClient(synthetic_route(-23.5612, -46.6559))
+    main.initialize_providers() # Antes de trocar o provedor: a primeira chamada não pode sobrescrevê-lo
+    main.directions_provider = GoogleDirectionsProvider(client, max_concurrency=REQUESTS)
+    main.geocoder = Geocoder(main.directions_provider, GeocodeCache(path=None))
+    main.routing_pool = RoutingPool.from_providers({"google": main.directions_provider}, order=["google"])
+    main.route_cache = RouteCache(InMemoryRouteCacheBackend())
+    main.directions_flight = SingleFlight("directions")
+
+    async def run():
+        return await asyncio.gather(*(main.get_google_directions(-23.5612, -46.6559, "Hospital das Clínicas")
+                                      for _ in range(REQUESTS)))
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        main.directions_provider.shutdown()
+    assert results[0] is not None
+    assert all(result is results[0] for result in results)
+    assert client.directions_calls == 1
+    assert client.geocode_calls == 1
@@ -0,0 +1,314 @@
+"""
+Áudio das instruções sintetizado no servidor (TTS), com cache em disco endereçado por conteúdo.
+
+A fala feita no aparelho (`speakText` no script.js) varia muito de qualidade e de tempo até
+começar a falar nos celulares mais simples. Aqui:
+
+- as instruções de `process_google_directions_response` são divididas em frases (uma por linha:
+  introdução, cada passo e a chegada);
+- cada frase é sintetizada por um motor plugável (Google Cloud Text-to-Speech ou espeak-ng,
+  local e offline) e gravada em disco com o hash do conteúdo (motor + voz + texto) como nome,
+  então a mesma frase nunca é sintetizada duas vezes; o cache tem tamanho máximo e descarta os
+  arquivos usados há mais tempo;
+- assim que a rota é planejada, o áudio dos próximos passos é sintetizado em segundo plano: quando
+  o cliente pede GET /tts/{audioId} o arquivo normalmente já existe, e sai com suporte a Range e
+  cabeçalhos de cache longos (o conteúdo de um id nunca muda). As sínteses saem de uma fila por
+  prioridade: a frase que um cliente está pedindo agora passa na frente, e entre as pré-calculadas
+  as primeiras de cada rota vêm antes das últimas.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TTS_ENGINE = os.getenv("TTS_ENGINE", "auto") # google, espeak, auto (o primeiro disponível) ou vazio para desativar
+TTS_VOICE = os.getenv("TTS_VOICE", "pt-BR-Wavenet-A") # Voz do Google Cloud Text-to-Speech
+TTS_ESPEAK_VOICE = os.getenv("TTS_ESPEAK_VOICE", "pt-br")
+TTS_SPEAKING_RATE = float(os.getenv("TTS_SPEAKING_RATE", "1.0")) # 1.0 = velocidade normal
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "200")) # Acima disso os áudios usados há mais tempo são apagados
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4")) # Sínteses simultâneas
+TTS_PRECOMPUTE_PHRASES = int(os.getenv("TTS_PRECOMPUTE_PHRASES", "30")) # Frases da rota sintetizadas assim que ela é planejada
+TTS_LANGUAGE = "pt-BR"
+TTS_MAX_PHRASE_CHARS = 500 # Frases maiores ficam só com a fala do aparelho
+_KNOWN_PHRASES = 20000 # Textos de frases já planejadas, para sintetizar sob demanda se ainda não estiverem no cache
+_IN_USE_SECONDS = 10 # Arquivos usados há menos tempo que isso não são apagados (podem estar sendo enviados)
+_PHRASE_SPACING_SECONDS = 5 # Para a prioridade, a frase i de uma rota é considerada necessária daqui a i * 5 s
+CACHE_CONTROL = "public, max-age=31536000, immutable" # O áudio de um id nunca muda
+
+MEDIA_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav", "ogg": "audio/ogg"}
+
+
+def split_phrases(instructions_text: str) -> List[str]:
+    """Unidades de fala: uma por linha das instruções (na mesma ordem usada pelo frontend)."""
+    return [line.strip() for line in instructions_text.splitlines()]
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES.get(path.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+class GoogleCloudTTSEngine:
+    """Google Cloud Text-to-Speech (MP3). Usa as credenciais padrão do Google Cloud (GOOGLE_APPLICATION_CREDENTIALS)."""
+
+    extension = "mp3"
+
+    def __init__(self, voice: str = TTS_VOICE, language: str = TTS_LANGUAGE, speaking_rate: float = TTS_SPEAKING_RATE):
+        from google.cloud import texttospeech # Dependência opcional: só é importada se este motor for usado
+
+        self._tts = texttospeech
+        self.client = texttospeech.TextToSpeechClient()
+        self.voice = texttospeech.VoiceSelectionParams(language_code=language, name=voice)
+        self.audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3,
+                                                     speaking_rate=speaking_rate)
+        self.identity = f"google:{voice}:{speaking_rate}"
+
+    def synthesize(self, text: str) -> bytes:
+        response = self.client.synthesize_speech(input=self._tts.SynthesisInput(text=text),
+                                                 voice=self.voice, audio_config=self.audio_config)
+        return response.audio_content
+
+
+class EspeakEngine:
+    """espeak-ng local (WAV): funciona offline, sem cota nem credenciais."""
+
+    extension = "wav"
+
+    def __init__(self, voice: str = TTS_ESPEAK_VOICE, speaking_rate: float = TTS_SPEAKING_RATE):
+        self.executable = shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise RuntimeError("espeak-ng não encontrado no PATH")
+        self.voice = voice
+        self.words_per_minute = int(175 * speaking_rate)
+        self.identity = f"espeak:{voice}:{self.words_per_minute}"
+
+    def synthesize(self, text: str) -> bytes:
+        result = subprocess.run([self.executable, "-v", self.voice, "-s", str(self.words_per_minute), "--stdout", text],
+                                capture_output=True, check=True, timeout=30)
+        return result.stdout
+
+
+ENGINES = {"google": GoogleCloudTTSEngine, "espeak": EspeakEngine}
+
+
+def create_tts_engine(name: str = TTS_ENGINE):
+    """Cria o motor configurado; "auto" tenta o Google e depois o espeak-ng. None se nenhum estiver disponível."""
+    candidates = list(ENGINES) if name == "auto" else [name] if name else []
+    for candidate in candidates:
+        try:
+            engine = ENGINES[candidate]()
+            logger.info("Motor de TTS do servidor: %s.", candidate)
+            return engine
+        except Exception as e:
+            logger.warning("Motor de TTS '%s' indisponível: %s", candidate, e)
+    logger.info("TTS no servidor desativado; o frontend usa a fala do aparelho.")
+    return None
+
+
+class AudioCache:
+    """
+    Arquivos de áudio em disco, nomeados pela chave de conteúdo, com limite de tamanho total.
+    A ordem de uso fica em memória (e na data de modificação dos arquivos, para sobreviver a reinícios).
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = int(TTS_CACHE_MAX_MB * 1024 * 1024),
+                 in_use_seconds: float = _IN_USE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.in_use_seconds = in_use_seconds
+        self.total_bytes = 0
+        self._files: "OrderedDict[str, tuple]" = OrderedDict() # chave -> (caminho, bytes, último uso), do menos para o mais recente
+        self._lock = threading.Lock() # Gravações acontecem nas threads de síntese
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                info = os.stat(path)
+                found.append((info.st_mtime, name.split(".", 1)[0], path, info.st_size))
+        for _, key, path, size in sorted(found):
+            self._files[key] = (path, size, 0.0)
+            self.total_bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._files[key] = (entry[0], entry[1], time.monotonic())
+            self._files.move_to_end(key)
+            self.stats["hits"] += 1
+        try:
+            os.utime(entry[0])
+        except FileNotFoundError: # Apagado por fora: trata como ausente
+            with self._lock:
+                if self._files.pop(key, None):
+                    self.total_bytes -= entry[1]
+            return None
+        return entry[0]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._files
+
+    def put(self, key: str, data: bytes, extension: str) -> str:
+        """Grava o áudio (escrita atômica) e apaga os mais antigos se o limite for ultrapassado."""
+        path = os.path.join(self.directory, key[:2], f"{key}.{extension}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        with self._lock:
+            previous = self._files.pop(key, None)
+            if previous:
+                self.total_bytes -= previous[1]
+            self._files[key] = (path, len(data), time.monotonic())
+            self.total_bytes += len(data)
+            self.stats["writes"] += 1
+            self._evict()
+        return path
+
+    def _evict(self):
+        in_use = time.monotonic() - self.in_use_seconds
+        while self.total_bytes > self.max_bytes and self._files:
+            key, (path, size, used_at) = next(iter(self._files.items()))
+            if used_at > in_use:
+                break # Até o mais antigo está em uso: o limite é ultrapassado por alguns segundos
+            del self._files[key]
+            self.total_bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "files": len(self._files), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+class SpeechSynthesizer:
+    """Gera os ids de áudio das frases, sintetiza em segundo plano e entrega o arquivo em cache."""
+
+    def __init__(self, engine, cache: AudioCache, workers: int = TTS_WORKERS, precompute: int = TTS_PRECOMPUTE_PHRASES):
+        self.engine = engine
+        self.cache = cache
+        self.workers = workers
+        self.precompute = precompute
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None # (prioridade, ordem, chave); criada com os workers
+        self._pending: "dict[str, asyncio.Future]" = {} # Sínteses na fila ou em andamento
+        self._priority: "dict[str, float]" = {} # Prioridade atual de cada chave pendente (menor sai antes; -inf = em andamento)
+        self._order = itertools.count()
+        self._workers = []
+        self.stats = {"phrases": 0, "precomputed": 0, "requested": 0, "waited": 0, "synthesized": 0, "failures": 0}
+
+    def phrase_id(self, text: str) -> str:
+        """Hash do motor/voz + texto: a mesma frase com a mesma voz tem sempre o mesmo id."""
+        return hashlib.sha256(f"{self.engine.identity}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+    def prepare(self, instructions_text: str) -> List[Optional[str]]:
+        """
+        Retorna o id de áudio de cada linha das instruções (None para linhas vazias ou longas demais)
+        e agenda a síntese das primeiras `precompute` frases que ainda não estão no cache.
+        """
+        ids = []
+        scheduled = 0
+        now = time.monotonic()
+        for index, text in enumerate(split_phrases(instructions_text)):
+            if not text or len(text) > TTS_MAX_PHRASE_CHARS:
+                ids.append(None)
+                continue
+            key = self.phrase_id(text)
+            ids.append(key)
+            self.stats["phrases"] += 1
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            if key not in self.cache and scheduled < self.precompute:
+                scheduled += 1
+                self.stats["precomputed"] += 1
+                self._request(key, now + index * _PHRASE_SPACING_SECONDS)
+        while len(self._texts) > _KNOWN_PHRASES:
+            self._texts.popitem(last=False)
+        return ids
+
+    async def audio(self, key: str) -> Optional[str]:
+        """Caminho do arquivo de áudio; sintetiza na hora se a frase for conhecida e ainda não estiver pronta."""
+        path = self.cache.get(key)
+        if path is not None or key not in self._texts:
+            return path
+        self.stats["waited"] += 1
+        # Pedido do cliente: passa na frente das frases pré-calculadas (ou aproveita a que já está em andamento)
+        return await asyncio.shield(self._request(key, time.monotonic() - _PHRASE_SPACING_SECONDS))
+
+    def _request(self, key: str, priority: float) -> asyncio.Future:
+        """Põe a chave na fila (ou sobe sua prioridade) e retorna o futuro com o caminho do arquivo."""
+        self._ensure_started()
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda done: done.cancelled() or done.exception()) # Erro de pré-cálculo sem ninguém esperando
+            self.stats["requested"] += 1
+        if priority < self._priority.get(key, float("inf")):
+            self._priority[key] = priority
+            self._queue.put_nowait((priority, next(self._order), key)) # A entrada antiga fica obsoleta
+        return future
+
+    def _ensure_started(self):
+        if not self._workers:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, key = await self._queue.get()
+            if self._priority.get(key) != priority:
+                continue # Já sintetizada, ou reenfileirada com prioridade maior
+            self._priority[key] = float("-inf")
+            future = self._pending[key]
+            try:
+                path = self.cache.get(key)
+                if path is None:
+                    path = await loop.run_in_executor(self._executor, self._synthesize_blocking, key, self._texts[key])
+                    self.stats["synthesized"] += 1
+                future.set_result(path)
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.error("Erro ao sintetizar áudio da instrução: %s", e)
+                future.set_exception(e)
+            finally:
+                del self._pending[key]
+                del self._priority[key]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _synthesize_blocking(self, key: str, text: str) -> str:
+        return self.cache.put(key, self.engine.synthesize(text), self.engine.extension)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "engine": self.engine.identity, "pending": len(self._pending),
+                "cache": self.cache.snapshot()}